@@ -0,0 +1,127 @@
+"""Frames per second of ROI tracking against full frame detection, on the CPU. Runs in any Python with mediapipe and
+cv2 installed (Blender isn't needed), and the models downloaded to data/models:
+
+    python benchmarks/roi_tracking.py capture.mp4 --model face --frames 300 --output roi.json
+
+The frames are decoded before timing, so only inference is measured. Three modes are timed on the same frames:
+
+    full        detect_landmarks on every full resolution frame in IMAGE mode, what each VideoLandmarkPipeline worker does
+    full_video  the same in VIDEO mode, which lets MediaPipe track between frames itself (LiveLandmarkStream without tracking)
+    roi         RoiTracker
+
+MediaPipe's Python tasks run on the CPU delegate unless told otherwise, so nothing needs turning off to match a capture
+station without a GPU. Tracked landmarks are compared with the full mode's, in pixels.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy
+
+import mediapipe_toolbox_inference as inference
+
+
+def read_frames(video_path, count):
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise IOError('Could not open video %s' % video_path)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    frames = []
+    while len(frames) < count:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames, fps
+
+
+def time_frames(frames, run):
+    """(landmarks, per frame ms) of run(frame_index, frame) over every frame"""
+    landmarks = numpy.empty((len(frames),) + run(0, frames[0]).shape, dtype=numpy.float32) # First frame is warm up
+    times = []
+    for index, frame in enumerate(frames):
+        started = time.perf_counter()
+        landmarks[index] = run(index, frame)
+        times.append((time.perf_counter() - started) * 1000)
+    return landmarks, times
+
+
+def summarize(times):
+    ordered = sorted(times)
+    return {
+        'fps': 1000.0 * len(times) / sum(times),
+        'ms_median': statistics.median(times),
+        'ms_p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+    }
+
+
+def agreement(landmarks, reference, width, height):
+    """How often both found the landmarks, and how far apart they were in pixels when they did"""
+    found = ~numpy.isnan(landmarks[:, :, 0])
+    reference_found = ~numpy.isnan(reference[:, :, 0])
+    both = found & reference_found
+    result = {
+        'found_frames': int(found.any(axis=1).sum()),
+        'reference_found_frames': int(reference_found.any(axis=1).sum()),
+    }
+    if both.any():
+        offsets = (landmarks[both][:, :2] - reference[both][:, :2]) * (width, height)
+        distances = numpy.linalg.norm(offsets, axis=1)
+        result.update({'px_mean': float(distances.mean()), 'px_p95': float(numpy.percentile(distances, 95))})
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare ROI tracking with full frame landmark detection on the CPU')
+    parser.add_argument('video')
+    parser.add_argument('--model', default='face', choices=list(inference.LANDMARK_COUNTS.keys()))
+    parser.add_argument('--frames', type=int, default=300, help='Frames from the start of the video to run on')
+    parser.add_argument('--input-size', type=int, default=256, help='RoiTracker crop size')
+    parser.add_argument('--detection-size', type=int, default=640, help='RoiTracker full frame search size')
+    parser.add_argument('--output', default=None, help='Also write the results to this json file')
+    args = parser.parse_args(argv)
+
+    frames, fps = read_frames(args.video, args.frames)
+    if not frames:
+        print('No frames in %s' % args.video)
+        return 1
+    height, width = frames[0].shape[:2]
+    frame_ms = 1000.0 / fps
+    results = {'video': os.path.abspath(args.video), 'model': args.model, 'frames': len(frames), 'resolution': [width, height], 'modes': {}}
+
+    landmarker = inference.create_landmarker(args.model)
+    full, times = time_frames(frames, lambda index, frame: inference.detect_landmarks(landmarker, args.model, frame))
+    landmarker.close()
+    results['modes']['full'] = summarize(times)
+
+    # Timestamps continue after the warm up frame, VIDEO mode needs them to keep increasing
+    landmarker = inference.create_landmarker(args.model, {'running_mode': inference.vision.RunningMode.VIDEO})
+    runs = iter(range(len(frames) + 1))
+    landmarks, times = time_frames(frames, lambda index, frame: inference.detect_landmarks(landmarker, args.model, frame, timestamp_ms=int(next(runs) * frame_ms)))
+    landmarker.close()
+    results['modes']['full_video'] = dict(summarize(times), **agreement(landmarks, full, width, height))
+
+    tracker = inference.RoiTracker(args.model, input_size=args.input_size, detection_size=args.detection_size, fps=fps)
+    landmarks, times = time_frames(frames, lambda index, frame: tracker.track(frame))
+    tracker.close()
+    results['modes']['roi'] = dict(summarize(times), detections=tracker.stats['detections'], **agreement(landmarks, full, width, height))
+
+    for mode, result in results['modes'].items():
+        print('%-11s %7.1f fps  %7.1f ms median  %7.1f ms p95' % (mode, result['fps'], result['ms_median'], result['ms_p95']))
+    roi = results['modes']['roi']
+    print('roi searched the whole frame %s times in %s frames, %.1fx the fps of full' % (roi['detections'], len(frames) + 1, roi['fps'] / results['modes']['full']['fps']))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,331 @@
+"""Benchmark suite for the add-on's operators and config loading. Runs inside Blender (or with the bpy module):
+
+    blender --background --factory-startup --python benchmarks/run_suite.py -- --output results.json
+    blender --background --factory-startup --python benchmarks/run_suite.py -- --output new.json --baseline results.json
+
+All the inputs are generated, so nothing needs to be downloaded: a 468 vertex facemesh, 831 vertex hands, two eyes,
+the 159 bone Rigify metarig, and scenes padded with thousands of unrelated objects (--scene-sizes). The operators are
+timed in each scene size, and mapping compilation is timed cold and warm on mapping files scaled up by --mapping-scales.
+
+With --baseline the medians are compared against an earlier results file, and the run fails (exit code 1) if any
+benchmark got slower by more than --tolerance. Two results files can also be compared without Blender:
+
+    python benchmarks/run_suite.py --compare new.json results.json
+
+The live webcam operator is timed per frame (LivePoseSolver on synthetic landmarks) since there's no camera to read.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+mapping_files = {
+    'facemesh': 'data/facemesh_rigify_mapping.json',
+    'hands': 'data/hand_rigify_mapping.json',
+}
+
+
+def time_call(run, repeat, warmup=1, setup=None):
+    """Median/min/max wall time of run() in ms. setup() runs untimed before every call"""
+    times = []
+    for index in range(warmup + repeat):
+        if setup is not None:
+            setup()
+        gc.collect()
+        started = time.perf_counter()
+        run()
+        elapsed = (time.perf_counter() - started) * 1000
+        if index >= warmup:
+            times.append(elapsed)
+    return {'median_ms': statistics.median(times), 'min_ms': min(times), 'max_ms': max(times), 'repeat': repeat}
+
+
+# Synthetic inputs
+
+def tube_geometry(vertex_count, columns, radius, height, seed):
+    """Vertices and triangles of an open tube with exactly vertex_count vertices (the last ring may be partial).
+
+    The rings wrap around, so there are enough edges for the facemesh's eye_edges indices, and the vertices are
+    jittered so no two mapping groups average to the same point (which would make zero length bones).
+    """
+    import numpy
+    rows = -(-vertex_count // columns)
+    random = numpy.random.RandomState(seed)
+    index = numpy.arange(vertex_count)
+    angle = (index % columns) * (2 * numpy.pi / columns)
+    z = (index // columns) * (height / max(rows - 1, 1))
+    verts = numpy.stack([numpy.cos(angle) * radius, numpy.sin(angle) * radius, z], axis=1)
+    verts += random.uniform(-0.1, 0.1, verts.shape) * (radius / columns)
+    faces = []
+    for row in range(rows - 1):
+        for column in range(columns):
+            a = row * columns + column
+            b = row * columns + (column + 1) % columns
+            c, d = a + columns, b + columns
+            for face in [(a, b, d), (a, d, c)]:
+                if max(face) < vertex_count:
+                    faces.append(face)
+    return verts.tolist(), faces
+
+
+def add_mesh_object(name, verts, faces):
+    import bpy
+    mesh = bpy.data.meshes.new(name)
+    mesh.from_pydata(verts, [], faces)
+    mesh.update()
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.scene.collection.objects.link(obj)
+    return obj
+
+
+def add_eye(name, location):
+    import bmesh
+    import bpy
+    mesh = bpy.data.meshes.new(name)
+    bm = bmesh.new()
+    bmesh.ops.create_icosphere(bm, subdivisions=2, radius=0.012)
+    bm.to_mesh(mesh)
+    bm.free()
+    obj = bpy.data.objects.new(name, mesh)
+    obj.location = location
+    bpy.context.scene.collection.objects.link(obj)
+    return obj
+
+
+def pad_scene(object_count):
+    """Fill the scene with object_count objects the add-on has no business with, half empties and half meshes"""
+    import bpy
+    collection = bpy.data.collections.new('Padding')
+    bpy.context.scene.collection.children.link(collection)
+    cube = bpy.data.meshes.new('PaddingCube')
+    cube.from_pydata([(x, y, z) for x in (0, 1) for y in (0, 1) for z in (0, 1)], [], [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)])
+    for index in range(object_count):
+        obj = bpy.data.objects.new('Padding.%05d' % index, cube if index % 2 else None)
+        obj.location = (index % 100, index // 100, -5)
+        collection.objects.link(obj)
+
+
+def build_scene(object_count):
+    """A fresh file with the rig, facemesh, eyes and hands assigned, padded with object_count other objects"""
+    import bpy
+    import mediapipe_toolbox
+    bpy.ops.wm.read_homefile(use_empty=True)
+    scene = bpy.context.scene
+    geometry = {
+        'FaceMesh': tube_geometry(468, 26, radius=0.08, height=0.22, seed=0),
+        'Hand.L': tube_geometry(831, 24, radius=0.03, height=0.18, seed=1),
+        'Hand.R': tube_geometry(831, 24, radius=0.03, height=0.18, seed=2),
+    }
+    facemesh_obj = add_mesh_object('FaceMesh', *geometry['FaceMesh'])
+    facemesh_obj.location = (0, -0.05, 1.55)
+    hand_objs = {}
+    for side, x in [('L', 0.7), ('R', -0.7)]:
+        hand_objs[side] = add_mesh_object('Hand.%s' % side, *geometry['Hand.%s' % side])
+        hand_objs[side].location = (x, 0, 1.3)
+    scene.mp_facemesh = facemesh_obj.data
+    scene.mp_eye_left = add_eye('Eye.L', (0.03, -0.1, 1.68)).data
+    scene.mp_eye_right = add_eye('Eye.R', (-0.03, -0.1, 1.68)).data
+    scene.mp_hand_left = hand_objs['L'].data
+    scene.mp_hand_right = hand_objs['R'].data
+    pad_scene(object_count)
+    run_operator('add_rig_to_scene')
+    rig_obj = mediapipe_toolbox.findObjectByNameAndType(scene.mp_edit_rig.name, 'ARMATURE')
+    if len(rig_obj.data.bones) != 159:
+        raise RuntimeError('Expected the 159 bone metarig, got %s bones' % len(rig_obj.data.bones))
+    bpy.context.view_layer.objects.active = rig_obj # The operators need an active object
+    return geometry
+
+
+def run_operator(name):
+    import bpy
+    outcome = getattr(bpy.ops.mp_tools, name)()
+    if 'FINISHED' not in outcome:
+        raise RuntimeError('mp_tools.%s returned %s' % (name, outcome))
+
+
+def synthetic_landmarks(seed=0):
+    """Stand-in face and hands results, shaped like LiveLandmarkStream.latest()'s"""
+    import numpy
+    random = numpy.random.RandomState(seed)
+    face = random.uniform(0.3, 0.7, (478, 4)).astype(numpy.float32)
+    hands = random.uniform(-0.08, 0.08, (42, 4)).astype(numpy.float32)
+    return {'face': face, 'hands': hands}
+
+
+# Benchmarks
+
+def benchmark_config_loading(scales, repeat, warmup):
+    """Mapping compilation, cold (no cache) and warm (memory-mapped cache), on mapping files duplicated scale times"""
+    import mediapipe_toolbox
+    results = {}
+    temp_dir = tempfile.mkdtemp(prefix='mp_toolbox_bench-')
+    try:
+        for mapping_name, mapping_file in mapping_files.items():
+            with open(os.path.join(repo_dir, mapping_file), 'r') as input_file:
+                config = json.load(input_file)
+            for scale in scales:
+                scaled = {key: {} for key in config if isinstance(config[key], dict)}
+                for copy in range(scale):
+                    suffix = '' if copy == 0 else '.%03d' % copy
+                    for key in scaled:
+                        scaled[key].update({name + suffix: value for name, value in config[key].items()})
+                json_path = os.path.join(temp_dir, '%s_x%s.json' % (mapping_name, scale))
+                with open(json_path, 'w') as output_file:
+                    json.dump(scaled, output_file)
+                cache_root = os.path.join(temp_dir, mediapipe_toolbox.mapping_cache_dir)
+
+                def clear_cache():
+                    shutil.rmtree(cache_root, ignore_errors=True)
+                label = '%s,x%s' % (mapping_name, scale)
+                results['compile_mapping_cold[%s]' % label] = time_call(lambda: mediapipe_toolbox.compile_mapping(json_path), repeat, warmup, setup=clear_cache)
+                results['compile_mapping_warm[%s]' % label] = time_call(lambda: mediapipe_toolbox.compile_mapping(json_path), repeat, warmup)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    results['load_configs'] = time_call(mediapipe_toolbox.load_configs, repeat, warmup)
+    return results
+
+
+def benchmark_operators(object_count, repeat, warmup):
+    import bpy
+    import mediapipe_toolbox
+    geometry = build_scene(object_count)
+    scene = bpy.context.scene
+    label = 'objects=%s' % object_count
+    results = {}
+
+    def restore_facemesh():
+        verts, faces = geometry['FaceMesh']
+        mesh = scene.mp_facemesh
+        mesh.clear_geometry()
+        mesh.from_pydata(verts, [], faces)
+        mesh.update()
+
+    base_rig = scene.mp_edit_rig
+    base_objects = set(bpy.data.objects)
+
+    def remove_added_rigs():
+        for obj in set(bpy.data.objects) - base_objects:
+            armature = obj.data
+            bpy.data.objects.remove(obj)
+            bpy.data.armatures.remove(armature)
+        scene.mp_edit_rig = base_rig
+        bpy.context.view_layer.objects.active = mediapipe_toolbox.findObjectByNameAndType(base_rig.name, 'ARMATURE')
+
+    results['add_rig_to_scene[%s]' % label] = time_call(lambda: run_operator('add_rig_to_scene'), repeat, warmup, setup=remove_added_rigs)
+    remove_added_rigs()
+    results['metarig_to_facemesh[%s]' % label] = time_call(lambda: run_operator('metarig_to_facemesh'), repeat, warmup)
+    results['align_hands_bones[%s]' % label] = time_call(lambda: run_operator('align_hands_bones'), repeat, warmup)
+    results['cutout_facemesh_eyes[%s]' % label] = time_call(lambda: run_operator('cutout_facemesh_eyes'), repeat, warmup, setup=restore_facemesh)
+    results['rip_facemesh_mouth[%s]' % label] = time_call(lambda: run_operator('rip_facemesh_mouth'), repeat, warmup, setup=restore_facemesh)
+    restore_facemesh()
+
+    rig_obj = mediapipe_toolbox.findObjectByNameAndType(base_rig.name, 'ARMATURE')
+    landmarks = synthetic_landmarks()
+    results['live_pose_solver_init[%s]' % label] = time_call(lambda: mediapipe_toolbox.LivePoseSolver(rig_obj), repeat, warmup)
+    solver = mediapipe_toolbox.LivePoseSolver(rig_obj)
+    results['live_pose_frame[%s]' % label] = time_call(lambda: solver.apply_landmarks(landmarks), repeat, warmup)
+    return results
+
+
+# Comparison
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Print current vs baseline medians and return the names of the benchmarks that regressed"""
+    current = results['benchmarks']
+    previous = baseline['benchmarks']
+    regressions = []
+    width = max([len(name) for name in current] + [9])
+    print('%s %12s %12s %8s' % ('benchmark'.ljust(width), 'baseline ms', 'current ms', 'change'))
+    for name in sorted(set(current) | set(previous)):
+        if name not in previous:
+            print('%s %12s %12.3f %8s' % (name.ljust(width), '-', current[name]['median_ms'], 'new'))
+            continue
+        if name not in current:
+            print('%s %12.3f %12s %8s' % (name.ljust(width), previous[name]['median_ms'], '-', 'missing'))
+            continue
+        before = previous[name]['median_ms']
+        after = current[name]['median_ms']
+        change = (after - before) / before if before > 0 else 0.0
+        regressed = change > tolerance and after - before > min_delta_ms
+        if regressed:
+            regressions.append(name)
+        print('%s %12.3f %12.3f %+7.1f%%%s' % (name.ljust(width), before, after, change * 100, '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def run_suite(args):
+    import bpy
+    import addon_utils
+    import numpy
+    sys.path.insert(0, repo_dir)
+    import mediapipe_toolbox
+    addon_utils.enable('rigify', default_set=False)
+    mediapipe_toolbox.register()
+    try:
+        benchmarks = benchmark_config_loading(args.mapping_scales, args.repeat, args.warmup)
+        for object_count in args.scene_sizes:
+            print('Timing operators with %s padding objects' % object_count, flush=True)
+            benchmarks.update(benchmark_operators(object_count, args.repeat, args.warmup))
+    finally:
+        mediapipe_toolbox.unregister()
+    return {
+        'blender': bpy.app.version_string,
+        'numpy': numpy.__version__,
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'repeat': args.repeat,
+        'benchmarks': benchmarks,
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Time the MediaPipe Toolbox operators and config loading on synthetic scenes')
+    parser.add_argument('--output', default=None, help='Write the results to this json file')
+    parser.add_argument('--baseline', default=None, help='Results json to compare against')
+    parser.add_argument('--compare', nargs=2, metavar=('RESULTS', 'BASELINE'), default=None, help='Only compare two results files, no Blender needed')
+    parser.add_argument('--scene-sizes', type=int, nargs='+', default=[0, 1000, 10000], help='Padding objects in each scene')
+    parser.add_argument('--mapping-scales', type=int, nargs='+', default=[1, 10, 100], help='How many copies of each mapping file to compile')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Allowed slowdown as a fraction of the baseline median')
+    parser.add_argument('--min-delta-ms', type=float, default=0.5, help='Slowdowns smaller than this are noise, not regressions')
+    args = parser.parse_args(argv)
+
+    if args.compare is not None:
+        results_path, baseline_path = args.compare
+        with open(results_path, 'r') as input_file:
+            results = json.load(input_file)
+    else:
+        results = run_suite(args)
+        baseline_path = args.baseline
+        if args.output:
+            with open(args.output, 'w') as output_file:
+                json.dump(results, output_file, indent=2)
+        if baseline_path is None:
+            for name, timing in results['benchmarks'].items():
+                print('%s %10.3f ms' % (name, timing['median_ms']))
+            return 0
+
+    with open(baseline_path, 'r') as input_file:
+        baseline = json.load(input_file)
+    regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+    for name in regressions:
+        print('FAIL: %s' % name)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    # Blender passes the arguments after -- on to the script, the bpy module leaves them all to us
+    if '--' in sys.argv:
+        script_args = sys.argv[sys.argv.index('--') + 1:]
+    else:
+        script_args = sys.argv[1:] if 'bpy' not in sys.modules else []
+    sys.exit(main(script_args))
@@ -0,0 +1,63 @@
+"""Startup time regression check for the add-on. Runs inside Blender:
+
+    blender --background --factory-startup --python benchmarks/startup_time.py -- --max-import-ms 150 --max-register-ms 50
+
+Measures importing the add-on and register()/unregister() cycles, and fails (exit code 1) if either goes over
+budget, or if registering imported any of the heavy modules that should only be loaded on first use.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+heavy_modules = ['mediapipe', 'cv2', 'skimage', 'mediapipe_toolbox_inference']
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-import-ms', type=float, default=150.0)
+    parser.add_argument('--max-register-ms', type=float, default=50.0)
+    parser.add_argument('--repeat', type=int, default=20, help='register/unregister cycles to time')
+    parser.add_argument('--output', default=None, help='Also write the results to this json file')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    started = time.perf_counter()
+    import mediapipe_toolbox
+    import_ms = (time.perf_counter() - started) * 1000
+
+    register_times = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        mediapipe_toolbox.register()
+        register_times.append((time.perf_counter() - started) * 1000)
+        mediapipe_toolbox.unregister()
+
+    results = {
+        'import_ms': import_ms,
+        'register_ms': statistics.median(register_times),
+        'register_ms_max': max(register_times),
+        'heavy_modules_loaded': [module for module in heavy_modules if module in sys.modules],
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    failures = []
+    if results['import_ms'] > args.max_import_ms:
+        failures.append('import took %.1f ms (budget %.1f ms)' % (results['import_ms'], args.max_import_ms))
+    if results['register_ms'] > args.max_register_ms:
+        failures.append('register took %.1f ms (budget %.1f ms)' % (results['register_ms'], args.max_register_ms))
+    if results['heavy_modules_loaded']:
+        failures.append('import/register loaded %s' % ', '.join(results['heavy_modules_loaded']))
+    for failure in failures:
+        print('FAIL: %s' % failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    script_args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    sys.exit(main(script_args))
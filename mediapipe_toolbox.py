@@ -1,36 +1,95 @@
 import bpy
 import bmesh
+import collections
+import contextlib
+import functools
+import hashlib
+import heapq
+import importlib
+import importlib.util
 import json
+import math
 import os
-import addon_utils
-
-missing_modules = False
-try:
-    # These modules aren't standard to Blender/Python, so they'll need to be installed. Opening the add-on with Blender in admin mode should trigger the installer.
-    import mediapipe
-    import cv2
-    import numpy
-    import skimage
-except:
-    missing_modules = True
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+import mathutils
+
+# Helper modules live next to this file
+addon_dir = os.path.dirname(os.path.abspath(__file__))
+if addon_dir not in sys.path:
+    sys.path.append(addon_dir)
+
+import numpy # Ships with Blender
+import mediapipe_toolbox_takes
+
+# These modules aren't standard to Blender/Python, so they'll need to be installed (module -> pip package). They're
+# only imported by the tools that use them, so registering the add-on doesn't pay for them, or need them.
+required_modules = {
+    'mediapipe': 'mediapipe',
+    'cv2': 'opencv-python',
+}
+
+def find_missing_modules():
+    # find_spec only looks for the module, it doesn't import it
+    return [module for module in required_modules if importlib.util.find_spec(module) is None]
+
+mediapipe_toolbox_inference = None
+
+def load_inference():
+    """Import the MediaPipe/cv2 half of the add-on the first time a tool needs it"""
+    global mediapipe_toolbox_inference
+    if mediapipe_toolbox_inference is None:
+        missing = find_missing_modules()
+        if len(missing) > 0:
+            raise ImportError('Missing modules %s, use Install Dependencies in the MP Tools panel' % ', '.join(missing))
+        mediapipe_toolbox_inference = importlib.import_module('mediapipe_toolbox_inference')
+    return mediapipe_toolbox_inference
+
+# Shown in the panel. missing is filled in by register() and refreshed after installing
+dependency_status = {'missing': [], 'installing': False, 'error': None}
 
 def install_missing_modules():
-    print('Missing Modules, trying to install them now...')
-    import sys
-    import pip
+    """Install the missing modules with pip in a background thread, so Blender stays responsive"""
+    missing = find_missing_modules()
+    if len(missing) == 0 or dependency_status['installing']:
+        return
+    print('Missing Modules, installing them now: %s' % missing)
     # https://stackoverflow.com/questions/11161901/how-to-install-python-modules-in-blender
-    required_modules = [
-        'mediapipe',
-        'cv2',
-        'numpy',
-        'skimage'
-    ]
-
-    try:
-        for module in required_modules:
-            pip.main(['install', module, '--target', (sys.exec_prefix) + r'\lib\site-packages'])
-    except Exception as e:
-        print(e)
+    # The user's scripts/modules directory is on Blender's sys.path and doesn't need admin rights
+    target = bpy.utils.user_resource('SCRIPTS', path='modules', create=True)
+    command = [sys.executable, '-m', 'pip', 'install', '--target', target] + [required_modules[module] for module in missing]
+    dependency_status.update({'installing': True, 'error': None})
+
+    def install():
+        try:
+            subprocess.run([sys.executable, '-m', 'ensurepip'], capture_output=True)
+            result = subprocess.run(command, capture_output=True, text=True)
+            if result.returncode != 0:
+                dependency_status['error'] = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'pip exited with code %s' % result.returncode
+                print(result.stderr)
+        except OSError as e:
+            dependency_status['error'] = str(e)
+        dependency_status['installing'] = False
+
+    def check_install():
+        if dependency_status['installing']:
+            return 0.5 # Seconds until the next check
+        importlib.invalidate_caches()
+        if target not in sys.path:
+            sys.path.append(target)
+        dependency_status['missing'] = find_missing_modules()
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                area.tag_redraw()
+        return None
+
+    threading.Thread(target=install, name='mp_toolbox_install', daemon=True).start()
+    bpy.app.timers.register(check_install, first_interval=0.5)
 
 
 bl_info = {
@@ -41,30 +100,26 @@ bl_info = {
 }
 
 hand_mapping_file = 'data/hand_rigify_mapping.json'
-hand_config_data = {}
+hand_mapping = {}
 facemesh_mapping_file = 'data/facemesh_rigify_mapping.json'
-facemesh_config_data = {}
+facemesh_mapping = {}
+mapping_cache_dir = '.cache' # Relative to the mapping files
+config_dir = addon_dir # Where data/ was found
 
 def load_configs():
-    global facemesh_config_data, hand_config_data
-    matching_addons = list(filter(lambda x: x.bl_info['name'] == bl_info['name'], addon_utils.modules()))
-    root_url = ''
-    if len(matching_addons) > 0:
-        # Production/installed environment path
-        root_url = os.path.dirname(matching_addons[0].__file__)
-    else:
-        # Dev environment path, user agnostic
+    global facemesh_mapping, hand_mapping, config_dir
+    root_url = addon_dir
+    if not os.path.isfile(os.path.join(root_url, facemesh_mapping_file)):
+        # Running from Blender's text editor, use the dev environment path, user agnostic
         script_dirs = bpy.utils.user_resource('SCRIPTS')
         split_drive = os.path.splitdrive(script_dirs)
         user_dir = os.path.join(split_drive[0], os.sep, *split_drive[1].split(os.sep)[0:3]) # user/username is common on Windows and Linux
         docs_dir = ['Documents','Blender','Add Ons','mediapipe_toolbox']
         root_url = os.path.join(user_dir, *docs_dir)
-    with open(os.path.join(root_url, facemesh_mapping_file), 'r') as input_file:
-        string_format = input_file.read()
-        facemesh_config_data = json.loads(string_format)
-    with open(os.path.join(root_url, hand_mapping_file), 'r') as input_file:
-        string_format = input_file.read()
-        hand_config_data = json.loads(string_format)
+    config_dir = root_url
+    facemesh_mapping = compile_mapping(os.path.join(root_url, facemesh_mapping_file))
+    hand_mapping = compile_mapping(os.path.join(root_url, hand_mapping_file))
+    correspondence_mappings.clear()
 
 
 def armature_bone_count_match(_, obj):
@@ -73,41 +128,744 @@ def armature_bone_count_match(_, obj):
     return obj.users > 0 and len(obj.bones) == rigify_bone_count
 
 
-def facemesh_vertex_count_match(_, obj):
-    facemesh_vertices_count = 468 # How many verticies a facemesh should have
-    # return len(obj.vertices) == facemesh_vertices_count
-    return obj.users > 0 and len(obj.vertices) == facemesh_vertices_count
-
-
-def realistic_hand_match(_, obj):
-    hand_vertices_count = 831
-    return obj.users > 0 and len(obj.vertices) == hand_vertices_count
+def non_empty_mesh_in_use(_, obj):
+    # Any topology will do for the facemesh and hands. Meshes with the reference's (468 for faces, 831 for Blender's
+    # realistic hands) use the mapping as is, others get a transferred mapping
+    return obj.users > 0 and len(obj.vertices) > 0
+
+# Profiling
+# Opt-in (see the Testing panel) instrumentation of the operators: wall time per phase, bpy.ops calls, mode switches
+# and how many vertices/bones each run touched. When it's off, every hook returns straight away.
+
+class OperatorProfiler:
+    max_runs = 200
+
+    def __init__(self):
+        self.enabled = False
+        self.runs = collections.deque(maxlen=self.max_runs)
+        self.current = None
+        self.epoch = time.perf_counter()
+
+    @contextlib.contextmanager
+    def run(self, name):
+        if not self.enabled or self.current is not None:
+            yield
+            return
+        self.current = {
+            'operator': name,
+            'start_ms': (time.perf_counter() - self.epoch) * 1000,
+            'phases': [],
+            'ops': collections.Counter(),
+            'mode_switches': 0,
+            'vertices': 0,
+            'bones': 0,
+        }
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.current['duration_ms'] = (time.perf_counter() - started) * 1000
+            self.current['ops'] = dict(self.current['ops'])
+            self.runs.append(self.current)
+            self.current = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if self.current is None:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.current['phases'].append({
+                'name': name,
+                'start_ms': (started - self.epoch) * 1000,
+                'duration_ms': (time.perf_counter() - started) * 1000,
+            })
+
+    def count(self, vertices=0, bones=0):
+        if self.current is not None:
+            self.current['vertices'] += vertices
+            self.current['bones'] += bones
+
+    def latest_runs(self):
+        """The most recent run of each operator"""
+        latest = {}
+        for run in self.runs:
+            latest[run['operator']] = run
+        return list(latest.values())
+
+    def to_json(self):
+        return {'runs': list(self.runs)}
+
+    def to_chrome_trace(self):
+        """Trace Event Format, for chrome://tracing or Perfetto"""
+        events = []
+        for run in self.runs:
+            args = {key: run[key] for key in ['ops', 'mode_switches', 'vertices', 'bones']}
+            events.append({'name': run['operator'], 'ph': 'X', 'ts': run['start_ms'] * 1000, 'dur': run['duration_ms'] * 1000, 'pid': 1, 'tid': 1, 'args': args})
+            for phase in run['phases']:
+                events.append({'name': phase['name'], 'ph': 'X', 'ts': phase['start_ms'] * 1000, 'dur': phase['duration_ms'] * 1000, 'pid': 1, 'tid': 1})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+operator_profiler = OperatorProfiler()
+
+def profiled(execute):
+    """Decorator for Operator.execute, recording the run under the operator's bl_idname"""
+    @functools.wraps(execute)
+    def wrapper(self, context):
+        with operator_profiler.run(self.bl_idname):
+            return execute(self, context)
+    return wrapper
+
+def run_op(op, *args, **kwargs):
+    """Call a bpy.ops operator, counting it (and mode switches) in the current profiler run"""
+    if operator_profiler.current is None:
+        return op(*args, **kwargs)
+    idname = op.idname_py()
+    operator_profiler.current['ops'][idname] += 1
+    if idname == 'object.mode_set':
+        operator_profiler.current['mode_switches'] += 1
+    with operator_profiler.phase(idname):
+        return op(*args, **kwargs)
+
+class ObjectLookupError(Exception):
+    """No object, or more than one object, uses the data an operator was pointed at"""
+    pass
+
+class SceneObjectIndex:
+    """(data name, object type) -> objects in the scene, so lookups don't have to scan every object.
+
+    The index is rebuilt lazily, on the first lookup after the handlers below mark it dirty (objects added, removed,
+    renamed, relinked or given other data, undo/redo, file load), after a lookup hits an object that has gone stale,
+    or when a lookup finds nothing, since objects added by a script before the depsgraph ran haven't been seen yet.
+    """
+
+    def __init__(self):
+        self.scene_pointer = None
+        self.objects = {}
+        self.keys = {} # object pointer -> its key in objects
+        self.object_count = 0
+        self.dirty = True
+
+    def rebuild(self, scene):
+        self.objects = {}
+        self.keys = {}
+        self.object_count = 0
+        for obj in scene.objects:
+            self.object_count += 1
+            if obj.data is not None:
+                key = (obj.data.name, obj.type)
+                self.objects.setdefault(key, []).append(obj)
+                self.keys[obj.as_pointer()] = key
+        self.scene_pointer = scene.as_pointer()
+        self.dirty = False
+
+    def changed_data(self, obj):
+        """Whether obj uses different data than when the index was built"""
+        return self.keys.get(obj.as_pointer()) != ((obj.data.name, obj.type) if obj.data is not None else None)
+
+    def matches(self, scene, name, obj_type):
+        rebuilt = self.dirty or self.scene_pointer != scene.as_pointer()
+        if rebuilt:
+            self.rebuild(scene)
+        objects = self.objects.get((name, obj_type), [])
+        try:
+            stale = any(obj.type != obj_type or obj.data is None or obj.data.name != name for obj in objects)
+        except ReferenceError: # Object was removed, or undo freed it
+            stale = True
+        if stale or (len(objects) == 0 and not rebuilt):
+            self.rebuild(scene)
+            objects = self.objects.get((name, obj_type), [])
+        return objects
+
+    def find(self, scene, name, obj_type):
+        objects = self.matches(scene, name, obj_type)
+        if len(objects) == 1:
+            return objects[0]
+        if len(objects) == 0:
+            raise ObjectLookupError('No %s object in scene %s uses %s' % (obj_type, scene.name, name))
+        raise ObjectLookupError('%s %s objects use %s (%s), make the data single user or pick a different one' % (len(objects), obj_type, name, ', '.join(obj.name for obj in objects)))
+
+scene_object_index = SceneObjectIndex()
+
+@bpy.app.handlers.persistent
+def invalidate_scene_object_index(*args):
+    scene_object_index.dirty = True
+
+@bpy.app.handlers.persistent
+def scene_object_index_depsgraph_update(scene, depsgraph):
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Scene):
+            # The scene is updated by almost anything, only objects linked straight into (or out of) it matter
+            if len(scene.objects) != scene_object_index.object_count:
+                scene_object_index.dirty = True
+                return
+            continue
+        # Moving or editing objects doesn't change the index, anything else (linking, renaming, ...) might
+        if isinstance(update.id, bpy.types.Collection) or not (update.is_updated_transform or update.is_updated_geometry):
+            scene_object_index.dirty = True
+            return
+        # Giving an object other data only shows up as a geometry update
+        if update.is_updated_geometry and isinstance(update.id, bpy.types.Object) and scene_object_index.changed_data(update.id.original):
+            scene_object_index.dirty = True
+            return
+
+scene_object_index_handlers = [
+    (bpy.app.handlers.depsgraph_update_post, scene_object_index_depsgraph_update),
+    (bpy.app.handlers.undo_post, invalidate_scene_object_index),
+    (bpy.app.handlers.redo_post, invalidate_scene_object_index),
+    (bpy.app.handlers.load_post, invalidate_scene_object_index),
+]
 
 def findObjectByNameAndType(name, obj_type):
-    objects = [obj for obj in bpy.context.scene.objects if obj.type == obj_type and obj.data.name == name]
-    if len(objects) == 1:
-        return objects[0]
-    print('Found %s objects for %s, %s' % (len(objects), name, obj_type))
-    print(objects)
-    return objects[-1]
+    """The scene object using the data called name. Raises ObjectLookupError if there isn't exactly one"""
+    with operator_profiler.phase('find_object'):
+        return scene_object_index.find(bpy.context.scene, name, obj_type)
 
 def selectObject(name, obj_type):
-    bpy.ops.object.mode_set(mode='OBJECT')
-    bpy.ops.object.select_all(action='DESELECT')
     obj = findObjectByNameAndType(name, obj_type)
+    run_op(bpy.ops.object.mode_set, mode='OBJECT')
+    run_op(bpy.ops.object.select_all, action='DESELECT')
     bpy.context.view_layer.objects.active = obj # Active object is what transform_apply is interacting with
-    bpy.data.objects[obj.name].select_set(True)
+    obj.select_set(True)
     return obj
 
+# Bone fitting engine
+# Every bone's head/tail is the average of a group of vertex indices from a mapping file. Rather than looking up
+# vertices and bones one at a time, the mapping is compiled into CSR style offset/index arrays, the mesh is read
+# with a single foreach_get, and the edit bones are written back with a single foreach_set per property.
+
+def compile_index_groups(groups, names=None):
+    """Flatten {name: [indices]} into a name table plus CSR offset/index arrays. None and single ints are allowed"""
+    if names is None:
+        names = list(groups.keys())
+    offsets = [0]
+    indices = []
+    for name in names:
+        verts = groups[name]
+        if verts is None:
+            verts = [] # Not positioned by this mapping
+        elif isinstance(verts, int):
+            verts = [verts]
+        indices.extend(verts)
+        offsets.append(len(indices))
+    return numpy.array(offsets, dtype=numpy.int64), numpy.array(indices, dtype=numpy.int32)
+
+def compile_mapping_data(config_data):
+    """Turn a mapping json dict into a flat dict of numpy arrays"""
+    compiled = {}
+    bone_positions = config_data.get('bone_positions', {})
+    bone_names = list(bone_positions.keys())
+    compiled['bone_names'] = numpy.array(bone_names, dtype=str)
+    for end in ['head', 'tail']:
+        end_groups = {bone_name: bone_positions[bone_name][end] for bone_name in bone_names}
+        compiled['%s_offsets' % end], compiled['%s_indices' % end] = compile_index_groups(end_groups, bone_names)
+    for section in ['eye_edges', 'rip_verts']:
+        if section not in config_data:
+            continue
+        compiled['%s_names' % section] = numpy.array(list(config_data[section].keys()), dtype=str)
+        compiled['%s_offsets' % section], compiled['%s_indices' % section] = compile_index_groups(config_data[section])
+    return compiled
+
+def compile_mapping(json_path):
+    """Load the compiled form of a mapping file, compiling it first if the cache is missing or stale.
+
+    The cache is a directory of .npy files (opened memory-mapped) next to the json file, named after the json
+    file's content hash, so editing the json invalidates it.
+    """
+    with open(json_path, 'rb') as input_file:
+        raw = input_file.read()
+    digest = hashlib.sha256(raw).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(json_path))[0]
+    cache_root = os.path.join(os.path.dirname(json_path), mapping_cache_dir)
+    cache_dir = os.path.join(cache_root, '%s-%s' % (stem, digest))
+
+    if not os.path.isdir(cache_dir):
+        compiled = compile_mapping_data(json.loads(raw))
+        try:
+            save_arrays(cache_dir, compiled)
+        except OSError as e:
+            # Read only install, or another process won the race. Either way the compiled data is still usable
+            print('Could not write mapping cache %s: %s' % (cache_dir, e))
+            if not os.path.isdir(cache_dir):
+                return compiled
+        for entry in os.listdir(cache_root):
+            if entry.startswith('%s-' % stem) and entry != os.path.basename(cache_dir):
+                shutil.rmtree(os.path.join(cache_root, entry), ignore_errors=True)
+
+    return load_arrays(cache_dir)
+
+def save_arrays(directory, arrays):
+    """Write {name: array} as a directory of .npy files. It's written next to directory and then moved into place"""
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix='%s-' % os.path.basename(directory), dir=parent)
+    for key, values in arrays.items():
+        numpy.save(os.path.join(temp_dir, '%s.npy' % key), values)
+    if os.path.isdir(directory):
+        shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temp_dir, directory)
+
+def load_arrays(directory):
+    """Read a directory written by save_arrays, memory-mapped"""
+    arrays = {}
+    for entry in os.listdir(directory):
+        if entry.endswith('.npy'):
+            arrays[entry[:-len('.npy')]] = numpy.load(os.path.join(directory, entry), mmap_mode='r')
+    return arrays
+
+def mapping_group(compiled, section, name):
+    """Index array for one named group of a compiled section, ie mapping_group(facemesh_mapping, 'eye_edges', 'eye.L')"""
+    position = numpy.flatnonzero(compiled['%s_names' % section] == name)[0]
+    offsets = compiled['%s_offsets' % section]
+    return compiled['%s_indices' % section][offsets[position]:offsets[position + 1]]
+
+def read_vertex_coordinates(mesh):
+    coordinates = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+    mesh.vertices.foreach_get('co', coordinates)
+    return coordinates.reshape(-1, 3)
+
+def transform_points(matrix, points):
+    """Apply a 4x4 matrix (mathutils or numpy) to an (N, 3) array of points"""
+    matrix = numpy.asarray(matrix, dtype=numpy.float64)
+    return points @ matrix[:3, :3].T + matrix[:3, 3]
+
+def grouped_mean(coordinates, offsets, indices):
+    """Mean of coordinates[indices] per offset segment. Empty segments are NaN"""
+    counts = numpy.diff(offsets)
+    means = numpy.full((len(counts), 3), numpy.nan)
+    filled = counts > 0
+    if filled.any():
+        # Empty segments contribute no indices, so the starts of the filled segments are enough for reduceat
+        sums = numpy.add.reduceat(coordinates[indices].astype(numpy.float64), offsets[:-1][filled], axis=0)
+        means[filled] = sums / counts[filled, None]
+    return means
+
+class EditBoneBuffer:
+    """Head/tail arrays for all of an armature's edit bones. Must be created and written in EDIT mode"""
+
+    def __init__(self, armature_obj):
+        with operator_profiler.phase('read_edit_bones'):
+            self.edit_bones = armature_obj.data.edit_bones
+            self.rows = {name: row for row, name in enumerate(self.edit_bones.keys())}
+            self.heads = self._read('head')
+            self.tails = self._read('tail')
+            self.original_heads = self.heads.copy()
+            self.original_tails = self.tails.copy()
+            connected = numpy.zeros(len(self.edit_bones), dtype=bool)
+            self.edit_bones.foreach_get('use_connect', connected)
+            self.connected_rows = numpy.flatnonzero(connected)
+            self.connected_parent_rows = numpy.array([self.rows[self.edit_bones[row].parent.name] for row in self.connected_rows], dtype=numpy.int64)
+
+    def _read(self, attribute):
+        values = numpy.empty(len(self.edit_bones) * 3, dtype=numpy.float32)
+        self.edit_bones.foreach_get(attribute, values)
+        return values.reshape(-1, 3)
+
+    def rows_for(self, bone_names):
+        """Rows of the named bones, -1 for bones that aren't in the armature (which must not be used as an index)"""
+        return numpy.array([self.rows.get(name, -1) for name in bone_names], dtype=numpy.int64)
+
+    def fit(self, bone_rows, groups, coordinates, matrix):
+        """Place heads/tails at the transformed group means. Bones that aren't in the armature or ends without verts are left alone"""
+        for end, values in [('head', self.heads), ('tail', self.tails)]:
+            # The mean is taken before transforming, which is equivalent since the transform is affine
+            means = grouped_mean(coordinates, groups['%s_offsets' % end], groups['%s_indices' % end])
+            valid = (bone_rows >= 0) & ~numpy.isnan(means[:, 0])
+            values[bone_rows[valid]] = transform_points(matrix, means[valid])
+
+    def connect(self):
+        """Keep connected bones on their parent's tail, which setting head/tail one bone at a time used to do.
+
+        A connected bone whose head was moved while its parent's tail wasn't takes the parent's tail with it, then
+        every connected bone's head goes to its parent's tail (so siblings follow a moved tail too).
+        """
+        children, parents = self.connected_rows, self.connected_parent_rows
+        if len(children) == 0:
+            return
+        head_moved = (self.heads[children] != self.original_heads[children]).any(axis=1)
+        tail_kept = (self.tails[parents] == self.original_tails[parents]).all(axis=1)
+        pulled = head_moved & tail_kept
+        self.tails[parents[pulled]] = self.heads[children[pulled]]
+        self.heads[children] = self.tails[parents]
+
+    def write(self):
+        with operator_profiler.phase('write_edit_bones'):
+            # foreach_set skips the edit bone update that keeps connected bones together
+            self.connect()
+            self.edit_bones.foreach_set('head', self.heads.ravel())
+            self.edit_bones.foreach_set('tail', self.tails.ravel())
+
+def fit_bones_to_mesh(buffer, armature_obj, mesh_obj, groups, bone_suffix=''):
+    bone_names = numpy.char.add(groups['bone_names'], bone_suffix).tolist()
+    bone_rows = buffer.rows_for(bone_names)
+    missing = [bone_names[i] for i in numpy.flatnonzero(bone_rows < 0)]
+    if len(missing) > 0:
+        print('Bones missing from %s: %s' % (armature_obj.name, missing))
+    # Mesh local space -> world space -> armature local space as one matrix
+    matrix = armature_obj.matrix_world.inverted() @ mesh_obj.matrix_world
+    with operator_profiler.phase('read_vertices'):
+        coordinates = read_vertex_coordinates(mesh_obj.data)
+    with operator_profiler.phase('fit_bones'):
+        buffer.fit(bone_rows, groups, coordinates, matrix)
+    operator_profiler.count(vertices=len(coordinates), bones=int((bone_rows >= 0).sum()))
+
+def fit_eye_bones(buffer, armature_world_matrix_inverted, eye_objs):
+    """Move eye bones (keeping their length and direction) onto the origins of their eyes, eye_objs is {bone name: eye object}"""
+    eye_bone_names = [name for name in eye_objs.keys() if name in buffer.rows]
+    missing = [name for name in eye_objs.keys() if name not in buffer.rows]
+    if len(missing) > 0:
+        print('Eye bones missing from the armature: %s' % missing)
+    if len(eye_bone_names) == 0:
+        return
+    eye_rows = buffer.rows_for(eye_bone_names)
+    eye_locations = numpy.array([eye_objs[name].location for name in eye_bone_names]) # World location of origin
+    bone_head_new_locations = transform_points(armature_world_matrix_inverted, eye_locations)
+    bone_translations = buffer.heads[eye_rows] - bone_head_new_locations
+    buffer.tails[eye_rows] -= bone_translations
+    buffer.heads[eye_rows] = bone_head_new_locations
+
+# Correspondence transfer
+# The mappings were picked by hand on one reference mesh each (a mediapipe-facemesh-to-obj facemesh, Blender's
+# realistic hands). Any other mesh gets its own copy of the mapping: the reference is registered onto it (similarity
+# ICP, then an affine refinement for different proportions) and each reference vertex is matched to its nearest
+# vertex on the mesh with a KD-tree. The result is cached by the mesh's topology, so meshes sharing a base mesh
+# only pay for it once. The reference meshes are saved by the user from meshes the mappings fit (see the panel).
+
+class CorrespondenceError(Exception):
+    """A mesh doesn't match the reference topology, and no correspondence could be made for it"""
+    pass
+
+mapping_vertex_counts = {'facemesh': 468, 'hand': 831} # Vertices of the reference meshes the mappings were made on
+reference_dir = 'data/references' # Relative to the config dir
+correspondence_mappings = {} # (kind, fingerprint) -> compiled mapping, so repeated fits reuse the same arrays
+transfer_version = 2 # Part of the correspondence cache key, bump it when transfer_mapping changes
+
+reference_topology_key = 'mp_reference_topology' # Set on meshes our edits added vertices to, see has_reference_topology
+
+def kind_mapping(kind):
+    return facemesh_mapping if kind == 'facemesh' else hand_mapping
+
+def has_reference_topology(mesh, kind):
+    """Whether the mapping of kind fits mesh as is. Ripping the mouth appends vertices after the reference ones, so a
+    ripped mesh records [reference vertex count, vertex count after the rip] and counts as long as it still has that many"""
+    count = mapping_vertex_counts[kind]
+    if len(mesh.vertices) == count:
+        return True
+    recorded = mesh.get(reference_topology_key)
+    return recorded is not None and list(recorded) == [count, len(mesh.vertices)]
+
+def read_edges(mesh):
+    edges = numpy.empty(len(mesh.edges) * 2, dtype=numpy.int32)
+    mesh.edges.foreach_get('vertices', edges)
+    return edges.reshape(-1, 2)
+
+def topology_fingerprint(mesh):
+    """Hash of the vertex count and edge list, which is all the vertex and edge indices of a mapping depend on"""
+    digest = hashlib.sha256(numpy.int64(len(mesh.vertices)).tobytes())
+    digest.update(read_edges(mesh).tobytes())
+    return digest.hexdigest()[:16]
+
+def reference_path(kind):
+    return os.path.join(config_dir, reference_dir, kind)
+
+def save_reference_mesh(obj, kind):
+    """Save obj's world space vertices and edges as the reference the mapping of kind was made on"""
+    if len(obj.data.vertices) != mapping_vertex_counts[kind]:
+        raise CorrespondenceError('A %s reference needs %s vertices, %s has %s' % (kind, mapping_vertex_counts[kind], obj.name, len(obj.data.vertices)))
+    coordinates = transform_points(obj.matrix_world, read_vertex_coordinates(obj.data))
+    save_arrays(reference_path(kind), {'coordinates': coordinates, 'edges': read_edges(obj.data)})
+    correspondence_mappings.clear()
+
+def kdtree_from_points(points):
+    tree = mathutils.kdtree.KDTree(len(points))
+    for index, point in enumerate(points.tolist()):
+        tree.insert(point, index)
+    tree.balance()
+    return tree
+
+def nearest_points(tree, points):
+    """Indices of, and distances to, the nearest tree point for each point"""
+    found = [tree.find(point) for point in points.tolist()]
+    return numpy.array([index for _, index, _ in found], dtype=numpy.int64), numpy.array([distance for _, _, distance in found])
+
+def register_points(source, target, tree, iterations=30, affine_iterations=10, tolerance=1e-6):
+    """4x4 matrix taking source points onto the target surface, and the mean distance left. tree is target's KD-tree"""
+    source_centered = source - source.mean(axis=0)
+    target_centered = target - target.mean(axis=0)
+    scale = numpy.sqrt((target_centered ** 2).sum(axis=1).mean() / max((source_centered ** 2).sum(axis=1).mean(), 1e-12))
+    # Both meshes are assumed to be roughly upright and facing the same way, so the start only fixes position and size
+    matrix = numpy.identity(4)
+    matrix[:3, :3] *= scale
+    matrix[:3, 3] = target.mean(axis=0) - scale * source.mean(axis=0)
+    # Similarity ICP until it settles, then a few affine steps for meshes with different proportions
+    error = numpy.inf
+    for _ in range(iterations):
+        nearest, distances = nearest_points(tree, transform_points(matrix, source))
+        matrix = similarity_transform(source, target[nearest])
+        previous_error, error = error, distances.mean()
+        if previous_error - error <= tolerance * scale:
+            break
+    homogeneous = numpy.concatenate([source, numpy.ones((len(source), 1))], axis=1)
+    for _ in range(affine_iterations):
+        nearest, _ = nearest_points(tree, transform_points(matrix, source))
+        matrix[:3, :] = numpy.linalg.lstsq(homogeneous, target[nearest], rcond=None)[0].T
+    _, distances = nearest_points(tree, transform_points(matrix, source))
+    return matrix, distances.mean()
+
+def edge_adjacency(edges, vertex_count):
+    """CSR adjacency of a mesh: the neighbours of vertex v are neighbours[offsets[v]:offsets[v + 1]], reached over
+    the edges at the same positions of edge_indices"""
+    ends = numpy.concatenate([edges, edges[:, ::-1]]).astype(numpy.int64)
+    order = numpy.argsort(ends[:, 0], kind='stable')
+    offsets = numpy.zeros(vertex_count + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(ends[:, 0], minlength=vertex_count), out=offsets[1:])
+    edge_indices = numpy.tile(numpy.arange(len(edges)), 2)
+    return offsets, ends[order, 1], edge_indices[order]
+
+def shortest_edge_path(adjacency, coordinates, start, end):
+    """Vertices and edges along the shortest path from start to end over the mesh edges, None if they aren't connected.
+    adjacency is edge_adjacency as lists and coordinates a list of points, which is much faster to walk than arrays"""
+    offsets, neighbours, edge_indices = adjacency
+    distances = {start: 0.0}
+    previous = {} # vertex -> (vertex before it, edge between them)
+    heap = [(0.0, start)]
+    while heap:
+        distance, vertex = heapq.heappop(heap)
+        if vertex == end:
+            break
+        if distance > distances[vertex]:
+            continue
+        for position in range(offsets[vertex], offsets[vertex + 1]):
+            neighbour = neighbours[position]
+            candidate = distance + math.dist(coordinates[vertex], coordinates[neighbour])
+            if candidate < distances.get(neighbour, math.inf):
+                distances[neighbour] = candidate
+                previous[neighbour] = (vertex, edge_indices[position])
+                heapq.heappush(heap, (candidate, neighbour))
+    else:
+        return None
+    vertices, edges = [end], []
+    while vertices[-1] != start:
+        vertex, edge = previous[vertices[-1]]
+        vertices.append(vertex)
+        edges.append(edge)
+    return vertices[::-1], edges[::-1]
+
+def transfer_mapping(groups, nearest, reference_edges, target_edges, target_coordinates):
+    """A compiled mapping for the target mesh, from one for the reference and the target vertex nearest each reference vertex.
+
+    Bone groups are averages, so their vertices just carry over. Eye edges and rip verts are loops and chains though,
+    and neighbouring reference vertices don't always land on neighbouring target vertices, so each reference edge
+    (and each step along a rip chain) becomes the shortest path between the transferred ends on the target
+    """
+    transferred = {key: numpy.array(values) for key, values in groups.items()}
+    for key in ['head_indices', 'tail_indices']:
+        if key in transferred:
+            transferred[key] = nearest[transferred[key]].astype(numpy.int32)
+    offsets, neighbours, edge_indices = edge_adjacency(target_edges, len(target_coordinates))
+    adjacency = (offsets.tolist(), neighbours.tolist(), edge_indices.tolist())
+    coordinates = target_coordinates.tolist()
+    paths = {}
+    def path(start, end):
+        if (start, end) not in paths:
+            paths[(start, end)] = shortest_edge_path(adjacency, coordinates, start, end)
+        return paths[(start, end)]
+
+    if 'eye_edges_indices' in groups:
+        edge_groups = {}
+        for name in groups['eye_edges_names'].tolist():
+            edge_groups[name] = []
+            for start, end in nearest[reference_edges[mapping_group(groups, 'eye_edges', name)]].tolist():
+                found = path(start, end)
+                if found is not None:
+                    edge_groups[name].extend(found[1])
+            edge_groups[name] = list(dict.fromkeys(edge_groups[name])) # Paths of neighbouring edges can overlap
+        transferred['eye_edges_offsets'], transferred['eye_edges_indices'] = compile_index_groups(edge_groups, groups['eye_edges_names'].tolist())
+
+    if 'rip_verts_indices' in groups:
+        reference_edge_set = set(map(tuple, numpy.sort(reference_edges, axis=1).tolist()))
+        vert_groups = {}
+        for name in groups['rip_verts_names'].tolist():
+            reference_verts = mapping_group(groups, 'rip_verts', name).tolist()
+            # The eye loops come back round to their first vertex, the mouth is a chain between the corners
+            closed = len(reference_verts) > 2 and tuple(sorted([reference_verts[0], reference_verts[-1]])) in reference_edge_set
+            ends = nearest[reference_verts + reference_verts[:1] if closed else reference_verts].tolist()
+            verts = ends[:1]
+            for start, end in zip(ends, ends[1:]):
+                found = path(start, end)
+                if found is None:
+                    verts.append(end) # Disconnected, so the chain has a gap here. Tools only use the verts that do join up
+                else:
+                    verts.extend(found[0][1:])
+            vert_groups[name] = verts[:-1] if closed else verts # A loop's closing vertex is its first
+        transferred['rip_verts_offsets'], transferred['rip_verts_indices'] = compile_index_groups(vert_groups, groups['rip_verts_names'].tolist())
+    return transferred
+
+def build_correspondence_mapping(obj, kind):
+    """Register the reference of kind onto obj and transfer its mapping. Returns the mapping and the mean registration error"""
+    if not os.path.isdir(reference_path(kind)):
+        raise CorrespondenceError('%s has %s vertices rather than %s, and there is no %s reference mesh saved to fit it from' % (obj.name, len(obj.data.vertices), mapping_vertex_counts[kind], kind))
+    reference = load_arrays(reference_path(kind))
+    with operator_profiler.phase('register_reference'):
+        target = transform_points(obj.matrix_world, read_vertex_coordinates(obj.data))
+        tree = kdtree_from_points(target)
+        source = numpy.asarray(reference['coordinates'], dtype=numpy.float64)
+        # A right hand is a mirrored left hand, so try the mirror image of the reference as well. Not for faces,
+        # which are symmetric enough that a mirrored fit could win and swap the .L and .R bones
+        flips = [numpy.identity(4)]
+        if kind == 'hand':
+            flips.append(numpy.diag([-1.0, 1.0, 1.0, 1.0]))
+        candidates = []
+        for flip in flips:
+            matrix, error = register_points(transform_points(flip, source), target, tree)
+            candidates.append((error, matrix @ flip))
+        error, matrix = min(candidates, key=lambda candidate: candidate[0])
+    with operator_profiler.phase('transfer_mapping'):
+        nearest, _ = nearest_points(tree, transform_points(matrix, source))
+        mapping = transfer_mapping(kind_mapping(kind), nearest, numpy.asarray(reference['edges']), read_edges(obj.data), target)
+    return mapping, error
+
+def mapping_for_mesh(obj, kind):
+    """The compiled mapping to fit obj with, the authored one if obj has the reference topology, else a transferred one"""
+    if has_reference_topology(obj.data, kind):
+        return kind_mapping(kind)
+    fingerprint = topology_fingerprint(obj.data)
+    mapping = correspondence_mappings.get((kind, fingerprint))
+    if mapping is not None:
+        return mapping
+    # The reference, the mapping and how it's transferred are part of the key too, as changing any of them changes the result
+    digest = hashlib.sha256(('%s-%s' % (fingerprint, transfer_version)).encode())
+    if os.path.isdir(reference_path(kind)):
+        for values in load_arrays(reference_path(kind)).values():
+            digest.update(numpy.ascontiguousarray(values).tobytes())
+    for key in sorted(kind_mapping(kind)):
+        digest.update(numpy.ascontiguousarray(kind_mapping(kind)[key]).tobytes())
+    cache_dir = os.path.join(config_dir, os.path.dirname(facemesh_mapping_file), mapping_cache_dir, 'correspondence', '%s-%s' % (kind, digest.hexdigest()[:16]))
+    if os.path.isdir(cache_dir):
+        mapping = load_arrays(cache_dir)
+    else:
+        mapping, error = build_correspondence_mapping(obj, kind)
+        print('Built a %s mapping for %s (mean registration error %.4f)' % (kind, obj.name, error))
+        try:
+            save_arrays(cache_dir, mapping)
+        except OSError as e:
+            print('Could not write correspondence cache %s: %s' % (cache_dir, e))
+    correspondence_mappings[(kind, fingerprint)] = mapping
+    return mapping
+
+# Bulk keyframe writer
+# keyframe_insert per bone per frame triggers an RNA update for every key. Instead chunks of frames are gathered in
+# NumPy, and each fcurve's keyframe_points are grown and filled with foreach_set once per flush. foreach_set always
+# writes the whole collection, so flushing after every chunk would rewrite every earlier key each time.
+
+pose_channel_sizes = {
+    'location': 3,
+    'rotation_quaternion': 4,
+    'rotation_euler': 3,
+    'scale': 3,
+}
+keyframe_interpolations = {'CONSTANT': 0, 'LINEAR': 1, 'BEZIER': 2} # Enum values, as foreach_set wants them
+
+class PoseActionWriter:
+    """Write pose bone animation into the armature's action, one foreach_set per fcurve property.
+
+    Values are passed as a (frames, len(self.columns)) array, each column being a (bone_name, channel, index) fcurve.
+    Chunks can be appended as they're produced, but each chunk should only contain frames that aren't keyed yet.
+    Nothing is keyed until flush(), which should be called once at the end of a take (or now and then on a long live
+    take, to see the keys so far).
+    """
+
+    def __init__(self, armature_obj, bone_names=None, channels=('location', 'rotation_quaternion', 'scale'), interpolation='LINEAR', action_name=None):
+        if bone_names is None:
+            bone_names = armature_obj.pose.bones.keys()
+        if armature_obj.animation_data is None:
+            armature_obj.animation_data_create()
+        action = armature_obj.animation_data.action
+        if action is None:
+            action = bpy.data.actions.new(action_name or '%sAction' % armature_obj.name)
+            armature_obj.animation_data.action = action
+        self.action = action
+        self.interpolation = keyframe_interpolations[interpolation]
+
+        self.columns = []
+        self.fcurves = []
+        for bone_name in bone_names:
+            for channel in channels:
+                data_path = 'pose.bones["%s"].%s' % (bone_name, channel)
+                for index in range(pose_channel_sizes[channel]):
+                    fcurve = action.fcurves.find(data_path, index=index)
+                    if fcurve is None:
+                        fcurve = action.fcurves.new(data_path, index=index, action_group=bone_name)
+                    self.columns.append((bone_name, channel, index))
+                    self.fcurves.append(fcurve)
+        self.pending_frames = []
+        self.pending_values = []
+
+    def column_index(self, bone_name, channel):
+        """First column of a bone's channel, ie values[:, i:i + 4] for a rotation_quaternion"""
+        return self.columns.index((bone_name, channel, 0))
+
+    def append(self, frames, values):
+        frames = numpy.asarray(frames, dtype=numpy.float32)
+        values = numpy.asarray(values, dtype=numpy.float32)
+        if values.shape != (len(frames), len(self.columns)):
+            raise ValueError('Expected values of shape (%s, %s), got %s' % (len(frames), len(self.columns), values.shape))
+        self.pending_frames.append(frames)
+        self.pending_values.append(values)
+
+    def flush(self):
+        """Key everything appended since the last flush"""
+        if not self.pending_frames:
+            return
+        frames = numpy.concatenate(self.pending_frames)
+        values = numpy.concatenate(self.pending_values)
+        self.pending_frames = []
+        self.pending_values = []
+        for column, fcurve in enumerate(self.fcurves):
+            points = fcurve.keyframe_points
+            start = len(points)
+            points.add(len(frames))
+            total = start + len(frames)
+
+            co = numpy.empty(total * 2, dtype=numpy.float32)
+            if start > 0:
+                points.foreach_get('co', co)
+            co[start * 2::2] = frames
+            co[start * 2 + 1::2] = values[:, column]
+            points.foreach_set('co', co)
+            # New keys' handles start on the key, update() places them. Keys that were already there keep theirs
+            for handle in ['handle_left', 'handle_right']:
+                handles = co.copy()
+                if start > 0:
+                    points.foreach_get(handle, handles)
+                    handles[start * 2:] = co[start * 2:]
+                points.foreach_set(handle, handles)
+
+            interpolation = numpy.empty(total, dtype=numpy.int32)
+            if start > 0:
+                points.foreach_get('interpolation', interpolation)
+            interpolation[start:] = self.interpolation
+            points.foreach_set('interpolation', interpolation)
+            fcurve.update()
+
+def pose_action_writer(context, **kwargs):
+    """PoseActionWriter for the scene's mp_edit_rig"""
+    armature_obj = findObjectByNameAndType(context.scene.mp_edit_rig.name, 'ARMATURE')
+    return PoseActionWriter(armature_obj, **kwargs)
+
 class AddRigOperator(bpy.types.Operator):
     """Add a rigify rig to the scene and select it"""
     bl_idname = 'mp_tools.add_rig_to_scene'
     bl_label = 'Add Rigify Rig'
     bl_options = {'REGISTER', 'UNDO'} # Enable undo for operations?
 
+    @profiled
     def execute(self, context):
         # Add Rig
-        bpy.ops.object.armature_human_metarig_add()
+        run_op(bpy.ops.object.armature_human_metarig_add)
         armatures = bpy.data.armatures
         context.scene.mp_edit_rig = armatures[-1]
         return {'FINISHED'}
@@ -118,6 +876,7 @@ class MetarigToFacemeshOperator(bpy.types.Operator):
     bl_label = 'Align to Facemesh'
     bl_options = {'REGISTER', 'UNDO'} # Enable undo for operations
 
+    @profiled
     def execute(self, context):
         armature = context.scene.mp_edit_rig
         facemesh = context.scene.mp_facemesh
@@ -129,76 +888,124 @@ class MetarigToFacemeshOperator(bpy.types.Operator):
 
         starting_mode = bpy.context.object.mode
 
-        armature_obj = selectObject(armature.name, 'ARMATURE')
+        try:
+            facemesh_obj = findObjectByNameAndType(facemesh.name, 'MESH')
+            eye_objs = None
+            if context.scene.mp_eye_left is not None and context.scene.mp_eye_right is not None:
+                eye_objs = [findObjectByNameAndType(context.scene.mp_eye_left.name, 'MESH'), findObjectByNameAndType(context.scene.mp_eye_right.name, 'MESH')]
+            armature_obj = selectObject(armature.name, 'ARMATURE')
+            groups = mapping_for_mesh(facemesh_obj, 'facemesh')
+        except (ObjectLookupError, CorrespondenceError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
         armature_world_matrix_inverted = armature_obj.matrix_world.inverted()
-        bpy.ops.object.mode_set(mode='EDIT')
+        run_op(bpy.ops.object.mode_set, mode='EDIT')
 
-        facemesh_obj = findObjectByNameAndType(facemesh.name, 'MESH')
-        facemesh_world_matrix = facemesh_obj.matrix_world
-        for bone_name in facemesh_config_data['bone_positions'].keys():
-            bone_id = armature.bones.find(bone_name)
-            # print('%s = %s' % (bone_name, bone_id))
-            head = facemesh_config_data['bone_positions'][bone_name]['head']
-            if head is not None:
-                facemesh_co = facemesh.vertices[head].co
-                world_co = facemesh_world_matrix @ facemesh_co
-                # bpy.data.objects[armature.name].data.edit_bones[bone_id].head = facemesh_co
-                armature_obj.data.edit_bones[bone_id].head = armature_world_matrix_inverted @ world_co
-            
-            tail = facemesh_config_data['bone_positions'][bone_name]['tail']
-            if tail is not None:
-                facemesh_co = facemesh.vertices[tail].co
-                world_co = facemesh_world_matrix @ facemesh_co
-                # bpy.data.objects[armature.name].data.edit_bones[bone_id].tail = facemesh_co
-                armature_obj.data.edit_bones[bone_id].tail = armature_world_matrix_inverted @ world_co
-
-        if context.scene.mp_eye_left is not None and context.scene.mp_eye_right is not None:
-            # Position the eyes
-            eye_bone_names = ['eye.L', 'eye.R']
-            eye_objs = [findObjectByNameAndType(context.scene.mp_eye_left.name, 'MESH'), findObjectByNameAndType(context.scene.mp_eye_right.name, 'MESH')]
-            for index in range(2):
-                bone_id = armature.bones.find(eye_bone_names[index])
-                bone_head_location = armature_obj.data.edit_bones[bone_id].head
-                bone_head_new_location = armature_world_matrix_inverted @ eye_objs[index].location # World location of origin
-                bone_translation = bone_head_location - bone_head_new_location
-                bone_tail_new_location = armature_obj.data.edit_bones[bone_id].tail - bone_translation
-                armature_obj.data.edit_bones[bone_id].head = bone_head_new_location
-                armature_obj.data.edit_bones[bone_id].tail = bone_tail_new_location
+        buffer = EditBoneBuffer(armature_obj)
+        fit_bones_to_mesh(buffer, armature_obj, facemesh_obj, groups)
+
+        if eye_objs is not None:
+            fit_eye_bones(buffer, armature_world_matrix_inverted, {'eye.L': eye_objs[0], 'eye.R': eye_objs[1]})
+
+        buffer.write()
 
         # bpy.ops.object.mode_set(mode='OBJECT')
-        bpy.ops.object.mode_set(mode=starting_mode)
+        run_op(bpy.ops.object.mode_set, mode=starting_mode)
 
         return {'FINISHED'}
 
+# Facemesh editing
+# Both edits work on a bmesh of the mesh data and write it back once, so they don't need mode switches, selection or
+# a 3D viewport, and run fine in blender --background.
+
+def edit_mesh_with_bmesh(mesh, edit):
+    """Call edit(bm) with a bmesh of mesh, then write it back. Works whether or not the mesh is in edit mode"""
+    operator_profiler.count(vertices=len(mesh.vertices))
+    if mesh.is_editmode:
+        bm = bmesh.from_edit_mesh(mesh)
+        with operator_profiler.phase('edit_bmesh'):
+            edit(bm)
+        with operator_profiler.phase('write_mesh'):
+            bmesh.update_edit_mesh(mesh)
+        return
+    bm = bmesh.new()
+    try:
+        with operator_profiler.phase('read_mesh'):
+            bm.from_mesh(mesh)
+        with operator_profiler.phase('edit_bmesh'):
+            edit(bm)
+        with operator_profiler.phase('write_mesh'):
+            bm.to_mesh(mesh)
+            mesh.update()
+    finally:
+        bm.free()
+
+def cutout_facemesh_eyes(mesh, groups=None):
+    """Delete the eye_edges (and the faces using them) from a facemesh. groups defaults to the facemesh mapping.
+    Returns {side: edges deleted}"""
+    groups = facemesh_mapping if groups is None else groups
+    counts = {side: len(mapping_group(groups, 'eye_edges', side)) for side in ['eye.L', 'eye.R']}
+    def edit(bm):
+        bm.edges.ensure_lookup_table()
+        edges = [bm.edges[index] for side in counts for index in mapping_group(groups, 'eye_edges', side).tolist()]
+        bmesh.ops.delete(bm, geom=edges, context='EDGES')
+    edit_mesh_with_bmesh(mesh, edit)
+    return counts
+
+def rip_facemesh_mouth(mesh, groups=None):
+    """Split the facemesh along the mouth rip_verts, so the upper and lower lips no longer share vertices. Returns the
+    number of edges split"""
+    groups = facemesh_mapping if groups is None else groups
+    reference_topology = has_reference_topology(mesh, 'facemesh')
+    split = []
+    appended = []
+    def edit(bm):
+        bm.verts.ensure_lookup_table()
+        originals = list(bm.verts)
+        rip_verts = set(bm.verts[index] for index in mapping_group(groups, 'rip_verts', 'mouth').tolist())
+        # Same edges a vertex selection would select. split_edges leaves the ends of the chain (the mouth corners) joined
+        edges = [edge for edge in bm.edges if edge.verts[0] in rip_verts and edge.verts[1] in rip_verts]
+        split.extend(edges)
+        bmesh.ops.split_edges(bm, edges=edges)
+        # The split vertices are normally appended, leaving the existing ones where they were. mesh.vertices lags
+        # behind in edit mode, so the new count comes from the bmesh
+        bm.verts.index_update()
+        if all(vert.index == index for index, vert in enumerate(originals)):
+            appended.append(len(bm.verts))
+    edit_mesh_with_bmesh(mesh, edit)
+    if reference_topology and appended:
+        mesh[reference_topology_key] = [mapping_vertex_counts['facemesh'], appended[0]]
+    elif reference_topology_key in mesh:
+        del mesh[reference_topology_key]
+    return len(split)
+
+partial_edit_ratio = 0.5 # Warn when a tool finds less than this much of what the reference mapping has
+
+def report_partial_edit(operator, obj, what, done, expected):
+    """Warn when a tool only found part of what the reference has, which happens with mappings transferred onto
+    meshes where the transferred loops couldn't be joined up (ie the eyes were already cut out)"""
+    if done == 0:
+        operator.report({'WARNING'}, 'None of the %s %s were found on %s, nothing was changed' % (expected, what, obj.name))
+    elif done < expected * partial_edit_ratio:
+        operator.report({'WARNING'}, 'Only %s of the reference\'s %s %s were found on %s, check the result' % (done, expected, what, obj.name))
+
 class CutoutFacemeshEyesOperator(bpy.types.Operator):
     """Cutout the eye holes from the facemesh"""
     bl_idname = 'mp_tools.cutout_facemesh_eyes'
     bl_label = 'Cutout Eyes'
     bl_options = {'REGISTER', 'UNDO'} # Enable undo for operations
 
+    @profiled
     def execute(self, context):
-        facemesh = context.scene.mp_facemesh
-
-        starting_mode = bpy.context.object.mode
-        selectObject(facemesh.name, 'MESH')
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.select_mode(type='EDGE')
-        bpy.ops.mesh.select_all(action='DESELECT')
-
-        # Counter-intuitively, you select the vertexes in Object mode, then switch to Edit mode
-        bpy.ops.object.mode_set(mode='OBJECT')
-        for edge in facemesh.edges:
-            edge.select = False
-        print('Selected Edges: %s' % len([edge for edge in facemesh.edges if edge.select]))
-        for index in facemesh_config_data['eye_edges']['eye.L']:
-            facemesh.edges[index].select = True
-        for index in facemesh_config_data['eye_edges']['eye.R']:
-            facemesh.edges[index].select = True
-        print('Selected Edges: %s' % len([edge for edge in facemesh.edges if edge.select]))
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.delete(type='EDGE')
-
-        bpy.ops.object.mode_set(mode=starting_mode)
+        try:
+            facemesh_obj = findObjectByNameAndType(context.scene.mp_facemesh.name, 'MESH')
+            groups = mapping_for_mesh(facemesh_obj, 'facemesh')
+        except (ObjectLookupError, CorrespondenceError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        counts = cutout_facemesh_eyes(facemesh_obj.data, groups)
+        for side, count in counts.items():
+            report_partial_edit(self, facemesh_obj, '%s edges' % side, count, len(mapping_group(facemesh_mapping, 'eye_edges', side)))
         return {'FINISHED'}
 
 class RipFacemeshMouthOperator(bpy.types.Operator):
@@ -207,43 +1014,41 @@ class RipFacemeshMouthOperator(bpy.types.Operator):
     bl_label = 'Rip mouth open'
     bl_options = {'REGISTER', 'UNDO'} # Enable undo for operations?
 
-    def selectVertices(self, facemesh):
-        # for vert in facemesh.vertices:
-        #     vert.select = False
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.select_mode(type='VERT')
-        bpy.ops.mesh.select_all(action='DESELECT')
-
-        # Counter-intuitively, you select the vertexes in Object mode, then switch to Edit mode
-        bpy.ops.object.mode_set(mode='OBJECT')
-        for index in facemesh_config_data['rip_verts']['mouth']:
-            facemesh.vertices[index].select = True
-
+    @profiled
     def execute(self, context):
-        facemesh = context.scene.mp_facemesh
-
-        selectObject(facemesh.name, 'MESH')
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.select_mode(type='VERT')
-
-        # TODO: See if I can avoid this separate meshes step now
-        self.selectVertices(facemesh)
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.separate(type='SELECTED') # Equivalent of P (separate menu) and "Separate Selection". Creates another object in the scene collection that should get cleaned up. Was encountering a "cannot rip selected faces" error without this step
-
-        # Both the facemesh and the separate are selected. Reset the selection to just the facemesh. 
-        selectObject(facemesh.name, 'MESH')
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.select_mode(type='VERT')
+        try:
+            facemesh_obj = findObjectByNameAndType(context.scene.mp_facemesh.name, 'MESH')
+            groups = mapping_for_mesh(facemesh_obj, 'facemesh')
+        except (ObjectLookupError, CorrespondenceError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        count = rip_facemesh_mouth(facemesh_obj.data, groups)
+        # The rip verts are a chain from one mouth corner to the other
+        expected = len(numpy.unique(mapping_group(facemesh_mapping, 'rip_verts', 'mouth'))) - 1
+        report_partial_edit(self, facemesh_obj, 'mouth edges', count, expected)
+        return {'FINISHED'}
 
-        self.selectVertices(facemesh) # Reselect the vertices
+class SaveReferenceMeshOperator(bpy.types.Operator):
+    """Save the facemesh or left hand as the reference mesh, so meshes with other topologies can be fitted"""
+    bl_idname = 'mp_tools.save_reference_mesh'
+    bl_label = 'Save Reference Mesh'
 
-        bpy.ops.object.mode_set(mode='EDIT')
-        # Operator bpy.ops.mesh.rip.poll() failed, context is incorrect
-        # bpy.ops.mesh.rip() # V to rip 
-        # bpy.ops.mesh.rip('INVOKE_DEFAULT') # V to rip 
-        bpy.ops.mesh.rip_move('INVOKE_DEFAULT', MESH_OT_rip={"mirror":False, "use_proportional_edit":False, "proportional_edit_falloff":'SMOOTH', "proportional_size":1, "use_proportional_connected":False, "use_proportional_projected":False, "release_confirm":False, "use_accurate":False, "use_fill":False}, TRANSFORM_OT_translate={"value":(0, 0, 0.000381055), "orient_axis_ortho":'X', "orient_type":'GLOBAL', "orient_matrix":((1, 0, 0), (0, 1, 0), (0, 0, 1)), "orient_matrix_type":'GLOBAL', "constraint_axis":(False, False, True), "mirror":False, "use_proportional_edit":False, "proportional_edit_falloff":'SMOOTH', "proportional_size":1, "use_proportional_connected":False, "use_proportional_projected":False, "snap":False, "snap_elements":{'INCREMENT'}, "use_snap_project":False, "snap_target":'CLOSEST', "use_snap_self":False, "use_snap_edit":False, "use_snap_nonedit":False, "use_snap_selectable":False, "snap_point":(0, 0, 0), "snap_align":False, "snap_normal":(0, 0, 0), "gpencil_strokes":False, "cursor_transform":False, "texture_space":False, "remove_on_cancel":False, "view2d_edge_pan":False, "release_confirm":False, "use_accurate":False, "use_automerge_and_split":False})
+    kind: bpy.props.EnumProperty(
+        name="Kind",
+        items=[('facemesh', "Facemesh", ""), ('hand', "Hand", "")],
+        default='facemesh',
+    )
 
+    def execute(self, context):
+        mesh = context.scene.mp_facemesh if self.kind == 'facemesh' else context.scene.mp_hand_left
+        try:
+            obj = findObjectByNameAndType(mesh.name, 'MESH')
+            save_reference_mesh(obj, self.kind)
+        except (AttributeError, ObjectLookupError, CorrespondenceError, OSError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        live_refitter.mappings.clear() # Meshes that couldn't be fitted before might be now
+        self.report({'INFO'}, 'Saved %s as the %s reference' % (obj.name, self.kind))
         return {'FINISHED'}
 
 # DEPRICATED!
@@ -288,50 +1093,811 @@ class AlignHandsOperator(bpy.types.Operator):
     bl_label = 'Align hand bones'
     bl_options = {'REGISTER', 'UNDO'} # Enable undo for operations
 
+    @profiled
     def execute(self, context):
         starting_mode = bpy.context.object.mode
 
-        left_hand = context.scene.mp_hand_left
-        right_hand = context.scene.mp_hand_right
-        left_hand_obj = findObjectByNameAndType(context.scene.mp_hand_left.name, 'MESH')
-        right_hand_obj = findObjectByNameAndType(context.scene.mp_hand_right.name, 'MESH')
+        try:
+            left_hand_obj = findObjectByNameAndType(context.scene.mp_hand_left.name, 'MESH')
+            right_hand_obj = findObjectByNameAndType(context.scene.mp_hand_right.name, 'MESH')
+            hand_groups = [mapping_for_mesh(hand_obj, 'hand') for hand_obj in [left_hand_obj, right_hand_obj]]
+            armature = context.scene.mp_edit_rig
+            armature_obj = selectObject(armature.name, 'ARMATURE')
+        except (ObjectLookupError, CorrespondenceError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        run_op(bpy.ops.object.mode_set, mode='EDIT')
+
+        buffer = EditBoneBuffer(armature_obj)
+        for side, hand_obj, groups in [('L', left_hand_obj, hand_groups[0]), ('R', right_hand_obj, hand_groups[1])]:
+            fit_bones_to_mesh(buffer, armature_obj, hand_obj, groups, bone_suffix='.%s' % side)
+        buffer.write()
+
+        run_op(bpy.ops.object.mode_set, mode=starting_mode)
+        return {'FINISHED'}
 
-        armature = context.scene.mp_edit_rig
-        armature_obj = selectObject(armature.name, 'ARMATURE')
-        armature_world_matrix_inverted = armature_obj.matrix_world.inverted()
-        bpy.ops.object.mode_set(mode='EDIT')
 
+# Live re-fit
+# While it's on, a depsgraph handler compares the watched meshes (facemesh, hands) with their last known vertex
+# positions, and looks up the bones that depend on the moved vertices in a reverse index of the mapping. A timer then
+# refits just those bones. Edit bones only exist in edit mode, so the timer waits for object mode if the user is
+# sculpting or editing, and the bones catch up as soon as they leave.
+
+def segment_positions(offsets, segments):
+    """Offsets and entry positions of the chosen CSR segments, concatenated in the order given"""
+    starts = offsets[segments]
+    lengths = offsets[segments + 1] - starts
+    selected_offsets = numpy.concatenate([[0], numpy.cumsum(lengths)]).astype(numpy.int64)
+    positions = numpy.repeat(starts - selected_offsets[:-1], lengths) + numpy.arange(selected_offsets[-1])
+    return selected_offsets, positions
+
+def select_groups(groups, rows):
+    """A compiled mapping cut down to the bones at rows"""
+    selected = {'bone_names': groups['bone_names'][rows]}
+    for end in ['head', 'tail']:
+        selected['%s_offsets' % end], positions = segment_positions(groups['%s_offsets' % end], rows)
+        selected['%s_indices' % end] = groups['%s_indices' % end][positions]
+    return selected
+
+def build_vertex_bone_index(groups):
+    """Reverse of a compiled mapping: CSR offsets over vertex index, and the rows of the bones that use each vertex"""
+    vertices = []
+    rows = []
+    for end in ['head', 'tail']:
+        offsets = groups['%s_offsets' % end]
+        vertices.append(groups['%s_indices' % end])
+        rows.append(numpy.repeat(numpy.arange(len(offsets) - 1), numpy.diff(offsets)))
+    vertices = numpy.concatenate(vertices)
+    rows = numpy.concatenate(rows)
+    unique = numpy.unique(vertices.astype(numpy.int64) * len(groups['bone_names']) + rows) # Bones using a vertex for both ends are listed once
+    vertices, rows = numpy.divmod(unique, len(groups['bone_names']))
+    offsets = numpy.searchsorted(vertices, numpy.arange(vertices.max() + 2 if len(vertices) else 1))
+    return offsets, rows
+
+def dependent_rows(vertex_bone_index, vertices):
+    """Rows of the bones that use any of vertices"""
+    offsets, rows = vertex_bone_index
+    vertices = vertices[vertices < len(offsets) - 1]
+    _, positions = segment_positions(offsets, vertices)
+    return numpy.unique(rows[positions])
+
+class LiveRefitter:
+    retry_interval = 0.25 # Seconds between checks while waiting for object mode
+    delay = 0.05 # Seconds to gather updates before refitting
+
+    def __init__(self):
+        self.enabled = False
+        self.snapshots = {} # Source -> (matrix_world, vertex coordinates) the bones were last fitted to
+        self.pending = {} # Source -> rows of the bones (in the source's mapping) to refit
+        self.vertex_bone_indexes = {}
+        self.mappings = {} # Source -> (signature, compiled mapping or None if it can't be fitted)
+        self.scheduled = False
+
+    def reset(self, scene=None):
+        """Forget what was seen and pending. With a scene, resolve its mappings and snapshot its sources so the next
+        edit is incremental"""
+        self.snapshots = {}
+        self.pending = {}
+        self.mappings = {}
+        if scene is not None:
+            for source, obj, groups, _ in self.sources(scene):
+                self.snapshots[source] = self.snapshot(obj, groups)
+
+    def sources(self, scene):
+        """(source, object, compiled mapping or None for eyes, bone suffix) for every watched object in the scene"""
+        watched = [
+            ('facemesh', scene.mp_facemesh, 'facemesh', ''),
+            ('hand.L', scene.mp_hand_left, 'hand', '.L'),
+            ('hand.R', scene.mp_hand_right, 'hand', '.R'),
+            ('eye.L', scene.mp_eye_left, None, ''),
+            ('eye.R', scene.mp_eye_right, None, ''),
+        ]
+        for source, mesh, kind, suffix in watched:
+            if mesh is None:
+                continue
+            try:
+                obj = findObjectByNameAndType(mesh.name, 'MESH')
+            except ObjectLookupError:
+                continue
+            if kind is None:
+                yield source, obj, None, suffix
+                continue
+            groups = self.mapping(source, obj, kind)
+            if groups is not None:
+                yield source, obj, groups, suffix
+
+    def mapping(self, source, obj, kind):
+        """The mapping for obj, only looked up again when the object, its vertex/edge count or the configs change.
+        mapping_for_mesh fingerprints every edge (and can run a registration), which is too slow for every update"""
+        signature = (obj.as_pointer(), len(obj.data.vertices), len(obj.data.edges), id(kind_mapping(kind)))
+        cached = self.mappings.get(source)
+        if cached is None or cached[0] != signature:
+            try:
+                groups = mapping_for_mesh(obj, kind)
+            except CorrespondenceError as e:
+                print('Live re-fit skips %s: %s' % (obj.name, e))
+                groups = None
+            cached = (signature, groups)
+            self.mappings[source] = cached
+        return cached[1]
+
+    def vertex_bone_index(self, groups):
+        cached = self.vertex_bone_indexes.get(id(groups))
+        if cached is None or cached[0] is not groups: # Mappings are replaced, not edited, when the configs reload
+            cached = (groups, build_vertex_bone_index(groups))
+            self.vertex_bone_indexes[id(groups)] = cached
+        return cached[1]
+
+    def snapshot(self, obj, groups):
+        coordinates = None if groups is None else read_vertex_coordinates(obj.data)
+        return numpy.array(obj.matrix_world), coordinates
+
+    def moved_rows(self, source, obj, groups):
+        """Rows of the bones affected by the changes to obj since the last snapshot, or None if it can't be fitted"""
+        previous = self.snapshots.get(source)
+        matrix, coordinates = self.snapshot(obj, groups)
+        if groups is None:
+            # Eye bones follow the eye's origin
+            self.snapshots[source] = (matrix, coordinates)
+            return numpy.zeros(0 if previous is not None and numpy.array_equal(previous[0], matrix) else 1, dtype=numpy.int64)
+        index = self.vertex_bone_index(groups)
+        if len(coordinates) < len(index[0]) - 1:
+            return None # Too few vertices for the mapping, the topology has been edited
+        self.snapshots[source] = (matrix, coordinates)
+        if previous is None or not numpy.array_equal(previous[0], matrix) or previous[1].shape != coordinates.shape:
+            return numpy.arange(len(groups['bone_names']))
+        moved = numpy.flatnonzero(numpy.any(previous[1] != coordinates, axis=1))
+        return dependent_rows(index, moved)
+
+    def check(self, scene, updated_objects):
+        """Queue up the bones depending on whatever changed in updated_objects"""
+        for source, obj, groups, _ in self.sources(scene):
+            if obj not in updated_objects:
+                continue
+            rows = self.moved_rows(source, obj, groups)
+            if rows is None or len(rows) == 0:
+                continue
+            self.pending[source] = numpy.union1d(self.pending.get(source, rows[:0]), rows)
+        if self.pending and not self.scheduled:
+            self.scheduled = True
+            bpy.app.timers.register(live_refit_timer, first_interval=self.delay)
+
+    def apply(self, context):
+        """Refit the pending bones. Returns when to try again, or None when done"""
+        if not self.enabled or not self.pending:
+            self.pending = {}
+            return None
+        scene = context.scene
+        try:
+            armature_obj = findObjectByNameAndType(scene.mp_edit_rig.name, 'ARMATURE')
+        except (AttributeError, ObjectLookupError):
+            self.pending = {} # No rig to fit
+            return None
+        in_edit_mode = armature_obj.mode == 'EDIT'
+        if not in_edit_mode and context.mode != 'OBJECT':
+            return self.retry_interval
+
+        view_layer = context.view_layer
+        active_obj = view_layer.objects.active
+        with operator_profiler.run('live_refit'):
+            if not in_edit_mode:
+                view_layer.objects.active = armature_obj
+                run_op(bpy.ops.object.mode_set, mode='EDIT')
+            try:
+                buffer = EditBoneBuffer(armature_obj)
+                eye_objs = {}
+                for source, obj, groups, suffix in self.sources(scene):
+                    rows = self.pending.get(source)
+                    if rows is None:
+                        continue
+                    if groups is None:
+                        eye_objs[source] = obj
+                    else:
+                        fit_bones_to_mesh(buffer, armature_obj, obj, select_groups(groups, rows), bone_suffix=suffix)
+                if eye_objs:
+                    fit_eye_bones(buffer, armature_obj.matrix_world.inverted(), eye_objs)
+                buffer.write()
+                self.pending = {}
+            finally:
+                if not in_edit_mode:
+                    run_op(bpy.ops.object.mode_set, mode='OBJECT')
+                    view_layer.objects.active = active_obj
+        return None
+
+live_refitter = LiveRefitter()
+
+def live_refit_timer():
+    interval = live_refitter.apply(bpy.context)
+    live_refitter.scheduled = interval is not None
+    return interval
+
+def set_live_refit(self, context):
+    live_refitter.enabled = self.mp_live_refit
+    live_refitter.reset(context.scene if live_refitter.enabled else None)
+
+@bpy.app.handlers.persistent
+def live_refit_depsgraph_update(scene, depsgraph):
+    if not live_refitter.enabled:
+        return
+    updated_objects = set()
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Object) and (update.is_updated_geometry or update.is_updated_transform):
+            updated_objects.add(update.id.original)
+    if updated_objects:
+        live_refitter.check(scene, updated_objects)
+
+@bpy.app.handlers.persistent
+def reset_live_refit(*args):
+    live_refitter.enabled = bpy.context.window_manager.mp_live_refit
+    live_refitter.reset()
+
+live_refit_handlers = [
+    (bpy.app.handlers.depsgraph_update_post, live_refit_depsgraph_update),
+    (bpy.app.handlers.load_post, reset_live_refit),
+]
+
+
+# Live posing
+# Landmarks are turned into head/tail target points for the metarig's face and hand bones (through the facemesh
+# mapping for the face, and the table below for the hands). The targets are aligned onto the rest pose with a
+# similarity transform, which removes the position, size and orientation of the head/hand, and each driven bone is
+# then rotated to point from its head target to its tail target.
+
+# MediaPipe hand landmark (head, tail) for each bone. 0 is the wrist, then 4 landmarks per finger from thumb to pinky
+hand_landmark_bones = {
+    'hand': (0, 9),
+    'thumb.01': (1, 2), 'thumb.02': (2, 3), 'thumb.03': (3, 4),
+    'palm.01': (0, 5), 'f_index.01': (5, 6), 'f_index.02': (6, 7), 'f_index.03': (7, 8),
+    'palm.02': (0, 9), 'f_middle.01': (9, 10), 'f_middle.02': (10, 11), 'f_middle.03': (11, 12),
+    'palm.03': (0, 13), 'f_ring.01': (13, 14), 'f_ring.02': (14, 15), 'f_ring.03': (15, 16),
+    'palm.04': (0, 17), 'f_pinky.01': (17, 18), 'f_pinky.02': (18, 19), 'f_pinky.03': (19, 20),
+}
+hand_static_bones = ('hand', 'palm.01', 'palm.02', 'palm.03', 'palm.04') # Only used to align the hand
+
+def image_landmarks_to_blender(landmarks, aspect=1.0):
+    """MediaPipe's x right, y down, z away from the camera to Blender's x right, y away from the camera, z up"""
+    return numpy.stack([landmarks[..., 0] * aspect, landmarks[..., 2] * aspect, -landmarks[..., 1]], axis=-1)
+
+def similarity_transform(source, target):
+    """4x4 scale, rotation and translation that best maps source points onto target points (Umeyama)"""
+    source_mean = source.mean(axis=0)
+    target_mean = target.mean(axis=0)
+    source_centered = source - source_mean
+    target_centered = target - target_mean
+    u, singular_values, vt = numpy.linalg.svd(target_centered.T @ source_centered / len(source))
+    signs = numpy.ones(3)
+    signs[2] = numpy.sign(numpy.linalg.det(u @ vt)) or 1.0 # Rotation, not reflection
+    rotation = (u * signs) @ vt
+    scale = (singular_values * signs).sum() / max((source_centered ** 2).sum(axis=1).mean(), 1e-12)
+    matrix = numpy.identity(4)
+    matrix[:3, :3] = scale * rotation
+    matrix[:3, 3] = target_mean - scale * rotation @ source_mean
+    return matrix
+
+class LivePoseSolver:
+    """Points the pose bones of the metarig at landmark targets"""
+
+    def __init__(self, armature_obj):
+        self.armature_obj = armature_obj
+        bones = armature_obj.data.bones
+        self.rows = {name: row for row, name in enumerate(bones.keys())}
+        self.rest_heads = numpy.empty(len(bones) * 3, dtype=numpy.float32)
+        self.rest_tails = numpy.empty(len(bones) * 3, dtype=numpy.float32)
+        bones.foreach_get('head_local', self.rest_heads)
+        bones.foreach_get('tail_local', self.rest_tails)
+        self.rest_heads = self.rest_heads.reshape(-1, 3)
+        self.rest_tails = self.rest_tails.reshape(-1, 3)
+
+        mapping_bones = facemesh_mapping['bone_names'].tolist()
+        self.face_mapping_rows = numpy.array([i for i, name in enumerate(mapping_bones) if name in self.rows], dtype=numpy.int64)
+        self.face_bones = [mapping_bones[i] for i in self.face_mapping_rows]
+        self.face_rows = numpy.array([self.rows[name] for name in self.face_bones], dtype=numpy.int64)
+        self.hand_bones = {}
         for side in ['L', 'R']:
-            hand = left_hand
-            hand_obj = left_hand_obj
-            if side == 'R':
-                hand = right_hand
-                hand_obj = right_hand_obj
-            
-            hand_world_matrix = hand_obj.matrix_world
-            for bone_name in hand_config_data['bone_positions'].keys():
-                sided_bone_name = '%s.%s' % (bone_name, side)
-                bone_id = armature.bones.find(sided_bone_name)
-                # Head
-                head_verts = hand_config_data['bone_positions'][bone_name]['head']
-                head_verts_cos_world = [hand_world_matrix @ hand.vertices[head].co for head in head_verts]
-                vert_co_world_sum = head_verts_cos_world[0]
-                for i in range(1, len(head_verts_cos_world)):
-                    vert_co_world_sum += head_verts_cos_world[i]
-                head_vert_co_world_avg = vert_co_world_sum / len(head_verts_cos_world)
-                armature_obj.data.edit_bones[bone_id].head = armature_world_matrix_inverted @ head_vert_co_world_avg
-                # Tail
-                tail_verts = hand_config_data['bone_positions'][bone_name]['tail']
-                tail_verts_cos_world = [hand_world_matrix @ hand.vertices[tail].co for tail in tail_verts]
-                vert_co_world_sum = tail_verts_cos_world[0]
-                for i in range(1, len(tail_verts_cos_world)):
-                    vert_co_world_sum += tail_verts_cos_world[i]
-                tail_vert_co_world_avg = vert_co_world_sum / len(tail_verts_cos_world)
-                armature_obj.data.edit_bones[bone_id].tail = armature_world_matrix_inverted @ tail_vert_co_world_avg
-
-        bpy.ops.object.mode_set(mode=starting_mode)
+            names = ['%s.%s' % (name, side) for name in hand_landmark_bones if '%s.%s' % (name, side) in self.rows]
+            self.hand_bones[side] = names
+
+        # Bones only rotate, so each bone's pose is its parent's pose times its rest offset from the parent times its rotation
+        driven = set(self.face_bones)
+        for side, names in self.hand_bones.items():
+            driven.update(name for name in names if name.rsplit('.', 1)[0] not in hand_static_bones)
+        self.driven = driven
+        needed = set()
+        for name in driven:
+            bone = bones[name]
+            while bone is not None and bone.name not in needed:
+                needed.add(bone.name)
+                bone = bone.parent
+        self.order = sorted(needed, key=lambda name: len(bones[name].parent_recursive))
+        self.rest_offsets = {}
+        for name in self.order:
+            bone = bones[name]
+            self.rest_offsets[name] = bone.matrix_local if bone.parent is None else bone.parent.matrix_local.inverted() @ bone.matrix_local
+
+    def _aligned_directions(self, names, rows, heads, tails):
+        """Armature space directions for bones, from landmark space head/tail targets (NaN where unknown)"""
+        known_heads = ~numpy.isnan(heads[:, 0])
+        known_tails = ~numpy.isnan(tails[:, 0])
+        source = numpy.concatenate([heads[known_heads], tails[known_tails]])
+        target = numpy.concatenate([self.rest_heads[rows[known_heads]], self.rest_tails[rows[known_tails]]])
+        if len(source) < 3:
+            return {}
+        matrix = similarity_transform(source, target)
+        # Bones whose head isn't in the mapping keep their rest head
+        heads = numpy.where(known_heads[:, None], transform_points(matrix, numpy.nan_to_num(heads)), self.rest_heads[rows])
+        tails = transform_points(matrix, tails)
+        directions = tails - heads
+        return {name: directions[i] for i, name in enumerate(names) if name in self.driven and not numpy.isnan(directions[i, 0])}
+
+    def face_directions(self, face_landmarks, aspect=1.0):
+        points = image_landmarks_to_blender(face_landmarks[:468, :3], aspect)
+        heads = grouped_mean(points, facemesh_mapping['head_offsets'], facemesh_mapping['head_indices'])[self.face_mapping_rows]
+        tails = grouped_mean(points, facemesh_mapping['tail_offsets'], facemesh_mapping['tail_indices'])[self.face_mapping_rows]
+        return self._aligned_directions(self.face_bones, self.face_rows, heads, tails)
+
+    def hand_directions(self, hand_landmarks, side):
+        """hand_landmarks are one hand's 21 world landmarks"""
+        names = self.hand_bones[side]
+        points = image_landmarks_to_blender(hand_landmarks[:, :3])
+        pairs = numpy.array([hand_landmark_bones[name.rsplit('.', 1)[0]] for name in names])
+        rows = numpy.array([self.rows[name] for name in names], dtype=numpy.int64)
+        return self._aligned_directions(names, rows, points[pairs[:, 0]], points[pairs[:, 1]])
+
+    def apply(self, directions):
+        """Rotate the pose bones so each bone in directions points along its armature space direction"""
+        pose_bones = self.armature_obj.pose.bones
+        bones = self.armature_obj.data.bones
+        y_axis = mathutils.Vector((0.0, 1.0, 0.0))
+        posed = {}
+        for name in self.order:
+            parent = bones[name].parent
+            base = self.rest_offsets[name] if parent is None else posed[parent.name] @ self.rest_offsets[name]
+            pose_bone = pose_bones[name]
+            direction = directions.get(name)
+            if direction is None:
+                posed[name] = base @ pose_bone.matrix_basis
+                continue
+            rotation = base.to_3x3().normalized()
+            swing = (rotation @ y_axis).rotation_difference(mathutils.Vector(direction))
+            basis_rotation = (rotation.inverted() @ swing.to_matrix() @ rotation).to_quaternion()
+            if pose_bone.rotation_mode == 'QUATERNION':
+                pose_bone.rotation_quaternion = basis_rotation
+            elif pose_bone.rotation_mode == 'AXIS_ANGLE':
+                axis, angle = basis_rotation.to_axis_angle()
+                pose_bone.rotation_axis_angle = (angle, axis.x, axis.y, axis.z)
+            else:
+                pose_bone.rotation_euler = basis_rotation.to_euler(pose_bone.rotation_mode)
+            posed[name] = base @ basis_rotation.to_matrix().to_4x4()
+
+    def apply_landmarks(self, results, aspect=1.0):
+        directions = {}
+        if 'face' in results and not numpy.isnan(results['face'][0, 0]):
+            directions.update(self.face_directions(results['face'], aspect))
+        if 'hands' in results:
+            hands = results['hands']
+            half = len(hands) // 2
+            # The stream doesn't mirror the camera, so MediaPipe's 'Left' hand (stored first) is the subject's right
+            for side, hand in [('R', hands[:half]), ('L', hands[half:])]:
+                if not numpy.isnan(hand[0, 0]):
+                    directions.update(self.hand_directions(hand, side))
+        self.apply(directions)
+
+# Shown in the panel while the webcam is live
+live_pose_stats = {'running': False}
+
+class LiveWebcamPoseOperator(bpy.types.Operator):
+    """Pose the metarig's face and hands from the webcam until Esc or right click"""
+    bl_idname = 'mp_tools.live_webcam_pose'
+    bl_label = 'Live webcam posing'
+
+    def invoke(self, context, event):
+        if live_pose_stats['running']:
+            live_pose_stats['running'] = False # Second press stops it
+            return {'CANCELLED'}
+        try:
+            armature_obj = findObjectByNameAndType(context.scene.mp_edit_rig.name, 'ARMATURE')
+        except (AttributeError, ObjectLookupError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        try:
+            inference = load_inference()
+        except ImportError as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        self.solver = LivePoseSolver(armature_obj)
+        roi_tracking = context.scene.mp_live_roi_tracking
+        self.stream = inference.LiveLandmarkStream(
+            camera=context.scene.mp_live_camera,
+            models=('face', 'hands'),
+            options={'face': {'roi_tracking': roi_tracking}, 'hands': {'world_landmarks': True, 'roi_tracking': roi_tracking}},
+        )
+        try:
+            self.stream.start()
+        except IOError as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        self.applied_sequence = None
+        self.timer = context.window_manager.event_timer_add(1.0 / context.scene.mp_live_target_fps, window=context.window)
+        context.window_manager.modal_handler_add(self)
+        live_pose_stats.clear()
+        live_pose_stats.update({'running': True, 'apply_ms': 0.0, 'latency_ms': 0.0})
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type in {'ESC', 'RIGHTMOUSE'} or not live_pose_stats['running'] or self.stream.error is not None:
+            return self.finish(context)
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        latest = self.stream.latest()
+        if latest is not None and latest[0] != self.applied_sequence:
+            sequence, captured, results = latest
+            started = time.perf_counter()
+            self.solver.apply_landmarks(results, self.stream.aspect)
+            now = time.perf_counter()
+            self.applied_sequence = sequence
+            live_pose_stats['apply_ms'] = (now - started) * 1000
+            live_pose_stats['latency_ms'] = (now - captured) * 1000
+        live_pose_stats.update(self.stream.timings)
+        for area in context.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
+        return {'PASS_THROUGH'}
+
+    def finish(self, context):
+        context.window_manager.event_timer_remove(self.timer)
+        self.stream.stop()
+        if self.stream.error is not None:
+            self.report({'ERROR'}, 'Live posing stopped: %s' % self.stream.error)
+        live_pose_stats['running'] = False
+        return {'FINISHED'}
+
+# Body fitting
+# The 33 MediaPipe Pose world landmarks (meters, centred on the hips) of every frame are rotated into a body frame
+# built from the hips and shoulders, and averaged over the frames with iteratively reweighted least squares, so bad
+# frames and hidden landmarks count for little. The average is projected onto the nearest left/right symmetric
+# skeleton (the least-squares fit under that constraint) and the limbs are rebuilt with the median segment lengths
+# over all frames. All of it works on whole (frames, 33, 3) arrays, so thousands of frames take milliseconds.
+
+# The pose landmark each landmark swaps with in a mirror image (MediaPipe numbers the subject's left side first)
+pose_mirror = [0, 4, 5, 6, 1, 2, 3, 8, 7, 10, 9, 12, 11, 14, 13, 16, 15, 18, 17, 20, 19, 22, 21, 24, 23, 26, 25, 28, 27, 30, 29, 32, 31]
+# (parent, child) landmarks of the left limbs, in the order they're rebuilt. The right limbs are their mirror
+pose_limb_segments = [(11, 13), (13, 15), (23, 25), (25, 27), (27, 29), (27, 31)]
+# Metarig bone: (head landmark, tail landmark) for the left side, bones ending at the ball of the foot are handled apart
+pose_limb_bones = {
+    'upper_arm': (11, 13),
+    'forearm': (13, 15),
+    'thigh': (23, 25),
+    'shin': (25, 27),
+}
+pose_torso_bones = ['spine', 'spine.001', 'spine.002', 'spine.003', 'pelvis.L', 'pelvis.R'] # Follow the hips -> shoulders line
+
+def body_frames(points):
+    """Per frame rotations into the body frame (x to the subject's left, y to their back, z up the spine) and hip centres"""
+    hips = (points[:, 23] + points[:, 24]) / 2
+    x = points[:, 23] - points[:, 24]
+    x /= numpy.linalg.norm(x, axis=-1, keepdims=True)
+    up = (points[:, 11] + points[:, 12]) / 2 - hips
+    z = up - (up * x).sum(axis=-1, keepdims=True) * x
+    z /= numpy.linalg.norm(z, axis=-1, keepdims=True)
+    y = numpy.cross(z, x)
+    return numpy.stack([x, y, z], axis=1), hips
+
+def nan_median(values):
+    """Median over the first axis ignoring NaNs (NaN where there's nothing else). numpy.nanmedian loops in Python per column"""
+    ordered = numpy.sort(values, axis=0) # NaNs sort last
+    counts = (~numpy.isnan(values)).sum(axis=0)
+    low = numpy.take_along_axis(ordered, numpy.maximum(counts - 1, 0)[numpy.newaxis] // 2, axis=0)[0]
+    high = numpy.take_along_axis(ordered, (counts // 2)[numpy.newaxis].clip(max=len(values) - 1), axis=0)[0]
+    return numpy.where(counts > 0, (low + high) / 2, numpy.nan)
+
+def robust_mean(points, weights, iterations=5, huber_k=1.5):
+    """Huber IRLS mean over the first axis of (frames, landmarks, 3) points, per landmark. Zero weights are ignored"""
+    valid = weights > 0
+    masked = numpy.where(valid[..., None], points, numpy.nan)
+    with numpy.errstate(invalid='ignore', divide='ignore'): # All-NaN landmarks stay NaN
+        mean = nan_median(masked)
+        points = numpy.where(valid[..., None], points, 0.0)
+        for _ in range(iterations):
+            residuals = numpy.sqrt(((points - mean) ** 2).sum(axis=-1))
+            scale = 1.4826 * nan_median(numpy.where(valid, residuals, numpy.nan)) + 1e-6
+            frame_weights = weights * numpy.minimum(1.0, huber_k * scale / numpy.maximum(residuals, 1e-12))
+            total = frame_weights.sum(axis=0)
+            mean = numpy.einsum('fl,flc->lc', frame_weights, points) / total[:, None]
+    return mean
+
+def mirror_landmarks(points):
+    return points[..., pose_mirror, :] * numpy.array([-1.0, 1.0, 1.0])
+
+def solve_body_skeleton(landmarks, min_visibility=0.5, iterations=5):
+    """Symmetric rest skeleton from (frames, 33, 4) pose world landmarks, as (33, 3) body frame positions in meters.
+
+    Frames where the hips or shoulders aren't visible are skipped. Raises ValueError if none are left.
+    """
+    landmarks = numpy.asarray(landmarks, dtype=numpy.float64)
+    points = image_landmarks_to_blender(landmarks[..., :3])
+    weights = numpy.where(landmarks[..., 3] >= min_visibility, landmarks[..., 3], 0.0)
+    weights[numpy.isnan(points).any(axis=-1)] = 0.0
+    usable = (weights[:, [11, 12, 23, 24]] > 0).all(axis=1)
+    if not usable.any():
+        raise ValueError('No frames with the hips and shoulders visible')
+    points, weights = points[usable], weights[usable]
+
+    rotations, hips = body_frames(points)
+    points = numpy.nan_to_num(points - hips[:, None]) @ rotations.transpose(0, 2, 1)
+    mean = robust_mean(points, weights, iterations)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        # Closest symmetric skeleton. A side that was never seen is taken from the other one
+        skeleton = numpy.nanmean(numpy.stack([mean, mirror_landmarks(mean)]), axis=0)
+
+        parents = numpy.array([parent for parent, _ in pose_limb_segments] + [pose_mirror[parent] for parent, _ in pose_limb_segments])
+        children = numpy.array([child for _, child in pose_limb_segments] + [pose_mirror[child] for _, child in pose_limb_segments])
+        visible = (weights[:, parents] > 0) & (weights[:, children] > 0)
+        lengths = numpy.where(visible, numpy.linalg.norm(points[:, children] - points[:, parents], axis=-1), numpy.nan)
+        lengths = nan_median(lengths)
+        lengths = numpy.nanmean(lengths.reshape(2, -1), axis=0) # Same length both sides
+    for side in [0, 1]:
+        for segment, (parent, child) in enumerate(pose_limb_segments):
+            if side:
+                parent, child = pose_mirror[parent], pose_mirror[child]
+            direction = skeleton[child] - skeleton[parent]
+            norm = numpy.linalg.norm(direction)
+            if norm > 0 and not numpy.isnan(lengths[segment]):
+                skeleton[child] = skeleton[parent] + direction / norm * lengths[segment]
+    return skeleton
+
+def rotation_between(a, b):
+    """Smallest 3x3 rotation turning direction a into direction b"""
+    a = a / numpy.linalg.norm(a)
+    b = b / numpy.linalg.norm(b)
+    axis = numpy.cross(a, b)
+    sine = numpy.linalg.norm(axis)
+    cosine = numpy.dot(a, b)
+    if sine < 1e-9:
+        if cosine > 0:
+            return numpy.identity(3)
+        axis = numpy.cross(a, [1.0, 0.0, 0.0] if abs(a[0]) < 0.9 else [0.0, 1.0, 0.0]) # Half turn about any perpendicular axis
+        axis /= numpy.linalg.norm(axis)
+        sine = 0.0
+    else:
+        axis /= sine
+    cross_matrix = numpy.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+    return numpy.identity(3) + sine * cross_matrix + (1 - cosine) * cross_matrix @ cross_matrix
+
+def fit_body_bones(buffer, armature_obj, skeleton):
+    """Set the torso, arm and leg rest bones from a solve_body_skeleton skeleton. The rest of the rig moves along"""
+    bones = armature_obj.data.edit_bones
+    old_heads = buffer.heads.copy()
+    old_tails = buffer.tails.copy()
+    row = buffer.rows
+    # Meters in the body frame to armature space, with the hips over the old hips and the feet on the old floor
+    joints = skeleton @ numpy.asarray(armature_obj.matrix_world.inverted().to_3x3(), dtype=numpy.float64).T
+    feet = [row[name] for side in ['L', 'R'] for name in ['foot.%s' % side, 'toe.%s' % side, 'heel.02.%s' % side] if name in row]
+    floor = min(old_heads[feet, 2].min(), old_tails[feet, 2].min()) if feet else 0.0
+    hips = (joints[23] + joints[24]) / 2
+    offset = old_heads[row['spine']] - hips
+    offset[2] = floor - numpy.nanmin(joints[[27, 28, 29, 30, 31, 32], 2])
+    joints += offset
+    hips = (joints[23] + joints[24]) / 2
+    shoulders = (joints[11] + joints[12]) / 2
+
+    fitted = set()
+    # The torso keeps its shape, scaled and turned onto the hips -> shoulders line
+    old_bottom, old_top = old_heads[row['spine']], old_tails[row['spine.003']]
+    scale = numpy.linalg.norm(shoulders - hips) / numpy.linalg.norm(old_top - old_bottom)
+    linear = scale * rotation_between(old_top - old_bottom, shoulders - hips)
+    torso_rows = [row[name] for name in pose_torso_bones if name in row]
+    buffer.heads[torso_rows] = (old_heads[torso_rows] - old_bottom) @ linear.T + hips
+    buffer.tails[torso_rows] = (old_tails[torso_rows] - old_bottom) @ linear.T + hips
+    fitted.update(torso_rows)
+
+    for side, flip in [('L', False), ('R', True)]:
+        def joint(index):
+            return joints[pose_mirror[index] if flip else index]
+        for name, (head, tail) in pose_limb_bones.items():
+            bone_row = row.get('%s.%s' % (name, side))
+            if bone_row is not None and not numpy.isnan([joint(head), joint(tail)]).any():
+                buffer.heads[bone_row], buffer.tails[bone_row] = joint(head), joint(tail)
+                fitted.add(bone_row)
+        shoulder_row = row.get('shoulder.%s' % side)
+        if shoulder_row is not None and not numpy.isnan(joint(11)).any():
+            buffer.heads[shoulder_row] = (old_heads[shoulder_row] - old_bottom) @ linear.T + hips
+            buffer.tails[shoulder_row] = joint(11)
+            fitted.add(shoulder_row)
+        foot_row, toe_row = row.get('foot.%s' % side), row.get('toe.%s' % side)
+        if foot_row is not None and toe_row is not None and not numpy.isnan([joint(27), joint(31)]).any():
+            # The ball of the foot divides ankle -> toe tip like it did before
+            old_foot = numpy.linalg.norm(old_tails[foot_row] - old_heads[foot_row])
+            old_toe = numpy.linalg.norm(old_tails[toe_row] - old_heads[toe_row])
+            ball = joint(27) + (joint(31) - joint(27)) * old_foot / (old_foot + old_toe)
+            buffer.heads[foot_row], buffer.tails[foot_row] = joint(27), ball
+            buffer.heads[toe_row], buffer.tails[toe_row] = ball, joint(31)
+            fitted.update([foot_row, toe_row])
+
+    # Everything else moves with its parent, by as much as the parent's tail moved (so connected bones stay connected)
+    depths = {}
+    for bone in bones:
+        depth, parent = 0, bone.parent
+        while parent is not None:
+            depth, parent = depth + 1, parent.parent
+        depths[bone.name] = depth
+    moved = {}
+    for bone in sorted(bones, key=lambda bone: depths[bone.name]):
+        bone_row = row[bone.name]
+        if bone_row in fitted:
+            moved[bone_row] = buffer.tails[bone_row] - old_tails[bone_row]
+            continue
+        parent_row = row[bone.parent.name] if bone.parent is not None else None
+        delta = numpy.zeros(3) if parent_row is None else moved[parent_row]
+        buffer.heads[bone_row] = old_heads[bone_row] + delta
+        buffer.tails[bone_row] = old_tails[bone_row] + delta
+        moved[bone_row] = delta
+    operator_profiler.count(bones=len(fitted))
+
+def read_pose_take(filepath):
+    """The landmarks of a take recorded with the pose model in world landmarks, memory mapped if uncompressed"""
+    with mediapipe_toolbox_takes.TakeReader(filepath) as reader:
+        if reader.kind != 'landmarks' or reader.metadata.get('model') != 'pose' or not reader.metadata.get('world_landmarks'):
+            raise ValueError('%s is not a pose take with world landmarks' % filepath)
+        return reader.read()[0]
+
+class MetarigToBodyOperator(bpy.types.Operator):
+    """Position the torso, arm and leg bones of the metarig from MediaPipe Pose, on an image or a video of the person"""
+    bl_idname = 'mp_tools.metarig_to_body'
+    bl_label = 'Metarig to Body'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    filepath: bpy.props.StringProperty(subtype='FILE_PATH') # Image, video, or a pose take (.mptake)
+    min_visibility: bpy.props.FloatProperty(
+        name="Min Visibility",
+        description="Landmarks MediaPipe is less sure of than this are left out of the fit",
+        default=0.5,
+        min=0.0,
+        max=1.0,
+    )
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    @profiled
+    def execute(self, context):
+        starting_mode = bpy.context.object.mode
+        filepath = bpy.path.abspath(self.filepath)
+        try:
+            armature_obj = findObjectByNameAndType(context.scene.mp_edit_rig.name, 'ARMATURE')
+            with operator_profiler.phase('landmarks'):
+                if filepath.lower().endswith(mediapipe_toolbox_takes.take_extension):
+                    landmarks = read_pose_take(filepath)
+                else:
+                    landmarks = load_inference().cached_landmarks(filepath, 'pose', {'world_landmarks': True})
+            with operator_profiler.phase('solve_body'):
+                skeleton = solve_body_skeleton(landmarks, self.min_visibility)
+        except (AttributeError, ObjectLookupError, ImportError, IOError, ValueError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        armature_obj = selectObject(armature_obj.data.name, 'ARMATURE')
+        run_op(bpy.ops.object.mode_set, mode='EDIT')
+        buffer = EditBoneBuffer(armature_obj)
+        with operator_profiler.phase('fit_body'):
+            fit_body_bones(buffer, armature_obj, skeleton)
+        buffer.write()
+        run_op(bpy.ops.object.mode_set, mode=starting_mode)
+        self.report({'INFO'}, 'Fitted the body to %s frames' % len(landmarks))
+        return {'FINISHED'}
+
+class ExportRigFitOperator(bpy.types.Operator):
+    """Save the metarig's fitted rest bones to a take file, to load onto another rig or in another file"""
+    bl_idname = 'mp_tools.export_rig_fit'
+    bl_label = 'Export Rig Fit'
+
+    filepath: bpy.props.StringProperty(subtype='FILE_PATH')
+    compress: bpy.props.BoolProperty(name="Compress", default=False)
+
+    def invoke(self, context, event):
+        if not self.filepath:
+            self.filepath = 'rig_fit%s' % mediapipe_toolbox_takes.take_extension
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        try:
+            armature_obj = findObjectByNameAndType(context.scene.mp_edit_rig.name, 'ARMATURE')
+        except (AttributeError, ObjectLookupError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        if armature_obj.mode == 'EDIT':
+            armature_obj.update_from_editmode() # Bones only get the edit bones' positions when leaving edit mode
+        bones = armature_obj.data.bones
+        heads = numpy.empty(len(bones) * 3, dtype=numpy.float32)
+        tails = numpy.empty(len(bones) * 3, dtype=numpy.float32)
+        bones.foreach_get('head_local', heads)
+        bones.foreach_get('tail_local', tails)
+        mediapipe_toolbox_takes.write_bone_sets(
+            bpy.path.abspath(self.filepath), bones.keys(), heads.reshape(-1, 3), tails.reshape(-1, 3),
+            compression='zlib' if self.compress else None, metadata={'armature': armature_obj.data.name},
+        )
+        self.report({'INFO'}, 'Saved %s bones to %s' % (len(bones), self.filepath))
+        return {'FINISHED'}
+
+class ImportRigFitOperator(bpy.types.Operator):
+    """Set the metarig's rest bones from a take file saved by Export Rig Fit. Bones are matched by name"""
+    bl_idname = 'mp_tools.import_rig_fit'
+    bl_label = 'Import Rig Fit'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    filepath: bpy.props.StringProperty(subtype='FILE_PATH')
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    @profiled
+    def execute(self, context):
+        starting_mode = bpy.context.object.mode
+        try:
+            bone_names, heads, tails = mediapipe_toolbox_takes.read_bone_set(bpy.path.abspath(self.filepath))
+            armature_obj = selectObject(context.scene.mp_edit_rig.name, 'ARMATURE')
+        except (AttributeError, ObjectLookupError, IOError, ValueError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        run_op(bpy.ops.object.mode_set, mode='EDIT')
+        buffer = EditBoneBuffer(armature_obj)
+        rows = buffer.rows_for(bone_names)
+        found = rows >= 0
+        buffer.heads[rows[found]] = heads[found]
+        buffer.tails[rows[found]] = tails[found]
+        buffer.write()
+        run_op(bpy.ops.object.mode_set, mode=starting_mode)
+        if not found.all():
+            self.report({'WARNING'}, '%s bones in the file aren\'t in %s' % (int((~found).sum()), armature_obj.name))
+        return {'FINISHED'}
+
+class InstallDependenciesOperator(bpy.types.Operator):
+    """Install the Python modules the MediaPipe tools need. Runs in the background"""
+    bl_idname = 'mp_tools.install_dependencies'
+    bl_label = 'Install Dependencies'
+
+    def execute(self, context):
+        install_missing_modules()
+        return {'FINISHED'}
+
+class SaveProfileOperator(bpy.types.Operator):
+    """Save the recorded operator runs as JSON, or as a Chrome trace (chrome://tracing, Perfetto)"""
+    bl_idname = 'mp_tools.save_profile'
+    bl_label = 'Save Profile'
+
+    filepath: bpy.props.StringProperty(subtype='FILE_PATH')
+    trace_format: bpy.props.EnumProperty(
+        name="Format",
+        items=[
+            ('JSON', "JSON", "Every recorded run with its phases and counters"),
+            ('CHROME_TRACE', "Chrome Trace", "Trace Event Format, one event per run and per phase"),
+        ],
+    )
+
+    def invoke(self, context, event):
+        if not self.filepath:
+            self.filepath = 'mp_tools_profile.json' if self.trace_format == 'JSON' else 'mp_tools_trace.json'
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        data = operator_profiler.to_json() if self.trace_format == 'JSON' else operator_profiler.to_chrome_trace()
+        with open(bpy.path.abspath(self.filepath), 'w') as output_file:
+            json.dump(data, output_file, indent=1)
+        self.report({'INFO'}, 'Saved %s runs to %s' % (len(operator_profiler.runs), self.filepath))
         return {'FINISHED'}
 
+class ClearProfileOperator(bpy.types.Operator):
+    """Forget the recorded operator runs"""
+    bl_idname = 'mp_tools.clear_profile'
+    bl_label = 'Clear Profile'
+
+    def execute(self, context):
+        operator_profiler.runs.clear()
+        return {'FINISHED'}
 
 class MEDIAPIPE_TOOLBOX_PT_Panel(bpy.types.Panel):
     bl_label = "MediaPipe Toolbox"
@@ -350,6 +1916,14 @@ class MEDIAPIPE_TOOLBOX_PT_Panel(bpy.types.Panel):
         # view = context.space_data
         view = context.scene
 
+        if dependency_status['installing']:
+            layout.label(text="Installing dependencies...", icon='TIME')
+        elif len(dependency_status['missing']) > 0:
+            layout.label(text="Missing: %s" % ', '.join(dependency_status['missing']), icon='ERROR')
+            if dependency_status['error']:
+                layout.label(text=dependency_status['error'])
+            layout.operator(InstallDependenciesOperator.bl_idname)
+
         col = layout.column(align=True)
         sub = col.column()
         
@@ -365,12 +1939,35 @@ class MEDIAPIPE_TOOLBOX_PT_Panel(bpy.types.Panel):
         sub.prop(view, "mp_eye_right")
         sub.prop(view, "mp_hand_left")
         sub.prop(view, "mp_hand_right")
+        # Meshes the mappings fit as is can be saved as the reference for fitting other topologies
+        for kind, mesh, text in [('facemesh', view.mp_facemesh, "Save Facemesh as Reference"), ('hand', view.mp_hand_left, "Save Hand as Reference")]:
+            if mesh is not None and len(mesh.vertices) == mapping_vertex_counts[kind] and not os.path.isdir(reference_path(kind)):
+                col.operator(SaveReferenceMeshOperator.bl_idname, text=text).kind = kind
         # Fit rig to mesh button
         col.operator(CutoutFacemeshEyesOperator.bl_idname, text="Cutout Eye Sockets")
         # col.operator(AlignEyeBonesOperator.bl_idname, text="Rig Eyes")
         col.operator(MetarigToFacemeshOperator.bl_idname, text="Metarig to Facemesh and Eyes")
         col.operator(AlignHandsOperator.bl_idname, text="Metarig to Hands")
+        col.operator(MetarigToBodyOperator.bl_idname, text="Metarig to Body from Image/Video")
+        row = col.row(align=True)
+        row.operator(ExportRigFitOperator.bl_idname, text="Export Fit")
+        row.operator(ImportRigFitOperator.bl_idname, text="Import Fit")
         col.operator(RipFacemeshMouthOperator.bl_idname, text="Rip Mouth")
+        col.prop(context.window_manager, "mp_live_refit")
+
+        # Live posing
+        col = layout.column(align=True)
+        col.prop(view, "mp_live_camera")
+        col.prop(view, "mp_live_target_fps")
+        col.prop(view, "mp_live_roi_tracking")
+        running = live_pose_stats['running']
+        col.operator(LiveWebcamPoseOperator.bl_idname, text="Stop Webcam" if running else "Pose from Webcam", depress=running)
+        if running:
+            stats = col.column(align=True)
+            stats.label(text="Capture: %.1f ms (%.0f fps)" % (live_pose_stats.get('capture_ms', 0), live_pose_stats.get('capture_fps', 0)))
+            stats.label(text="Inference: %.1f ms (%.0f fps)" % (live_pose_stats.get('inference_ms', 0), live_pose_stats.get('inference_fps', 0)))
+            stats.label(text="Apply: %.1f ms, latency %.0f ms" % (live_pose_stats['apply_ms'], live_pose_stats['latency_ms']))
+            stats.label(text="Dropped frames: %s" % live_pose_stats.get('dropped_frames', 0))
 
 class TESTING_PT_Panel(bpy.types.Panel):
     bl_label = "Testing Tab"
@@ -394,13 +1991,42 @@ class TESTING_PT_Panel(bpy.types.Panel):
         
         sub.prop(view, "mp_edit_rig")
 
+        # Profiling
+        col = layout.column(align=True)
+        col.prop(context.window_manager, "mp_profiling")
+        if not context.window_manager.mp_profiling:
+            return
+        row = col.row(align=True)
+        row.operator(SaveProfileOperator.bl_idname, text="Save JSON").trace_format = 'JSON'
+        row.operator(SaveProfileOperator.bl_idname, text="Save Trace").trace_format = 'CHROME_TRACE'
+        row.operator(ClearProfileOperator.bl_idname, text="", icon='TRASH')
+        for run in operator_profiler.latest_runs():
+            box = layout.box()
+            box.label(text="%s: %.1f ms" % (run['operator'], run['duration_ms']))
+            stats = box.column(align=True)
+            stats.label(text="bpy.ops: %s, mode switches: %s" % (sum(run['ops'].values()), run['mode_switches']))
+            stats.label(text="Vertices: %s, bones: %s" % (run['vertices'], run['bones']))
+            phase_totals = collections.Counter()
+            for phase in run['phases']:
+                phase_totals[phase['name']] += phase['duration_ms']
+            for name, duration in phase_totals.most_common(5):
+                stats.label(text="  %s: %.2f ms" % (name, duration))
+
 classes = (
     AddRigOperator,
     MetarigToFacemeshOperator,
     CutoutFacemeshEyesOperator,
     RipFacemeshMouthOperator,
+    SaveReferenceMeshOperator,
     # AlignEyeBonesOperator,
     AlignHandsOperator,
+    LiveWebcamPoseOperator,
+    MetarigToBodyOperator,
+    ExportRigFitOperator,
+    ImportRigFitOperator,
+    InstallDependenciesOperator,
+    SaveProfileOperator,
+    ClearProfileOperator,
     MEDIAPIPE_TOOLBOX_PT_Panel,
     TESTING_PT_Panel,
 )
@@ -417,7 +2043,7 @@ def register():
         name="FaceMesh",
         description="FaceMesh generated from Mediapipe",
         type=bpy.types.Mesh,
-        poll=facemesh_vertex_count_match
+        poll=non_empty_mesh_in_use
     )
 
     bpy.types.Scene.mp_eye_left = bpy.props.PointerProperty(
@@ -436,24 +2062,62 @@ def register():
         name="Left Hand",
         description="The character's left hand",
         type=bpy.types.Mesh,
-        poll=realistic_hand_match
+        poll=non_empty_mesh_in_use
     )
 
     bpy.types.Scene.mp_hand_right = bpy.props.PointerProperty(
         name="Right Hand",
         description="The character's right hand",
         type=bpy.types.Mesh,
-        poll=realistic_hand_match
+        poll=non_empty_mesh_in_use
     )
 
-    if missing_modules:
-        install_missing_modules()
+    bpy.types.Scene.mp_live_camera = bpy.props.IntProperty(
+        name="Camera",
+        description="Index of the webcam to pose from",
+        default=0,
+        min=0,
+    )
+
+    bpy.types.Scene.mp_live_target_fps = bpy.props.FloatProperty(
+        name="Target FPS",
+        description="How often the newest landmarks are applied to the metarig",
+        default=30.0,
+        min=1.0,
+        max=120.0,
+    )
+
+    bpy.types.Scene.mp_live_roi_tracking = bpy.props.BoolProperty(
+        name="Track Face/Hands Region",
+        description="Run MediaPipe on a crop around the previous frame's landmarks, only searching the whole frame when they're lost. Much faster without a GPU",
+        default=False,
+    )
+
+    bpy.types.WindowManager.mp_profiling = bpy.props.BoolProperty(
+        name="Profile Operators",
+        description="Record time per phase, bpy.ops calls, mode switches and vertices/bones touched for each tool run",
+        default=False,
+        update=lambda self, context: setattr(operator_profiler, 'enabled', self.mp_profiling),
+    )
+
+    bpy.types.WindowManager.mp_live_refit = bpy.props.BoolProperty(
+        name="Live Re-fit",
+        description="Keep the metarig fitted to the facemesh, eyes and hands as they're edited, refitting only the bones whose vertices moved",
+        default=False,
+        update=set_live_refit,
+    )
+
+    dependency_status['missing'] = find_missing_modules()
 
     load_configs()
 
     for cls in classes:
         bpy.utils.register_class(cls)
 
+    for handlers, handler in scene_object_index_handlers + live_refit_handlers:
+        if handler not in handlers:
+            handlers.append(handler)
+
 def unregister():
     del bpy.types.Scene.mp_edit_rig
     del bpy.types.Scene.mp_facemesh
@@ -461,9 +2125,22 @@ def unregister():
     del bpy.types.Scene.mp_eye_right
     del bpy.types.Scene.mp_hand_left
     del bpy.types.Scene.mp_hand_right
+    del bpy.types.Scene.mp_live_camera
+    del bpy.types.Scene.mp_live_target_fps
+    del bpy.types.Scene.mp_live_roi_tracking
+    del bpy.types.WindowManager.mp_profiling
+    del bpy.types.WindowManager.mp_live_refit
+    live_refitter.enabled = False
+    if bpy.app.timers.is_registered(live_refit_timer):
+        bpy.app.timers.unregister(live_refit_timer)
+    live_refitter.scheduled = False
 
     for cls in classes:
         bpy.utils.unregister_class(cls)
 
+    for handlers, handler in scene_object_index_handlers + live_refit_handlers:
+        if handler in handlers:
+            handlers.remove(handler)
+
 if __name__ == '__main__':
     register()
\ No newline at end of file
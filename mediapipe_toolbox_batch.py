@@ -0,0 +1,333 @@
+"""Run the MediaPipe Toolbox steps over many files without the UI.
+
+    python mediapipe_toolbox_batch.py manifest.json --workers 8 --steps cutout_eyes metarig_to_facemesh
+
+The manifest is a json list of jobs (or {"jobs": [...]}). A job is either the path of a .blend file or an object:
+
+    {
+        "input": "characters/bob.blend",             # .blend file, or a facemesh .obj
+        "output": "fitted/bob.blend",                # Optional, defaults to <output dir>/<input name>.blend
+        "steps": ["metarig_to_facemesh"],            # Optional, defaults to the --steps the job has the objects for
+        "facemesh": "FaceMesh",                      # Optional object names (for .blend inputs) or .obj paths
+        "eye_left": "Eye.L", "eye_right": "Eye.R",
+        "hand_left": "Hand.L", "hand_right": "Hand.R",
+        "rig": "metarig"
+    }
+
+Jobs are fanned out over a pool of `blender --background --python mediapipe_toolbox_batch.py -- --worker` processes.
+Each worker registers the add-on once and then processes jobs sent over stdin until it runs out, so Blender's
+startup is only paid once per worker. A job that fails (or crashes or hangs its worker, which is then killed after
+--timeout seconds and restarted) is reported in the summary without stopping the other jobs.
+"""
+import argparse
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+# Steps in the order they're run, and the operator that runs them
+steps = {
+    'cutout_eyes': 'cutout_facemesh_eyes',
+    'metarig_to_facemesh': 'metarig_to_facemesh',
+    'metarig_to_hands': 'align_hands_bones',
+    'rip_mouth': 'rip_facemesh_mouth',
+}
+# Scene properties each step needs. Jobs without their own steps skip the steps they don't have the objects for
+step_inputs = {
+    'cutout_eyes': ['mp_facemesh'],
+    'metarig_to_facemesh': ['mp_facemesh'],
+    'metarig_to_hands': ['mp_hand_left', 'mp_hand_right'],
+    'rip_mouth': ['mp_facemesh'],
+}
+# Job object fields and the scene property they fill in
+object_fields = {
+    'rig': 'mp_edit_rig',
+    'facemesh': 'mp_facemesh',
+    'eye_left': 'mp_eye_left',
+    'eye_right': 'mp_eye_right',
+    'hand_left': 'mp_hand_left',
+    'hand_right': 'mp_hand_right',
+}
+ready_marker = '@@MP_TOOLBOX_READY@@'
+result_marker = '@@MP_TOOLBOX_RESULT@@'
+script_path = os.path.abspath(__file__)
+
+
+# Worker side, runs inside Blender
+
+def _import_obj(filepath):
+    import bpy
+    before = set(bpy.data.objects)
+    if hasattr(bpy.ops.wm, 'obj_import'):
+        bpy.ops.wm.obj_import(filepath=filepath)
+    else:
+        bpy.ops.import_scene.obj(filepath=filepath) # Blender < 3.2
+    imported = [obj for obj in bpy.data.objects if obj not in before and obj.type == 'MESH']
+    if len(imported) != 1:
+        raise ValueError('Expected one mesh in %s, found %s' % (filepath, len(imported)))
+    return imported[0]
+
+
+def _find_object(name, obj_type):
+    import bpy
+    obj = bpy.data.objects.get(name)
+    if obj is None or obj.type != obj_type:
+        raise ValueError('No %s object called %s' % (obj_type, name))
+    return obj
+
+
+def _assign_objects(job, from_files):
+    import bpy
+    import mediapipe_toolbox
+    scene = bpy.context.scene
+    for field, prop in object_fields.items():
+        value = job.get(field)
+        if field == 'facemesh' and value is None and from_files:
+            value = job['input']
+        if value is None:
+            continue
+        if field == 'rig':
+            setattr(scene, prop, _find_object(value, 'ARMATURE').data)
+        elif from_files:
+            setattr(scene, prop, _import_obj(value).data)
+        else:
+            setattr(scene, prop, _find_object(value, 'MESH').data)
+    if scene.mp_edit_rig is None:
+        import addon_utils
+        addon_utils.enable('rigify', default_set=False)
+        bpy.ops.mp_tools.add_rig_to_scene()
+    rig_obj = mediapipe_toolbox.findObjectByNameAndType(scene.mp_edit_rig.name, 'ARMATURE')
+    bpy.context.view_layer.objects.active = rig_obj # The operators need an active object
+
+
+def run_job(job, output_dir):
+    import bpy
+    result = {'input': job['input'], 'ok': False, 'output': None, 'steps': {}, 'skipped': [], 'error': None}
+    started = time.perf_counter()
+    try:
+        from_files = not job['input'].lower().endswith('.blend')
+        if from_files:
+            bpy.ops.wm.read_homefile(use_empty=True)
+        else:
+            bpy.ops.wm.open_mainfile(filepath=job['input'])
+        _assign_objects(job, from_files)
+
+        job_steps = job['steps']
+        if job.get('default_steps'):
+            scene = bpy.context.scene
+            job_steps = [step for step in job['steps'] if all(getattr(scene, prop) is not None for prop in step_inputs[step])]
+            result['skipped'] = [step for step in job['steps'] if step not in job_steps]
+        for step in job_steps:
+            step_started = time.perf_counter()
+            outcome = getattr(bpy.ops.mp_tools, steps[step])()
+            if 'FINISHED' not in outcome:
+                raise RuntimeError('Step %s returned %s' % (step, outcome))
+            result['steps'][step] = time.perf_counter() - step_started
+
+        output = job.get('output') or os.path.join(output_dir, '%s.blend' % os.path.splitext(os.path.basename(job['input']))[0])
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        bpy.ops.wm.save_as_mainfile(filepath=os.path.abspath(output))
+        result['output'] = output
+        result['ok'] = True
+    except Exception:
+        result['error'] = traceback.format_exc()
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def worker_main():
+    sys.path.insert(0, os.path.dirname(script_path))
+    import mediapipe_toolbox
+    mediapipe_toolbox.register()
+    sys.stdout.write('%s\n' % ready_marker)
+    sys.stdout.flush()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        message = json.loads(line)
+        result = run_job(message['job'], message['output_dir'])
+        sys.stdout.write('%s %s\n' % (result_marker, json.dumps(result)))
+        sys.stdout.flush()
+
+
+# Controller side, runs in any Python
+
+class BlenderWorker:
+    """A background Blender process that runs jobs sent to it one at a time. A job (or the startup) taking longer
+    than timeout seconds kills the process"""
+
+    def __init__(self, blender, timeout=None):
+        self.blender = blender
+        self.timeout = timeout
+        self.process = None
+        self.lines = None
+        self.log = []
+
+    def start(self):
+        self.log = []
+        self.process = subprocess.Popen(
+            [self.blender, '--background', '--factory-startup', '--python', script_path, '--', '--worker'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1,
+        )
+        # Output is read on a thread, so waiting for it can time out
+        self.lines = queue.Queue()
+        threading.Thread(target=self._pump, args=(self.process, self.lines), daemon=True).start()
+        try:
+            started = self._read_until(ready_marker)
+        except TimeoutError:
+            self.kill()
+            started = None
+        if started is None:
+            raise RuntimeError('Blender worker failed to start:\n%s' % ''.join(self.log[-50:]))
+
+    @staticmethod
+    def _pump(process, lines):
+        for line in process.stdout:
+            lines.put(line)
+        lines.put(None)
+
+    def _read_until(self, marker):
+        """Read the worker's output up to the line starting with marker and return that line, or None if it exits.
+        Raises TimeoutError if that takes longer than the timeout"""
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            try:
+                line = self.lines.get(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise TimeoutError()
+            if line is None:
+                return None
+            if line.startswith(marker):
+                return line[len(marker):]
+            self.log.append(line)
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+    def run(self, job, output_dir):
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        self.log = []
+        failure = {'input': job['input'], 'ok': False, 'output': None, 'steps': {}, 'skipped': []}
+        try:
+            self.process.stdin.write('%s\n' % json.dumps({'job': job, 'output_dir': output_dir}))
+            self.process.stdin.flush()
+            line = self._read_until(result_marker)
+        except TimeoutError:
+            # Hung (a stuck operator, a dialog, ...), the next job gets a fresh worker
+            self.kill()
+            return dict(failure, error='Timed out after %s seconds:\n%s' % (self.timeout, ''.join(self.log[-50:])))
+        except (BrokenPipeError, OSError):
+            line = None
+        if line is None:
+            # Blender crashed on this job, the next job gets a fresh worker
+            self.process.wait()
+            return dict(failure, error='Blender exited with code %s:\n%s' % (self.process.returncode, ''.join(self.log[-50:])))
+        return json.loads(line)
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+
+def load_manifest(path, default_steps):
+    with open(path, 'r') as input_file:
+        manifest = json.load(input_file)
+    if isinstance(manifest, dict):
+        manifest = manifest['jobs']
+    base_dir = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    for entry in manifest:
+        job = {'input': entry} if isinstance(entry, str) else dict(entry)
+        job['default_steps'] = 'steps' not in job
+        job.setdefault('steps', default_steps)
+        unknown = [step for step in job['steps'] if step not in steps]
+        if unknown:
+            raise ValueError('Unknown steps %s for %s, expected some of %s' % (unknown, job['input'], list(steps.keys())))
+        job['steps'] = [step for step in steps if step in job['steps']]
+        # Paths in the manifest are relative to the manifest
+        for field in ['input', 'output'] + list(object_fields.keys()):
+            value = job.get(field)
+            if value is not None and (field in ('input', 'output') or value.lower().endswith('.obj')):
+                job[field] = os.path.join(base_dir, value)
+        jobs.append(job)
+    return jobs
+
+
+def run_batch(jobs, blender='blender', workers=1, output_dir='output', timeout=None):
+    """Run jobs over a pool of Blender workers, returning the results in job order. Jobs taking longer than timeout
+    seconds fail"""
+    pending = queue.Queue()
+    for index, job in enumerate(jobs):
+        pending.put((index, job))
+    results = [None] * len(jobs)
+
+    def work():
+        worker = BlenderWorker(blender, timeout)
+        try:
+            while True:
+                try:
+                    index, job = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    results[index] = worker.run(job, output_dir)
+                except Exception:
+                    results[index] = {'input': job['input'], 'ok': False, 'output': None, 'steps': {}, 'skipped': [], 'error': traceback.format_exc()}
+                status = 'ok' if results[index]['ok'] else 'FAILED'
+                print('[%s/%s] %s %s' % (index + 1, len(jobs), status, job['input']), flush=True)
+        finally:
+            worker.close()
+
+    threads = [threading.Thread(target=work, daemon=True) for _ in range(max(1, min(workers, len(jobs))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run MediaPipe Toolbox steps over many files in background Blender processes')
+    parser.add_argument('manifest', help='json list of jobs, see the module docstring')
+    parser.add_argument('--blender', default=os.environ.get('BLENDER', 'blender'), help='Blender executable (default: $BLENDER or blender)')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2), help='Number of Blender processes')
+    parser.add_argument('--steps', nargs='+', default=list(steps.keys()), choices=list(steps.keys()), help='Steps for jobs that don\'t list their own, skipping those a job doesn\'t have the objects for')
+    parser.add_argument('--timeout', type=float, default=1800.0, help='Seconds a job may take before its Blender is killed, 0 for no limit')
+    parser.add_argument('--output-dir', default=None, help='Where jobs without an output are saved (default: output/ next to the manifest)')
+    parser.add_argument('--summary', default=None, help='Where to write the json summary (default: <output dir>/summary.json)')
+    args = parser.parse_args(argv)
+
+    output_dir = os.path.abspath(args.output_dir or os.path.join(os.path.dirname(os.path.abspath(args.manifest)), 'output'))
+    jobs = load_manifest(args.manifest, args.steps)
+    started = time.time()
+    results = run_batch(jobs, args.blender, args.workers, output_dir, args.timeout or None)
+    summary = {
+        'manifest': os.path.abspath(args.manifest),
+        'workers': args.workers,
+        'seconds': time.time() - started,
+        'succeeded': sum(1 for result in results if result['ok']),
+        'failed': sum(1 for result in results if not result['ok']),
+        'results': results,
+    }
+    summary_path = args.summary or os.path.join(output_dir, 'summary.json')
+    os.makedirs(os.path.dirname(os.path.abspath(summary_path)), exist_ok=True)
+    with open(summary_path, 'w') as output_file:
+        json.dump(summary, output_file, indent=2)
+    print('%s succeeded, %s failed, summary written to %s' % (summary['succeeded'], summary['failed'], summary_path))
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    # Blender passes the arguments after -- on to the script untouched
+    script_args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    if '--worker' in script_args:
+        worker_main()
+    else:
+        sys.exit(main())
@@ -0,0 +1,914 @@
+"""MediaPipe inference for the MediaPipe Toolbox add-on.
+
+This module doesn't import bpy, so the worker processes (which run Blender's bundled Python, not Blender itself)
+can import it.
+"""
+import abc
+import collections
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import struct
+import tempfile
+import threading
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import cv2
+import mediapipe
+import numpy
+from mediapipe.tasks.python import BaseOptions, vision
+
+# Landmarks per frame for each model. The first 468 face landmarks match the facemesh vertices, the last 10 are the
+# irises. Hands are stored by MediaPipe's handedness label, 'Left' first. MediaPipe expects mirrored (selfie) images,
+# so in an unmirrored camera image the 'Left' hand is the subject's right hand
+LANDMARK_COUNTS = {
+    'face': 478,
+    'hands': 42,
+    'pose': 33,
+}
+LANDMARK_CHANNELS = 4 # x, y, z, confidence
+
+# MediaPipe doesn't ship its models, they need to be downloaded into models_dir
+models_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'models')
+model_files = {
+    'face': 'face_landmarker.task',
+    'hands': 'hand_landmarker.task',
+    'pose': 'pose_landmarker_full.task',
+}
+
+
+def create_landmarker(model, options=None):
+    """Create a MediaPipe landmarker for one of the LANDMARK_COUNTS models. Each frame is treated as a separate image.
+
+    options are passed on to the landmarker's options, apart from model_path (overrides the model file),
+    world_landmarks (used when converting the results) and roi_tracking (see RoiTracker).
+    """
+    if model not in LANDMARK_COUNTS:
+        raise ValueError('Unknown landmark model %s, expected one of %s' % (model, list(LANDMARK_COUNTS.keys())))
+    options = dict(options or {})
+    options.pop('world_landmarks', None)
+    options.pop('roi_tracking', None)
+    model_path = options.pop('model_path', None) or os.path.join(models_dir, model_files[model])
+    if not os.path.isfile(model_path):
+        raise FileNotFoundError('MediaPipe model %s is missing, download it from https://developers.google.com/mediapipe/solutions/vision/' % model_path)
+    base_options = BaseOptions(model_asset_path=model_path)
+    if model == 'face':
+        return vision.FaceLandmarker.create_from_options(vision.FaceLandmarkerOptions(base_options=base_options, num_faces=1, **options))
+    if model == 'hands':
+        return vision.HandLandmarker.create_from_options(vision.HandLandmarkerOptions(base_options=base_options, num_hands=2, **options))
+    return vision.PoseLandmarker.create_from_options(vision.PoseLandmarkerOptions(base_options=base_options, num_poses=1, **options))
+
+
+def _fill_landmarks(out, landmarks, confidence=None):
+    values = []
+    for landmark in landmarks:
+        landmark_confidence = confidence
+        if landmark_confidence is None:
+            landmark_confidence = landmark.visibility if landmark.visibility is not None else landmark.presence
+        values.append((landmark.x, landmark.y, landmark.z, 1.0 if landmark_confidence is None else landmark_confidence))
+    out[:len(values)] = values
+
+
+def landmarks_to_array(model, results, world_landmarks=False):
+    """Convert a landmarker result to a (landmarks, 4) float32 array. Landmarks that weren't detected are NaN"""
+    out = numpy.full((LANDMARK_COUNTS[model], LANDMARK_CHANNELS), numpy.nan, dtype=numpy.float32)
+    if model == 'face':
+        if results.face_landmarks:
+            _fill_landmarks(out, results.face_landmarks[0])
+    elif model == 'hands':
+        hands = results.hand_world_landmarks if world_landmarks else results.hand_landmarks
+        for hand_landmarks, handedness in zip(hands, results.handedness):
+            category = handedness[0]
+            offset = 0 if category.category_name == 'Left' else LANDMARK_COUNTS['hands'] // 2
+            _fill_landmarks(out[offset:], hand_landmarks, confidence=category.score)
+    elif model == 'pose':
+        poses = results.pose_world_landmarks if world_landmarks else results.pose_landmarks
+        if poses:
+            _fill_landmarks(out, poses[0])
+    return out
+
+
+def _run_landmarker(landmarker, image_rgb, timestamp_ms=None):
+    image = mediapipe.Image(image_format=mediapipe.ImageFormat.SRGB, data=image_rgb)
+    if timestamp_ms is None:
+        return landmarker.detect(image)
+    return landmarker.detect_for_video(image, timestamp_ms)
+
+
+def detect_landmarks(landmarker, model, image_bgr, world_landmarks=False, timestamp_ms=None):
+    """Run a landmarker on a single BGR image (as read by cv2). Landmarkers in VIDEO mode need the timestamp_ms"""
+    results = _run_landmarker(landmarker, cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB), timestamp_ms)
+    return landmarks_to_array(model, results, world_landmarks)
+
+
+def _inference_worker(model, options, memory_name, frames_shape, tasks, results):
+    memory = shared_memory.SharedMemory(name=memory_name)
+    frames = numpy.ndarray(frames_shape, dtype=numpy.uint8, buffer=memory.buf)
+    world_landmarks = bool((options or {}).get('world_landmarks', False))
+    try:
+        try:
+            landmarker = create_landmarker(model, options)
+        except Exception:
+            results.put((None, None, None, traceback.format_exc()))
+            return
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            slot, frame_index = task
+            try:
+                landmarks = detect_landmarks(landmarker, model, frames[slot], world_landmarks)
+                results.put((slot, frame_index, landmarks, None))
+            except Exception:
+                results.put((slot, frame_index, None, traceback.format_exc()))
+        landmarker.close()
+    finally:
+        del frames # The buffer can't be closed while a view of it exists
+        memory.close()
+
+
+class VideoLandmarkPipeline:
+    """Decode a video with cv2 and run MediaPipe on the frames in a pool of worker processes.
+
+    Frames are decoded straight into a shared memory ring of queue_size slots, so only the slot index crosses the
+    process boundary. A slot is only reused once a worker has returned its result, which is the backpressure: at
+    most queue_size frames are decoded ahead of inference. Results are put back in frame order before being yielded,
+    only the small landmark arrays of results that came back early wait for that.
+    """
+
+    def __init__(self, model='face', workers=None, queue_size=None, options=None):
+        if model not in LANDMARK_COUNTS:
+            raise ValueError('Unknown landmark model %s, expected one of %s' % (model, list(LANDMARK_COUNTS.keys())))
+        self.model = model
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.queue_size = queue_size or self.workers * 2
+        self.options = options or {}
+
+    def stream(self, video_path, chunk_size=32):
+        """Yield (first_frame_index, landmarks) chunks in frame order, landmarks being a (frames, landmarks, 4) float32 array"""
+        if self.options.get('roi_tracking'):
+            yield from self._stream_tracked(video_path, chunk_size)
+            return
+        capture = cv2.VideoCapture(video_path)
+        if not capture.isOpened():
+            raise IOError('Could not open video %s' % video_path)
+        # The slots are sized from a decoded frame, the reported width and height are wrong for rotated videos
+        ok, first_frame = capture.read()
+        if not ok:
+            capture.release()
+            return
+        frames_shape = (self.queue_size,) + first_frame.shape
+        memory = shared_memory.SharedMemory(create=True, size=int(numpy.prod(frames_shape)))
+        frames = numpy.ndarray(frames_shape, dtype=numpy.uint8, buffer=memory.buf)
+
+        context = multiprocessing.get_context('spawn') # Forking Blender itself isn't safe
+        tasks = context.Queue()
+        results = context.Queue()
+        processes = [
+            context.Process(target=_inference_worker, args=(self.model, self.options, memory.name, frames_shape, tasks, results), daemon=True)
+            for _ in range(self.workers)
+        ]
+
+        free_slots = list(range(self.queue_size))
+        pending = {} # frame index -> landmarks, for results that came back out of order
+        decoded_frames = 0
+        next_frame = 0
+        finished_decoding = False
+        chunk = []
+        try:
+            for process in processes:
+                process.start()
+            while True:
+                while free_slots and not finished_decoding:
+                    slot = free_slots.pop()
+                    if first_frame is not None:
+                        ok, image = True, first_frame
+                        first_frame = None
+                    else:
+                        ok, image = capture.read(frames[slot])
+                    if not ok:
+                        free_slots.append(slot)
+                        finished_decoding = True
+                        break
+                    if not numpy.shares_memory(image, frames):
+                        if image.shape != frames.shape[1:]:
+                            raise ValueError('Frame %s of %s is %s, the first frame was %s' % (decoded_frames, video_path, image.shape, frames.shape[1:]))
+                        frames[slot] = image # cv2 decoded into its own buffer instead of the slot
+                    tasks.put((slot, decoded_frames))
+                    decoded_frames += 1
+
+                if finished_decoding and next_frame == decoded_frames:
+                    break
+
+                try:
+                    slot, frame_index, landmarks, error = results.get(timeout=1.0)
+                except queue.Empty:
+                    if not all(process.is_alive() for process in processes):
+                        raise RuntimeError('A landmark worker process exited unexpectedly')
+                    continue
+                if error is not None:
+                    if frame_index is None:
+                        raise RuntimeError('Could not start a landmark worker:\n%s' % error)
+                    raise RuntimeError('Landmark detection failed on frame %s of %s:\n%s' % (frame_index, video_path, error))
+                free_slots.append(slot)
+                pending[frame_index] = landmarks
+
+                while next_frame in pending:
+                    chunk.append(pending.pop(next_frame))
+                    next_frame += 1
+                    if len(chunk) == chunk_size:
+                        yield next_frame - len(chunk), numpy.stack(chunk)
+                        chunk = []
+            if chunk:
+                yield next_frame - len(chunk), numpy.stack(chunk)
+        finally:
+            for _ in processes:
+                tasks.put(None)
+            deadline = time.monotonic() + 5 # Shared by all the workers, they shut down at the same time
+            for process in processes:
+                process.join(timeout=max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    process.terminate()
+            capture.release()
+            del frames
+            memory.close()
+            memory.unlink()
+
+    def _stream_tracked(self, video_path, chunk_size):
+        """stream() with roi_tracking. Tracking needs every frame in order, so it runs here instead of in the workers"""
+        capture = cv2.VideoCapture(video_path)
+        if not capture.isOpened():
+            raise IOError('Could not open video %s' % video_path)
+        tracker = RoiTracker(self.model, self.options, fps=capture.get(cv2.CAP_PROP_FPS) or 30.0)
+        frame = None # The first decoded frame becomes the buffer the rest are decoded into
+        decoded_frames = 0
+        chunk = []
+        try:
+            while True:
+                ok, image = capture.read(frame)
+                if not ok:
+                    break
+                if frame is None:
+                    frame = image
+                chunk.append(tracker.track(image))
+                decoded_frames += 1
+                if len(chunk) == chunk_size:
+                    yield decoded_frames - len(chunk), numpy.stack(chunk)
+                    chunk = []
+            if chunk:
+                yield decoded_frames - len(chunk), numpy.stack(chunk)
+        finally:
+            tracker.close()
+            capture.release()
+
+
+def video_to_landmarks(video_path, model='face', workers=None, queue_size=None, options=None):
+    """Landmarks for every frame of a video as a single (frames, landmarks, 4) float32 array"""
+    pipeline = VideoLandmarkPipeline(model, workers=workers, queue_size=queue_size, options=options)
+    chunks = [landmarks for _, landmarks in pipeline.stream(video_path)]
+    if len(chunks) == 0:
+        return numpy.empty((0, LANDMARK_COUNTS[model], LANDMARK_CHANNELS), dtype=numpy.float32)
+    return numpy.concatenate(chunks)
+
+
+def image_to_landmarks(image_path, model='face', options=None):
+    """Landmarks for a single image as a (1, landmarks, 4) float32 array, so it can be used like a one frame video"""
+    image = cv2.imread(image_path)
+    if image is None:
+        raise IOError('Could not open image %s' % image_path)
+    landmarker = create_landmarker(model, options)
+    try:
+        landmarks = detect_landmarks(landmarker, model, image, bool((options or {}).get('world_landmarks', False)))
+    finally:
+        landmarker.close()
+    return landmarks[numpy.newaxis]
+
+
+# ROI tracking
+# A landmarker given a whole full resolution frame spends most of its time finding the subject again, in an image many
+# times bigger than its model's input. RoiTracker only searches the whole frame (downscaled) when it has to, and
+# otherwise runs on a crop around where the landmarks were in the previous frame.
+
+scored_models = ('hands', 'pose') # Their landmarks have a usable confidence, the face landmarker drops the face instead
+min_roi_size = 32 # pixels
+
+
+class RoiTracker:
+    """Landmarks for the consecutive frames of one video or camera, run on a crop around the previous frame's landmarks.
+
+    The whole frame, downscaled to detection_size on its long side, is only searched on the first frame, every
+    redetect_interval tracked frames (0 for never) and when tracking is lost: nothing found in the crop, fewer hands
+    than the last search found, or for hands and pose a median confidence under min_confidence. redetect_interval
+    defaults to about a second of frames for hands, so a hand coming into view outside the crop is picked up, and to
+    never for the face and pose. The crop is a square
+    margin (of the landmarks' size) bigger than the landmarks on every side, resized to input_size. The downscaled
+    frame and the crop are resized and colour converted into buffers that are only allocated once.
+
+    options are the same as for VideoLandmarkPipeline. The results are in full frame coordinates, like detect_landmarks.
+    """
+
+    def __init__(self, model='face', options=None, input_size=256, detection_size=640, margin=0.25, min_confidence=0.5, redetect_interval=None, fps=30.0):
+        options = dict(options or {})
+        self.model = model
+        self.world_landmarks = bool(options.get('world_landmarks', False))
+        self.input_size = input_size
+        self.detection_size = detection_size
+        self.margin = margin
+        self.min_confidence = min_confidence
+        if redetect_interval is None:
+            redetect_interval = max(1, int(round(fps))) if model == 'hands' else 0
+        self.redetect_interval = redetect_interval
+        self.frame_ms = 1000.0 / fps
+        self.detector = create_landmarker(model, dict(options, running_mode=vision.RunningMode.IMAGE))
+        # The crop follows the subject, so MediaPipe's own tracking from one video frame to the next still holds in it
+        self.tracker = create_landmarker(model, dict(options, running_mode=vision.RunningMode.VIDEO))
+        self.crop_bgr = numpy.zeros((input_size, input_size, 3), dtype=numpy.uint8)
+        self.crop_rgb = numpy.empty_like(self.crop_bgr)
+        self.detection_bgr = None # Allocated for the first frame's size
+        self.detection_rgb = None
+        self.roi = None # left, top, side of the square crop in pixels
+        self.expected_instances = 0 # Faces, hands or poses the last whole frame search found
+        self.tracked_frames = 0
+        self.frame_index = 0
+        self.stats = {'frames': 0, 'detections': 0}
+
+    def track(self, frame_bgr, timestamp_ms=None):
+        """(landmarks, 4) float32 array for the next frame. timestamp_ms defaults to frame number / fps"""
+        if timestamp_ms is None:
+            timestamp_ms = int(self.frame_index * self.frame_ms)
+        self.frame_index += 1
+        self.stats['frames'] += 1
+        height, width = frame_bgr.shape[:2]
+        landmarks = None
+        if self.roi is not None and not (self.redetect_interval and self.tracked_frames >= self.redetect_interval):
+            image_landmarks, landmarks = self._track(frame_bgr, timestamp_ms)
+            if self._lost(image_landmarks):
+                landmarks = None
+            else:
+                self.tracked_frames += 1
+        if landmarks is None:
+            image_landmarks, landmarks = self._detect(frame_bgr)
+            self.expected_instances = self._instances(image_landmarks)
+            self.tracked_frames = 0
+            self.stats['detections'] += 1
+        self.roi = self._roi(image_landmarks, width, height)
+        return landmarks
+
+    def close(self):
+        self.detector.close()
+        self.tracker.close()
+
+    def _results(self, results):
+        """Image landmarks (for the crop) and the landmarks to return, which are the same array unless world_landmarks"""
+        image_landmarks = landmarks_to_array(self.model, results)
+        if self.world_landmarks:
+            return image_landmarks, landmarks_to_array(self.model, results, world_landmarks=True)
+        return image_landmarks, image_landmarks
+
+    def _detect(self, frame_bgr):
+        height, width = frame_bgr.shape[:2]
+        scale = min(1.0, self.detection_size / max(height, width))
+        shape = (max(1, int(round(height * scale))), max(1, int(round(width * scale))), 3)
+        if self.detection_rgb is None or self.detection_rgb.shape != shape:
+            self.detection_bgr = numpy.empty(shape, dtype=numpy.uint8)
+            self.detection_rgb = numpy.empty(shape, dtype=numpy.uint8)
+        source = frame_bgr
+        if scale < 1.0:
+            # Normalized landmarks are the same in the downscaled frame
+            source = cv2.resize(frame_bgr, (shape[1], shape[0]), dst=self.detection_bgr, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(source, cv2.COLOR_BGR2RGB, dst=self.detection_rgb)
+        return self._results(_run_landmarker(self.detector, self.detection_rgb))
+
+    def _track(self, frame_bgr, timestamp_ms):
+        height, width = frame_bgr.shape[:2]
+        left, top, side = self.roi
+        # Only the part of the square inside the frame is copied, the rest of the crop is black
+        x0, y0, x1, y1 = max(left, 0), max(top, 0), min(left + side, width), min(top + side, height)
+        scale = self.input_size / side
+        crop_x0, crop_y0 = int(round((x0 - left) * scale)), int(round((y0 - top) * scale))
+        crop_x1, crop_y1 = int(round((x1 - left) * scale)), int(round((y1 - top) * scale))
+        if (crop_x0, crop_y0, crop_x1, crop_y1) != (0, 0, self.input_size, self.input_size):
+            self.crop_bgr[:] = 0
+        cv2.resize(frame_bgr[y0:y1, x0:x1], (crop_x1 - crop_x0, crop_y1 - crop_y0), dst=self.crop_bgr[crop_y0:crop_y1, crop_x0:crop_x1], interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.crop_bgr, cv2.COLOR_BGR2RGB, dst=self.crop_rgb)
+        image_landmarks, landmarks = self._results(_run_landmarker(self.tracker, self.crop_rgb, timestamp_ms))
+        # Back to full frame coordinates. MediaPipe's z is on the same scale as x
+        image_landmarks[:, 0] = (left + image_landmarks[:, 0] * side) / width
+        image_landmarks[:, 1] = (top + image_landmarks[:, 1] * side) / height
+        image_landmarks[:, 2] *= side / width
+        return image_landmarks, landmarks
+
+    def _instances(self, image_landmarks):
+        """How many hands (or faces or poses, at most one) have landmarks"""
+        found = ~numpy.isnan(image_landmarks[:, 0])
+        if self.model == 'hands':
+            return int(found.reshape(2, -1).any(axis=1).sum())
+        return int(found.any())
+
+    def _lost(self, image_landmarks):
+        instances = self._instances(image_landmarks)
+        if instances == 0 or instances < self.expected_instances:
+            return True
+        found = ~numpy.isnan(image_landmarks[:, 0])
+        return self.model in scored_models and float(numpy.median(image_landmarks[found, 3])) < self.min_confidence
+
+    def _roi(self, image_landmarks, width, height):
+        """Square crop around the landmarks for the next frame, or None to search the whole frame"""
+        points = image_landmarks[~numpy.isnan(image_landmarks[:, 0])]
+        if self.model in scored_models:
+            confident = points[points[:, 3] >= self.min_confidence]
+            if len(confident) > 0:
+                points = confident # Pose places landmarks it can't see, often outside the frame
+        if len(points) == 0:
+            return None
+        x = numpy.clip(points[:, 0], 0.0, 1.0) * width
+        y = numpy.clip(points[:, 1], 0.0, 1.0) * height
+        side = int(max(max(x.max() - x.min(), y.max() - y.min()) * (1 + 2 * self.margin), min_roi_size))
+        return int(round((x.min() + x.max() - side) / 2)), int(round((y.min() + y.max() - side) / 2)), side
+
+
+class LiveLandmarkStream:
+    """Capture frames from a camera and run MediaPipe on them in background threads.
+
+    The capture thread pushes frames into a small ring buffer, throwing away the oldest frame when it's full. The
+    inference thread always takes the newest frame and drops the rest, so results lag the camera by at most one
+    inference. latest() returns the newest results without blocking, for a Blender timer to pick up. Models with
+    roi_tracking in their options run through a RoiTracker.
+    """
+
+    def __init__(self, camera=0, models=('face', 'hands'), options=None, buffer_size=2):
+        self.camera = camera
+        self.models = tuple(models)
+        self.options = options or {} # model -> landmarker options
+        self.frames = collections.deque(maxlen=buffer_size)
+        self.condition = threading.Condition()
+        self.running = False
+        self.error = None
+        self.threads = []
+        self.capture = None
+        self.aspect = 1.0
+        self._latest = None
+        self.timings = {
+            'capture_ms': 0.0,
+            'capture_fps': 0.0,
+            'inference_ms': 0.0,
+            'inference_fps': 0.0,
+            'dropped_frames': 0,
+        }
+
+    def start(self):
+        self.capture = cv2.VideoCapture(self.camera)
+        if not self.capture.isOpened():
+            raise IOError('Could not open camera %s' % self.camera)
+        # Normalized landmarks are relative to the frame's width and height
+        self.aspect = self.capture.get(cv2.CAP_PROP_FRAME_WIDTH) / max(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT), 1)
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self._capture_loop, name='mp_toolbox_capture', daemon=True),
+            threading.Thread(target=self._inference_loop, name='mp_toolbox_inference', daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=2)
+        self.threads = []
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+    def latest(self):
+        """(sequence, timestamp, {model: landmarks}) of the newest inferred frame, or None before the first one"""
+        return self._latest
+
+    def _capture_loop(self):
+        frame_index = 0
+        last_frame = time.perf_counter()
+        while self.running:
+            started = time.perf_counter()
+            ok, frame = self.capture.read()
+            if not ok:
+                self.error = 'Camera %s stopped returning frames' % self.camera
+                break
+            now = time.perf_counter()
+            with self.condition:
+                if len(self.frames) == self.frames.maxlen:
+                    self.timings['dropped_frames'] += 1
+                self.frames.append((frame_index, now, frame))
+                self.condition.notify()
+            self.timings['capture_ms'] = (now - started) * 1000
+            self.timings['capture_fps'] = 1.0 / max(now - last_frame, 1e-6)
+            last_frame = now
+            frame_index += 1
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def _inference_loop(self):
+        landmarkers = {}
+        try:
+            for model in self.models:
+                model_options = self.options.get(model, {})
+                if model_options.get('roi_tracking'):
+                    landmarkers[model] = RoiTracker(model, model_options)
+                else:
+                    landmarkers[model] = create_landmarker(model, dict(model_options, running_mode=vision.RunningMode.VIDEO))
+        except Exception:
+            for landmarker in landmarkers.values():
+                landmarker.close()
+            self.error = traceback.format_exc()
+            self.running = False
+            return
+        world_landmarks = {model: bool(self.options.get(model, {}).get('world_landmarks', False)) for model in self.models}
+        stream_started = time.perf_counter()
+        last_result = stream_started
+        last_timestamp_ms = -1
+        try:
+            while True:
+                with self.condition:
+                    while self.running and len(self.frames) == 0:
+                        self.condition.wait()
+                    if not self.running:
+                        break
+                    frame_index, captured, frame = self.frames.pop()
+                    self.timings['dropped_frames'] += len(self.frames)
+                    self.frames.clear()
+                started = time.perf_counter()
+                # VIDEO mode rejects timestamps that don't increase, and frames can predate stream_started
+                timestamp_ms = max(int((captured - stream_started) * 1000), last_timestamp_ms + 1)
+                last_timestamp_ms = timestamp_ms
+                results = {}
+                for model, landmarker in landmarkers.items():
+                    if isinstance(landmarker, RoiTracker):
+                        results[model] = landmarker.track(frame, timestamp_ms)
+                    else:
+                        results[model] = detect_landmarks(landmarker, model, frame, world_landmarks[model], timestamp_ms)
+                now = time.perf_counter()
+                self._latest = (frame_index, captured, results) # Replaced in one assignment, so readers never see half of it
+                self.timings['inference_ms'] = (now - started) * 1000
+                self.timings['inference_fps'] = 1.0 / max(now - last_result, 1e-6)
+                last_result = now
+        except Exception:
+            self.error = traceback.format_exc()
+            self.running = False
+        finally:
+            for landmarker in landmarkers.values():
+                landmarker.close()
+
+
+# Temporal filtering
+# Raw landmarks jitter from frame to frame. The filters keep their state (one row per landmark) in NumPy arrays and
+# update every landmark of a frame at once, so a chunk only costs a handful of array operations per frame. State is
+# kept between calls, so chunks can be filtered as they stream in. Missing (NaN) landmarks stay NaN and lose their
+# state, so they restart from their next measurement instead of easing in from where they were before the gap.
+
+class LandmarkFilter(abc.ABC):
+    """Base class for filters over (frames, landmarks, 4) chunks. Only x, y, z are filtered, confidence is passed through"""
+
+    def __init__(self, frequency=30.0):
+        self.frequency = frequency
+        self.last_timestamp = None
+
+    def reset(self):
+        self.last_timestamp = None
+
+    def filter(self, chunk, timestamps=None):
+        """Filter a chunk of frames. timestamps (seconds, one per frame) are needed if frames aren't 1/frequency apart"""
+        chunk = numpy.asarray(chunk, dtype=numpy.float32)
+        filtered = chunk.copy()
+        for frame in range(len(chunk)):
+            if timestamps is None:
+                dt = 1.0 / self.frequency
+            else:
+                timestamp = float(timestamps[frame])
+                dt = 1.0 / self.frequency if self.last_timestamp is None else max(timestamp - self.last_timestamp, 1e-6)
+                self.last_timestamp = timestamp
+            filtered[frame, :, :3] = self._step(chunk[frame, :, :3].astype(numpy.float64), dt)
+        return filtered
+
+    @abc.abstractmethod
+    def _step(self, points, dt):
+        """Filter one frame's (landmarks, 3) float64 points, dt seconds after the last"""
+
+    def _start_missing(self, state, points):
+        """Landmarks without state take their measurement as is. Returns which ones were started"""
+        started = numpy.isnan(state[:, 0]) & ~numpy.isnan(points[:, 0])
+        state[started] = points[started]
+        return started
+
+
+class OneEuroFilter(LandmarkFilter):
+    """One Euro filter: smooths heavily when a landmark is still, and less as it speeds up to keep the lag down.
+
+    min_cutoff (Hz) sets the smoothing of still landmarks, beta how quickly the cutoff rises with speed.
+    """
+
+    def __init__(self, frequency=30.0, min_cutoff=1.0, beta=0.0, derivative_cutoff=1.0):
+        super().__init__(frequency)
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.derivative_cutoff = derivative_cutoff
+        self.previous = None
+        self.previous_derivative = None
+
+    def reset(self):
+        super().reset()
+        self.previous = None
+        self.previous_derivative = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        return 1.0 / (1.0 + 1.0 / (2 * numpy.pi * cutoff * dt))
+
+    def _step(self, points, dt):
+        if self.previous is None:
+            self.previous = numpy.full_like(points, numpy.nan)
+            self.previous_derivative = numpy.zeros_like(points)
+        started = self._start_missing(self.previous, points)
+        self.previous_derivative[started] = 0.0
+
+        derivative = (points - self.previous) / dt
+        derivative = self.previous_derivative + self._alpha(self.derivative_cutoff, dt) * (derivative - self.previous_derivative)
+        cutoff = self.min_cutoff + self.beta * numpy.linalg.norm(derivative, axis=1, keepdims=True)
+        filtered = self.previous + self._alpha(cutoff, dt) * (points - self.previous)
+
+        measured = ~numpy.isnan(points[:, 0])
+        self.previous[measured] = filtered[measured]
+        self.previous_derivative[measured] = derivative[measured]
+        self.previous[~measured] = numpy.nan
+        self.previous_derivative[~measured] = 0.0
+        filtered[~measured] = numpy.nan
+        return filtered
+
+
+class KalmanFilter(LandmarkFilter):
+    """Constant velocity Kalman filter, run independently on every coordinate of every landmark.
+
+    process_noise is the variance of the (unmodelled) acceleration, measurement_noise the variance of MediaPipe's
+    jitter, both in landmark units.
+    """
+
+    def __init__(self, frequency=30.0, process_noise=1.0, measurement_noise=1e-4):
+        super().__init__(frequency)
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.position = None
+
+    def reset(self):
+        super().reset()
+        self.position = None
+
+    def _step(self, points, dt):
+        if self.position is None:
+            self.position = numpy.full_like(points, numpy.nan)
+            self.velocity = numpy.zeros_like(points)
+            # Covariance [[p00, p01], [p01, p11]] per coordinate
+            self.p00 = numpy.zeros_like(points)
+            self.p01 = numpy.zeros_like(points)
+            self.p11 = numpy.zeros_like(points)
+        started = self._start_missing(self.position, points)
+        self.velocity[started] = 0.0
+        self.p00[started] = self.measurement_noise
+        self.p01[started] = 0.0
+        self.p11[started] = self.process_noise
+
+        # Predict
+        q = self.process_noise
+        position = self.position + self.velocity * dt
+        p00 = self.p00 + dt * (2 * self.p01 + dt * self.p11) + q * dt ** 3 / 3
+        p01 = self.p01 + dt * self.p11 + q * dt ** 2 / 2
+        p11 = self.p11 + q * dt
+
+        # Update
+        measured = ~numpy.isnan(points[:, 0])
+        innovation = points - position
+        s = p00 + self.measurement_noise
+        k0 = p00 / s
+        k1 = p01 / s
+        updated_position = position + k0 * innovation
+        updated_velocity = self.velocity + k1 * innovation
+        self.position[measured] = updated_position[measured]
+        self.velocity[measured] = updated_velocity[measured]
+        self.p00[measured] = ((1 - k0) * p00)[measured]
+        self.p01[measured] = ((1 - k0) * p01)[measured]
+        self.p11[measured] = (p11 - k1 * p01)[measured]
+        self.position[~measured] = numpy.nan
+        self.velocity[~measured] = 0.0
+        self.p00[~measured] = 0.0
+        self.p01[~measured] = 0.0
+        self.p11[~measured] = 0.0
+
+        return self.position.copy()
+
+
+landmark_filters = {
+    'one_euro': OneEuroFilter,
+    'kalman': KalmanFilter,
+}
+
+
+def filter_landmark_stream(chunks, landmark_filter):
+    """Filter the (first_frame_index, landmarks) chunks of a VideoLandmarkPipeline as they stream past"""
+    for first_frame, landmarks in chunks:
+        yield first_frame, landmark_filter.filter(landmarks)
+
+
+# Landmark cache
+# Running MediaPipe is by far the slowest step, so results are kept on disk as .npy files that are opened memory
+# mapped. Entries are keyed by the content of the image/video plus the model and the inference options, so changing
+# retargeting settings never re-runs inference but changing the footage or the options does.
+
+image_extensions = ('.bmp', '.jpeg', '.jpg', '.png', '.tif', '.tiff', '.webp')
+default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'mediapipe_toolbox', 'landmarks')
+default_cache_size = 4 * 1024 ** 3 # bytes
+
+
+def file_hash(path, block_size=1024 ** 2):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+file_hashes = {} # (path, size, mtime) -> content hash, so a file is only hashed again when it changes
+
+
+def cached_file_hash(path):
+    """file_hash, remembered for as long as the file's size and modification time stay the same"""
+    stat = os.stat(path)
+    signature = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if signature not in file_hashes:
+        file_hashes[signature] = file_hash(path)
+    return file_hashes[signature]
+
+
+def model_hash(model_path):
+    """Content hash of a model file, or None if it's missing (inference reports that)"""
+    try:
+        return cached_file_hash(model_path)
+    except OSError:
+        return None
+
+
+def _npy_header(shape, total_length=None):
+    """Version 1.0 .npy header for a float32 array, padded with spaces to total_length bytes if given"""
+    header = "{'descr': '<f4', 'fortran_order': False, 'shape': %r, }" % (tuple(int(size) for size in shape),)
+    if total_length is None:
+        total_length = -(-(10 + len(header) + 1) // 64) * 64 # Magic + length + header + newline, 64 byte aligned
+    header = header + ' ' * (total_length - 10 - len(header) - 1) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class LandmarkCacheWriter:
+    """Appends landmark chunks to a new cache entry. Nothing is visible in the cache until commit()"""
+
+    max_frames = 10 ** 12 # Only used to reserve enough room in the header for the real frame count
+
+    def __init__(self, cache, key, landmark_count, metadata):
+        self.cache = cache
+        self.key = key
+        self.landmark_count = landmark_count
+        self.metadata = metadata
+        self.frames = 0
+        self.file = tempfile.NamedTemporaryFile(dir=cache.cache_dir, prefix='%s-' % key, suffix='.tmp', delete=False)
+        self.header_length = len(_npy_header((self.max_frames, landmark_count, LANDMARK_CHANNELS)))
+        self.file.write(b'\0' * self.header_length)
+
+    def append(self, landmarks):
+        landmarks = numpy.ascontiguousarray(landmarks, dtype='<f4')
+        if landmarks.shape[1:] != (self.landmark_count, LANDMARK_CHANNELS):
+            raise ValueError('Expected (frames, %s, %s) landmarks, got %s' % (self.landmark_count, LANDMARK_CHANNELS, landmarks.shape))
+        self.file.write(landmarks.tobytes())
+        self.frames += len(landmarks)
+
+    def commit(self):
+        self.file.seek(0)
+        self.file.write(_npy_header((self.frames, self.landmark_count, LANDMARK_CHANNELS), self.header_length))
+        self.file.close()
+        os.replace(self.file.name, self.cache.entry_path(self.key))
+        self.cache._add_entry(self.key, self.frames, self.metadata)
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.file.name)
+
+
+class LandmarkCache:
+    """Size capped, least recently used cache of landmark arrays, stored as .npy files plus a manifest.json"""
+
+    def __init__(self, cache_dir=None, max_bytes=default_cache_size):
+        self.cache_dir = cache_dir or default_cache_dir
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(self.cache_dir, 'manifest.json')
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.entries = {}
+        if os.path.isfile(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r') as input_file:
+                    self.entries = json.load(input_file)['entries']
+            except (OSError, ValueError, KeyError) as e:
+                print('Ignoring unreadable landmark cache manifest %s: %s' % (self.manifest_path, e))
+        # Drop entries whose file went missing
+        self.entries = {key: entry for key, entry in self.entries.items() if os.path.isfile(self.entry_path(key))}
+
+    def key(self, media_path, model, options=None):
+        """Cache key for running model with options over the image/video at media_path"""
+        options = dict(options or {})
+        model_path = options.pop('model_path', None) or os.path.join(models_dir, model_files[model])
+        description = json.dumps({
+            'media': cached_file_hash(media_path), # Hashing a long video takes seconds, so not on every lookup
+            'model': model,
+            'model_file': os.path.basename(model_path),
+            'model_hash': model_hash(model_path), # A model replaced under the same name gets new entries
+            'options': options,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()[:32]
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, '%s.npy' % key)
+
+    def open(self, key):
+        """Memory mapped (frames, landmarks, 4) array for key, or None if it isn't cached"""
+        if key not in self.entries:
+            return None
+        try:
+            landmarks = numpy.load(self.entry_path(key), mmap_mode='r')
+        except (OSError, ValueError):
+            del self.entries[key]
+            self._save_manifest()
+            return None
+        self.entries[key]['last_used'] = time.time()
+        self._save_manifest()
+        return landmarks
+
+    def writer(self, key, model, metadata=None):
+        return LandmarkCacheWriter(self, key, LANDMARK_COUNTS[model], dict(metadata or {}, model=model))
+
+    def store(self, key, model, landmarks, metadata=None):
+        writer = self.writer(key, model, metadata)
+        writer.append(landmarks)
+        writer.commit()
+        return self.open(key)
+
+    def total_bytes(self):
+        return sum(entry['bytes'] for entry in self.entries.values())
+
+    def _add_entry(self, key, frames, metadata):
+        self.entries[key] = dict(metadata, frames=frames, bytes=os.path.getsize(self.entry_path(key)), last_used=time.time())
+        self.evict(keep=key)
+        self._save_manifest()
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the cache fits in max_bytes"""
+        total = self.total_bytes()
+        for key in sorted(self.entries, key=lambda key: self.entries[key]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(self.entry_path(key))
+            except OSError as e:
+                # Still memory mapped somewhere on Windows, try again next time
+                print('Could not evict landmark cache entry %s: %s' % (key, e))
+                continue
+            total -= self.entries.pop(key)['bytes']
+
+    def _save_manifest(self):
+        temp_path = '%s.tmp' % self.manifest_path
+        with open(temp_path, 'w') as output_file:
+            json.dump({'entries': self.entries}, output_file, indent=1)
+        os.replace(temp_path, self.manifest_path)
+
+
+def cached_landmarks(media_path, model='face', options=None, cache=None, workers=None, queue_size=None):
+    """Landmarks for an image or video, memory mapped from the landmark cache. MediaPipe only runs on a cache miss"""
+    cache = cache or LandmarkCache()
+    key = cache.key(media_path, model, options)
+    landmarks = cache.open(key)
+    if landmarks is not None:
+        return landmarks
+
+    metadata = {'source': os.path.abspath(media_path), 'options': {name: str(value) for name, value in (options or {}).items()}}
+    if media_path.lower().endswith(image_extensions):
+        return cache.store(key, model, image_to_landmarks(media_path, model, options), metadata)
+
+    writer = cache.writer(key, model, metadata)
+    try:
+        pipeline = VideoLandmarkPipeline(model, workers=workers, queue_size=queue_size, options=options)
+        for _, chunk in pipeline.stream(media_path):
+            writer.append(chunk)
+    except BaseException:
+        writer.discard()
+        raise
+    writer.commit()
+    return cache.open(key)
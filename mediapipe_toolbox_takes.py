@@ -0,0 +1,369 @@
+"""Compact binary files for landmark takes and fitted rigs (.mptake).
+
+Like mediapipe_toolbox_inference this module doesn't import bpy, and it only needs numpy, so takes can be recorded on
+a capture machine and loaded on a Blender workstation without MediaPipe installed:
+
+    python mediapipe_toolbox_takes.py record capture.mp4 capture.mptake --model pose --float16 --compression zlib
+    python mediapipe_toolbox_takes.py info capture.mptake
+
+A take is a sequence of frames, each an array of frame_shape (landmarks x 4 channels for a landmark take, bones x
+head/tail x 3 for a fitted rig), plus a confidence and a timestamp per frame. The file is:
+
+    header      magic, version, length of the metadata json, the metadata json (kind, dtype, frame_shape, ...)
+    chunks      chunk header, then the values, confidence and timestamps of chunk_frames frames
+    index       first frame, frame count and offset of every chunk
+    trailer     offset of the index, frame count, end magic
+
+Payloads start on 64 byte boundaries, so uncompressed chunks are read straight out of a memory map with no copying.
+Compressed chunks are byte shuffled (all the first bytes of the values, then all the second bytes, ...) before
+zlib/lzma, which compresses float arrays much better. A take whose writer never closed (a crashed capture) has no
+index, and is read by walking the chunk headers instead.
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import zlib
+
+import numpy
+
+take_extension = '.mptake'
+header_magic = b'MPTAKE\x00\x00'
+trailer_magic = b'MPTKEND\x00'
+chunk_magic = b'CHNK'
+index_magic = b'INDX'
+format_version = 1
+alignment = 64
+
+header_struct = struct.Struct('<8sIIQ') # magic, version, flags, metadata length
+chunk_struct = struct.Struct('<4sBBxxQIIQQQ') # magic, compression, shuffled, first frame, frame count, reserved, payload lengths
+index_entry_struct = struct.Struct('<QQQ') # first frame, frame count, chunk offset
+trailer_struct = struct.Struct('<QQ8s') # index offset, frame count, magic
+
+compressions = {None: 0, 'zlib': 1, 'lzma': 2}
+value_dtypes = ('float16', 'float32')
+
+
+def _padding(offset):
+    return -offset % alignment
+
+
+def _shuffle(array):
+    """Bytes of array grouped by their position within each element"""
+    data = numpy.ascontiguousarray(array).view(numpy.uint8).reshape(-1, array.dtype.itemsize)
+    return data.T.tobytes()
+
+
+def _unshuffle(data, dtype, count):
+    itemsize = numpy.dtype(dtype).itemsize
+    return numpy.frombuffer(data, dtype=numpy.uint8).reshape(itemsize, count).T.copy().view(dtype).ravel()
+
+
+def _compress(data, compression, level):
+    if compression == 'zlib':
+        return zlib.compress(data, 6 if level is None else level)
+    import lzma
+    return lzma.compress(data, preset=6 if level is None else level)
+
+
+def _decompress(data, compression_code):
+    if compression_code == compressions['zlib']:
+        return zlib.decompress(data)
+    import lzma
+    return lzma.decompress(data)
+
+
+class TakeWriter:
+    """Streams frames into a take file, a chunk at a time. Use as a context manager, or call close() when done"""
+
+    def __init__(self, path, frame_shape, dtype='float32', kind='landmarks', compression=None, compression_level=None, chunk_frames=256, metadata=None):
+        if dtype not in value_dtypes:
+            raise ValueError('Unsupported dtype %s, expected one of %s' % (dtype, value_dtypes))
+        if compression not in compressions:
+            raise ValueError('Unknown compression %s, expected one of %s' % (compression, list(compressions.keys())))
+        self.path = path
+        self.frame_shape = tuple(int(size) for size in frame_shape)
+        self.dtype = numpy.dtype(dtype)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.chunk_frames = chunk_frames
+        self.metadata = dict(metadata or {})
+        self.metadata.update({'kind': kind, 'dtype': self.dtype.name, 'frame_shape': list(self.frame_shape), 'compression': compression})
+        self.frame_count = 0
+        self.index = []
+        self.pending = []
+        self.pending_frames = 0
+
+        self.file = open(path, 'wb')
+        metadata_bytes = json.dumps(self.metadata).encode('utf-8')
+        self.file.write(header_struct.pack(header_magic, format_version, 0, len(metadata_bytes)))
+        self.file.write(metadata_bytes)
+        self.file.write(b'\x00' * _padding(self.file.tell()))
+
+    def append(self, values, confidence=None, timestamps=None):
+        """Add frames. values is (frames,) + frame_shape. Confidence defaults to the mean of the landmarks' confidence
+        channel (0 for frames with nothing detected), timestamps to the frame number divided by the metadata's fps"""
+        values = numpy.asarray(values)
+        if values.shape[1:] != self.frame_shape:
+            raise ValueError('Expected frames of shape %s, got %s' % (self.frame_shape, values.shape[1:]))
+        if len(values) == 0:
+            return
+        frames = numpy.arange(self.frame_count + self.pending_frames, self.frame_count + self.pending_frames + len(values))
+        if confidence is None:
+            if self.metadata['kind'] == 'landmarks' and self.frame_shape[-1] == 4:
+                channel = values[..., 3].reshape(len(values), -1).astype(numpy.float32)
+                detected = ~numpy.isnan(channel)
+                confidence = numpy.where(detected, channel, 0.0).sum(axis=1) / numpy.maximum(detected.sum(axis=1), 1)
+            else:
+                confidence = numpy.ones(len(values))
+        if timestamps is None:
+            timestamps = frames / float(self.metadata.get('fps') or 1.0)
+        self.pending.append((values.astype(self.dtype, copy=False), numpy.asarray(confidence, dtype=numpy.float32), numpy.asarray(timestamps, dtype=numpy.float64)))
+        self.pending_frames += len(values)
+        while self.pending_frames >= self.chunk_frames:
+            self._write_chunk(self.chunk_frames)
+
+    def flush(self):
+        """Write out the buffered frames as a (possibly short) chunk"""
+        if self.pending_frames:
+            self._write_chunk(self.pending_frames)
+        self.file.flush()
+
+    def _write_chunk(self, frame_count):
+        values, confidence, timestamps = (numpy.concatenate(parts) for parts in zip(*self.pending))
+        self.pending = [(values[frame_count:], confidence[frame_count:], timestamps[frame_count:])] if len(values) > frame_count else []
+        self.pending_frames = len(values) - frame_count
+        arrays = [values[:frame_count], confidence[:frame_count], timestamps[:frame_count]]
+
+        compression_code = 0
+        payloads = [numpy.ascontiguousarray(array).tobytes() for array in arrays]
+        if self.compression is not None:
+            compressed = [_compress(_shuffle(array), self.compression, self.compression_level) for array in arrays]
+            if sum(len(data) for data in compressed) < sum(len(data) for data in payloads):
+                payloads = compressed
+                compression_code = compressions[self.compression]
+
+        offset = self.file.tell()
+        self.file.write(chunk_struct.pack(chunk_magic, compression_code, int(compression_code != 0), self.frame_count, frame_count, 0, *(len(data) for data in payloads)))
+        for data in payloads:
+            self.file.write(b'\x00' * _padding(self.file.tell()))
+            self.file.write(data)
+        self.file.write(b'\x00' * _padding(self.file.tell()))
+        self.index.append((self.frame_count, frame_count, offset))
+        self.frame_count += frame_count
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        index_offset = self.file.tell()
+        self.file.write(index_magic + struct.pack('<Q', len(self.index)))
+        for entry in self.index:
+            self.file.write(index_entry_struct.pack(*entry))
+        self.file.write(trailer_struct.pack(index_offset, self.frame_count, trailer_magic))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TakeReader:
+    """Random access to the frames of a take file. Uncompressed chunks are views into a memory map of the file"""
+
+    def __init__(self, path, cached_chunks=4):
+        self.path = path
+        self.buffer = numpy.memmap(path, dtype=numpy.uint8, mode='r')
+        magic, version, _, metadata_length = header_struct.unpack_from(self.buffer, 0)
+        if magic != header_magic:
+            raise ValueError('%s is not a take file' % path)
+        if version > format_version:
+            raise ValueError('%s is take format version %s, this reads up to %s' % (path, version, format_version))
+        metadata_start = header_struct.size
+        self.metadata = json.loads(bytes(self.buffer[metadata_start:metadata_start + metadata_length]).decode('utf-8'))
+        self.kind = self.metadata['kind']
+        self.dtype = numpy.dtype(self.metadata['dtype'])
+        self.frame_shape = tuple(self.metadata['frame_shape'])
+        self.frame_size = int(numpy.prod(self.frame_shape))
+        self.data_start = metadata_start + metadata_length + _padding(metadata_start + metadata_length)
+        self.chunks = self._read_index()
+        if not self.chunks:
+            self.chunks = self._scan_chunks()
+        self.first_frames = numpy.array([first for first, _, _ in self.chunks], dtype=numpy.int64)
+        self.frame_count = self.chunks[-1][0] + self.chunks[-1][1] if self.chunks else 0
+        self.cached_chunks = cached_chunks
+        self.decoded = {} # Chunk number -> decompressed arrays, most recently used last
+
+    def _read_index(self):
+        if len(self.buffer) < self.data_start + trailer_struct.size:
+            return []
+        index_offset, _, magic = trailer_struct.unpack_from(self.buffer, len(self.buffer) - trailer_struct.size)
+        if magic != trailer_magic or bytes(self.buffer[index_offset:index_offset + 4]) != index_magic:
+            return []
+        count, = struct.unpack_from('<Q', self.buffer, index_offset + 4)
+        entries = numpy.frombuffer(self.buffer, dtype='<u8', count=count * 3, offset=index_offset + 12).reshape(-1, 3)
+        return [tuple(int(value) for value in entry) for entry in entries]
+
+    def _scan_chunks(self):
+        """Rebuild the index from the chunk headers, for takes that were never closed. A torn last chunk is dropped"""
+        chunks = []
+        offset = self.data_start
+        while offset + chunk_struct.size <= len(self.buffer):
+            magic, _, _, first_frame, frame_count, _, *lengths = chunk_struct.unpack_from(self.buffer, offset)
+            if magic != chunk_magic:
+                break
+            end = offset + chunk_struct.size
+            for length in lengths:
+                end += _padding(end) + length
+            end += _padding(end)
+            if end > len(self.buffer):
+                break
+            chunks.append((first_frame, frame_count, offset))
+            offset = end
+        return chunks
+
+    def __len__(self):
+        return self.frame_count
+
+    def chunk(self, number):
+        """(values, confidence, timestamps) of one chunk. Views into the file unless the chunk is compressed"""
+        decoded = self.decoded.pop(number, None)
+        if decoded is not None:
+            self.decoded[number] = decoded
+            return decoded
+        _, _, offset = self.chunks[number]
+        _, compression_code, shuffled, _, frame_count, _, *lengths = chunk_struct.unpack_from(self.buffer, offset)
+        position = offset + chunk_struct.size
+        arrays = []
+        for dtype, count, length in zip([self.dtype, numpy.float32, numpy.float64], [frame_count * self.frame_size, frame_count, frame_count], lengths):
+            position += _padding(position)
+            data = self.buffer[position:position + length]
+            if compression_code:
+                data = _decompress(bytes(data), compression_code)
+                array = _unshuffle(data, dtype, count) if shuffled else numpy.frombuffer(data, dtype=dtype, count=count)
+            else:
+                array = data.view(dtype)
+            arrays.append(array)
+            position += length
+        arrays[0] = arrays[0].reshape((frame_count,) + self.frame_shape)
+        if compression_code:
+            self.decoded[number] = tuple(arrays)
+            while len(self.decoded) > self.cached_chunks:
+                self.decoded.pop(next(iter(self.decoded)))
+        return tuple(arrays)
+
+    def frames(self, start=0, stop=None):
+        """(values, confidence, timestamps) for frames start to stop. Zero copy when they're in one uncompressed chunk"""
+        stop = self.frame_count if stop is None else min(stop, self.frame_count)
+        start = max(0, min(start, stop))
+        if start == stop:
+            return numpy.empty((0,) + self.frame_shape, dtype=self.dtype), numpy.empty(0, dtype=numpy.float32), numpy.empty(0, dtype=numpy.float64)
+        first = int(numpy.searchsorted(self.first_frames, start, side='right')) - 1
+        last = int(numpy.searchsorted(self.first_frames, stop - 1, side='right')) - 1
+        parts = []
+        for number in range(first, last + 1):
+            chunk_start = self.chunks[number][0]
+            parts.append([array[max(start - chunk_start, 0):stop - chunk_start] for array in self.chunk(number)])
+        if len(parts) == 1:
+            return tuple(parts[0])
+        return tuple(numpy.concatenate(arrays) for arrays in zip(*parts))
+
+    def read(self):
+        return self.frames(0, self.frame_count)
+
+    def __getitem__(self, frame):
+        if frame < 0:
+            frame += self.frame_count
+        if not 0 <= frame < self.frame_count:
+            raise IndexError('Frame %s is out of range for a %s frame take' % (frame, self.frame_count))
+        return self.frames(frame, frame + 1)[0][0]
+
+    def close(self):
+        # Frames handed out may still be views of the map, so it's left for them to release
+        self.decoded = {}
+        self.buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_landmark_take(path, landmarks, model, fps=None, confidence=None, timestamps=None, dtype='float32', compression=None, metadata=None):
+    """Save a (frames, landmarks, 4) array as a landmark take"""
+    metadata = dict(metadata or {}, model=model, fps=fps)
+    with TakeWriter(path, landmarks.shape[1:], dtype, 'landmarks', compression, metadata=metadata) as writer:
+        writer.append(landmarks, confidence, timestamps)
+
+
+def write_bone_sets(path, bone_names, heads, tails, dtype='float32', compression=None, metadata=None):
+    """Save fitted rest bones, heads and tails being (sets, bones, 3) or (bones, 3) armature space arrays"""
+    values = numpy.stack([numpy.asarray(heads), numpy.asarray(tails)], axis=-2)
+    if values.ndim == 3:
+        values = values[numpy.newaxis]
+    metadata = dict(metadata or {}, bone_names=list(bone_names))
+    with TakeWriter(path, values.shape[1:], dtype, 'bones', compression, metadata=metadata) as writer:
+        writer.append(values)
+
+
+def read_bone_set(path, number=-1):
+    """(bone names, heads, tails) of one fitted set in a bone take, the last one by default"""
+    with TakeReader(path) as reader:
+        if reader.kind != 'bones':
+            raise ValueError('%s is a %s take, not fitted bones' % (path, reader.kind))
+        values = numpy.array(reader[number], dtype=numpy.float32)
+        return reader.metadata['bone_names'], values[:, 0], values[:, 1]
+
+
+def record_video(video_path, take_path, model='face', dtype='float32', compression=None, world_landmarks=False, workers=None, roi_tracking=False):
+    """Run the landmark pipeline on a video and stream the landmarks into a take as they come"""
+    import cv2
+    import mediapipe_toolbox_inference
+    capture = cv2.VideoCapture(video_path)
+    fps = capture.get(cv2.CAP_PROP_FPS) or None
+    capture.release()
+    options = {'world_landmarks': world_landmarks, 'roi_tracking': roi_tracking}
+    metadata = {'model': model, 'fps': fps, 'source': os.path.abspath(video_path), 'world_landmarks': world_landmarks, 'roi_tracking': roi_tracking}
+    frame_shape = (mediapipe_toolbox_inference.LANDMARK_COUNTS[model], mediapipe_toolbox_inference.LANDMARK_CHANNELS)
+    pipeline = mediapipe_toolbox_inference.VideoLandmarkPipeline(model, workers=workers, options=options)
+    with TakeWriter(take_path, frame_shape, dtype, 'landmarks', compression, metadata=metadata) as writer:
+        for _, chunk in pipeline.stream(video_path):
+            writer.append(chunk)
+    return writer.frame_count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Record and inspect MediaPipe Toolbox take files')
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser('record', help='Landmark a video into a take')
+    record.add_argument('video')
+    record.add_argument('take')
+    record.add_argument('--model', default='face', choices=['face', 'hands', 'pose'])
+    record.add_argument('--world-landmarks', action='store_true', help='Hands and pose in meters rather than image coordinates')
+    record.add_argument('--float16', action='store_true', help='Store half precision values')
+    record.add_argument('--compression', default=None, choices=['zlib', 'lzma'])
+    record.add_argument('--workers', type=int, default=None)
+    record.add_argument('--roi-tracking', action='store_true', help='Track a crop around the landmarks in one process instead of searching every frame in the workers')
+    info = commands.add_parser('info', help='Print a take\'s metadata and layout')
+    info.add_argument('take')
+    args = parser.parse_args(argv)
+
+    if args.command == 'record':
+        frames = record_video(args.video, args.take, args.model, 'float16' if args.float16 else 'float32', args.compression, args.world_landmarks, args.workers, args.roi_tracking)
+        print('Wrote %s frames to %s (%.1f MB)' % (frames, args.take, os.path.getsize(args.take) / 1024 ** 2))
+        return 0
+
+    with TakeReader(args.take) as reader:
+        raw_bytes = reader.frame_count * (reader.frame_size * reader.dtype.itemsize + 4 + 8)
+        print(json.dumps(reader.metadata, indent=2))
+        print('%s frames of %s %s in %s chunks' % (reader.frame_count, reader.frame_shape, reader.dtype.name, len(reader.chunks)))
+        print('%.1f MB on disk, %.1f MB of data' % (os.path.getsize(args.take) / 1024 ** 2, raw_bytes / 1024 ** 2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
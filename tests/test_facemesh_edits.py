@@ -0,0 +1,94 @@
+"""Facemesh edit tests, run with Blender's Python (or the bpy module) and python -m pytest tests"""
+import os
+import sys
+
+import numpy
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+bpy = pytest.importorskip('bpy')
+
+import mediapipe_toolbox as toolbox
+
+
+@pytest.fixture(scope='module', autouse=True)
+def mappings():
+    toolbox.load_configs()
+
+
+@pytest.fixture
+def facemesh_obj():
+    """A 468 vertex stand-in for the facemesh: a strip of quads above and below the mouth rip_verts, so the lips are
+    joined along the chain like on the real mesh. The other vertices are left loose"""
+    rip_verts = toolbox.mapping_group(toolbox.facemesh_mapping, 'rip_verts', 'mouth').tolist()
+    others = [index for index in range(468) if index not in rip_verts]
+    above, below = others[:len(rip_verts)], others[len(rip_verts):2 * len(rip_verts)]
+    coordinates = numpy.random.default_rng(0).uniform(-1.0, 1.0, (468, 3))
+    for column, (top, lip, bottom) in enumerate(zip(above, rip_verts, below)):
+        coordinates[top] = [column, 1.0, 0.0]
+        coordinates[lip] = [column, 0.0, 0.0]
+        coordinates[bottom] = [column, -1.0, 0.0]
+    faces = []
+    for column in range(len(rip_verts) - 1):
+        faces.append([above[column], rip_verts[column], rip_verts[column + 1], above[column + 1]])
+        faces.append([rip_verts[column], below[column], below[column + 1], rip_verts[column + 1]])
+    mesh = bpy.data.meshes.new('facemesh')
+    mesh.from_pydata(coordinates.tolist(), [], faces)
+    obj = bpy.data.objects.new('facemesh', mesh)
+    yield obj
+    bpy.data.objects.remove(obj)
+    bpy.data.meshes.remove(mesh)
+
+
+def head_means(obj, groups):
+    return toolbox.grouped_mean(toolbox.read_vertex_coordinates(obj.data), groups['head_offsets'], groups['head_indices'])
+
+
+def test_ripped_facemesh_keeps_the_reference_mapping(facemesh_obj):
+    before = head_means(facemesh_obj, toolbox.mapping_for_mesh(facemesh_obj, 'facemesh'))
+    split = toolbox.rip_facemesh_mouth(facemesh_obj.data)
+    assert split == len(toolbox.mapping_group(toolbox.facemesh_mapping, 'rip_verts', 'mouth')) - 1
+    assert len(facemesh_obj.data.vertices) > 468
+
+    # Refitting after the rip uses the authored mapping, and the bones land where they did before
+    groups = toolbox.mapping_for_mesh(facemesh_obj, 'facemesh')
+    assert groups is toolbox.facemesh_mapping
+    numpy.testing.assert_allclose(head_means(facemesh_obj, groups), before, atol=1e-6)
+
+
+def test_other_edits_drop_the_reference_topology(facemesh_obj):
+    toolbox.rip_facemesh_mouth(facemesh_obj.data)
+    assert toolbox.has_reference_topology(facemesh_obj.data, 'facemesh')
+    mesh = facemesh_obj.data
+    mesh.vertices.add(1) # Anything else that changes the vertex count
+    assert not toolbox.has_reference_topology(mesh, 'facemesh')
+
+
+def grid(size):
+    """Vertices and edges of a size x size grid on the unit square"""
+    coordinates = numpy.array([[x / (size - 1), y / (size - 1), 0.0] for y in range(size) for x in range(size)])
+    edges = [(row * size + column, row * size + column + 1) for row in range(size) for column in range(size - 1)]
+    edges += [(row * size + column, (row + 1) * size + column) for row in range(size - 1) for column in range(size)]
+    return coordinates, numpy.array(edges)
+
+
+def test_transferred_loops_follow_the_target_edges():
+    # The border of a 4x4 grid transferred onto a 7x7 one, where the nearest vertices of neighbouring reference
+    # vertices are two edges apart
+    reference_coordinates, reference_edges = grid(4)
+    target_coordinates, target_edges = grid(7)
+    loop = [0, 1, 2, 3, 7, 11, 15, 14, 13, 12, 8, 4]
+    reference_edge_index = {tuple(sorted(edge)): index for index, edge in enumerate(reference_edges.tolist())}
+    loop_edges = [reference_edge_index[tuple(sorted(edge))] for edge in zip(loop, loop[1:] + loop[:1])]
+    groups = {'rip_verts_names': numpy.array(['eye.L', 'mouth']), 'eye_edges_names': numpy.array(['eye.L'])}
+    groups['rip_verts_offsets'], groups['rip_verts_indices'] = toolbox.compile_index_groups({'eye.L': loop, 'mouth': [0, 1, 2, 3]})
+    groups['eye_edges_offsets'], groups['eye_edges_indices'] = toolbox.compile_index_groups({'eye.L': loop_edges})
+    nearest = numpy.array([((target_coordinates - point) ** 2).sum(axis=1).argmin() for point in reference_coordinates])
+
+    transferred = toolbox.transfer_mapping(groups, nearest, reference_edges, target_edges, target_coordinates)
+    border = toolbox.mapping_group(transferred, 'rip_verts', 'eye.L').tolist()
+    assert len(border) == len(set(border)) == 24
+    target_edge_set = set(map(tuple, numpy.sort(target_edges, axis=1).tolist()))
+    assert all(tuple(sorted(edge)) in target_edge_set for edge in zip(border, border[1:] + border[:1]))
+    assert toolbox.mapping_group(transferred, 'rip_verts', 'mouth').tolist() == list(range(7))
+    assert len(toolbox.mapping_group(transferred, 'eye_edges', 'eye.L')) == 24
@@ -0,0 +1,109 @@
+"""Landmark cache tests, run with python -m pytest tests"""
+import os
+import sys
+
+import numpy
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pytest.importorskip('cv2')
+pytest.importorskip('mediapipe')
+
+import mediapipe_toolbox_inference as inference
+
+
+def landmarks(frames, model='face', value=0.0):
+    return numpy.full((frames, inference.LANDMARK_COUNTS[model], inference.LANDMARK_CHANNELS), value, dtype=numpy.float32)
+
+
+@pytest.fixture
+def media(tmp_path):
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(b'not really a video')
+    return str(path)
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    path = tmp_path / 'face_landmarker.task'
+    path.write_bytes(b'model one')
+    return str(path)
+
+
+def test_store_then_open_is_memory_mapped(tmp_path, media):
+    cache = inference.LandmarkCache(str(tmp_path / 'cache'))
+    key = cache.key(media, 'face')
+    assert cache.open(key) is None
+    stored = cache.store(key, 'face', landmarks(3, value=0.5))
+    assert isinstance(stored, numpy.memmap)
+    numpy.testing.assert_array_equal(stored, landmarks(3, value=0.5))
+
+
+def test_entries_survive_reopening(tmp_path, media):
+    cache = inference.LandmarkCache(str(tmp_path / 'cache'))
+    key = cache.key(media, 'face')
+    cache.store(key, 'face', landmarks(2))
+    reopened = inference.LandmarkCache(str(tmp_path / 'cache'))
+    assert reopened.open(key).shape == landmarks(2).shape
+
+
+def test_streamed_writer(tmp_path, media):
+    cache = inference.LandmarkCache(str(tmp_path / 'cache'))
+    key = cache.key(media, 'face')
+    writer = cache.writer(key, 'face')
+    writer.append(landmarks(2, value=1.0))
+    writer.append(landmarks(3, value=2.0))
+    assert cache.open(key) is None # Nothing is visible before commit
+    writer.commit()
+    stored = cache.open(key)
+    assert stored.shape[0] == 5
+    numpy.testing.assert_array_equal(stored[:, 0, 0], [1, 1, 2, 2, 2])
+
+
+def test_discarded_writer_leaves_nothing(tmp_path, media):
+    cache = inference.LandmarkCache(str(tmp_path / 'cache'))
+    key = cache.key(media, 'face')
+    writer = cache.writer(key, 'face')
+    writer.append(landmarks(2))
+    writer.discard()
+    assert cache.open(key) is None
+    assert os.listdir(cache.cache_dir) == []
+
+
+def test_least_recently_used_is_evicted(tmp_path, media):
+    entry_bytes = landmarks(10).nbytes
+    cache = inference.LandmarkCache(str(tmp_path / 'cache'), max_bytes=int(entry_bytes * 2.5))
+    keys = ['%032x' % number for number in range(3)]
+    cache.store(keys[0], 'face', landmarks(10))
+    cache.store(keys[1], 'face', landmarks(10))
+    cache.entries[keys[0]]['last_used'] = 0 # Used longest ago
+    cache.store(keys[2], 'face', landmarks(10))
+    assert cache.open(keys[0]) is None
+    assert cache.open(keys[1]) is not None
+    assert cache.open(keys[2]) is not None
+
+
+def test_key_changes_with_options_media_and_model(media, model_path, tmp_path):
+    cache = inference.LandmarkCache(str(tmp_path / 'cache'))
+    key = cache.key(media, 'face', {'model_path': model_path})
+    assert key == cache.key(media, 'face', {'model_path': model_path})
+    assert key != cache.key(media, 'face', {'model_path': model_path, 'world_landmarks': True})
+
+    with open(model_path, 'wb') as model_file:
+        model_file.write(b'model two, replaced under the same name')
+    model_key = cache.key(media, 'face', {'model_path': model_path})
+    assert model_key != key
+
+    with open(media, 'ab') as media_file:
+        media_file.write(b' but edited')
+    assert cache.key(media, 'face', {'model_path': model_path}) != model_key
+
+
+def test_media_is_only_hashed_once(media, tmp_path, monkeypatch):
+    cache = inference.LandmarkCache(str(tmp_path / 'cache'))
+    hashed = []
+    original = inference.file_hash
+    monkeypatch.setattr(inference, 'file_hash', lambda path: hashed.append(path) or original(path))
+    for _ in range(3):
+        cache.key(media, 'face')
+    assert hashed.count(media) == 1
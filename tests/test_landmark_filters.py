@@ -0,0 +1,49 @@
+"""Landmark filter tests, run with python -m pytest tests"""
+import os
+import sys
+
+import numpy
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pytest.importorskip('cv2')
+pytest.importorskip('mediapipe')
+
+import mediapipe_toolbox_inference as inference
+
+
+def landmark_track(xs):
+    """(frames, 2, 4) chunk: landmark 0 follows xs on every axis, landmark 1 stays at the origin"""
+    chunk = numpy.zeros((len(xs), 2, inference.LANDMARK_CHANNELS), dtype=numpy.float32)
+    chunk[:, 0, :3] = numpy.asarray(xs, dtype=numpy.float32)[:, None]
+    chunk[:, :, 3] = 1.0
+    return chunk
+
+
+@pytest.mark.parametrize('filter_class', list(inference.landmark_filters.values()))
+def test_gap_then_jump_restarts_from_the_new_measurement(filter_class):
+    chunk = landmark_track([0.0, numpy.nan, numpy.nan, 10.0, 10.0, 10.0])
+    filtered = filter_class().filter(chunk)
+    assert numpy.isnan(filtered[1:3, 0, :3]).all()
+    numpy.testing.assert_allclose(filtered[3:, 0, :3], 10.0, atol=1e-4)
+    numpy.testing.assert_allclose(filtered[:, 1, :3], 0.0, atol=1e-6)
+
+
+@pytest.mark.parametrize('filter_class', list(inference.landmark_filters.values()))
+def test_gap_across_chunks(filter_class):
+    landmark_filter = filter_class()
+    landmark_filter.filter(landmark_track([0.0, 0.0, numpy.nan]))
+    filtered = landmark_filter.filter(landmark_track([5.0, 5.0]))
+    numpy.testing.assert_allclose(filtered[:, 0, :3], 5.0, atol=1e-4)
+
+
+@pytest.mark.parametrize('filter_class', list(inference.landmark_filters.values()))
+def test_confidence_passes_through(filter_class):
+    chunk = landmark_track([0.0, 1.0, 2.0])
+    chunk[:, :, 3] = [[0.25], [0.5], [0.75]]
+    numpy.testing.assert_array_equal(filter_class().filter(chunk)[:, :, 3], chunk[:, :, 3])
+
+
+def test_base_filter_is_abstract():
+    with pytest.raises(TypeError):
+        inference.LandmarkFilter()
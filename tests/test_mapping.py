@@ -0,0 +1,90 @@
+"""Compiled mapping tests, run with Blender's Python (or the bpy module) and python -m pytest tests"""
+import json
+import os
+import shutil
+import sys
+
+import numpy
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pytest.importorskip('bpy')
+
+import mediapipe_toolbox as toolbox
+
+data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+
+@pytest.fixture
+def mapping_path(tmp_path):
+    """A copy of the facemesh mapping, so the compiled cache is written under tmp_path rather than data/"""
+    path = str(tmp_path / 'facemesh_rigify_mapping.json')
+    shutil.copy(os.path.join(data_dir, 'facemesh_rigify_mapping.json'), path)
+    return path
+
+
+def cache_entries(mapping_path):
+    return sorted(os.listdir(os.path.join(os.path.dirname(mapping_path), toolbox.mapping_cache_dir)))
+
+
+def test_index_groups_allow_none_and_single_ints():
+    offsets, indices = toolbox.compile_index_groups({'a': [3, 4], 'b': None, 'c': 7, 'd': []})
+    assert offsets.tolist() == [0, 2, 2, 3, 3]
+    assert indices.tolist() == [3, 4, 7]
+
+
+def test_compiled_groups_match_the_json(mapping_path):
+    with open(mapping_path) as mapping_file:
+        config_data = json.load(mapping_file)
+    compiled = toolbox.compile_mapping(mapping_path)
+    assert compiled['bone_names'].tolist() == list(config_data['bone_positions'].keys())
+    for row, (bone_name, ends) in enumerate(config_data['bone_positions'].items()):
+        for end in ['head', 'tail']:
+            expected = ends[end] if isinstance(ends[end], list) else [] if ends[end] is None else [ends[end]]
+            offsets = compiled['%s_offsets' % end]
+            assert compiled['%s_indices' % end][offsets[row]:offsets[row + 1]].tolist() == expected, bone_name
+    for section in ['eye_edges', 'rip_verts']:
+        for name, expected in config_data[section].items():
+            assert toolbox.mapping_group(compiled, section, name).tolist() == expected
+
+
+def test_compiled_mapping_is_cached_and_memory_mapped(mapping_path):
+    toolbox.compile_mapping(mapping_path)
+    entries = cache_entries(mapping_path)
+    assert len(entries) == 1
+    compiled = toolbox.compile_mapping(mapping_path)
+    assert cache_entries(mapping_path) == entries
+    assert isinstance(compiled['head_indices'], numpy.memmap)
+
+
+def test_editing_the_json_replaces_the_cache(mapping_path):
+    toolbox.compile_mapping(mapping_path)
+    with open(mapping_path) as mapping_file:
+        config_data = json.load(mapping_file)
+    bone_name = next(iter(config_data['bone_positions']))
+    config_data['bone_positions'][bone_name]['head'] = [1, 2, 3]
+    with open(mapping_path, 'w') as mapping_file:
+        json.dump(config_data, mapping_file)
+    old_entries = cache_entries(mapping_path)
+    after = toolbox.compile_mapping(mapping_path)
+    assert after['head_indices'][:after['head_offsets'][1]].tolist() == [1, 2, 3]
+    new_entries = cache_entries(mapping_path)
+    assert len(new_entries) == 1 and new_entries != old_entries # The stale cache is removed
+
+
+def test_grouped_mean_matches_numpy():
+    coordinates = numpy.random.default_rng(0).normal(size=(20, 3)).astype(numpy.float32)
+    groups = {'a': [0, 1, 2], 'b': None, 'c': [19], 'd': [5, 5, 6], 'e': []}
+    offsets, indices = toolbox.compile_index_groups(groups)
+    means = toolbox.grouped_mean(coordinates, offsets, indices)
+    assert means.shape == (5, 3)
+    for row, verts in enumerate(groups.values()):
+        if verts:
+            numpy.testing.assert_allclose(means[row], coordinates[verts].mean(axis=0), rtol=1e-6)
+        else:
+            assert numpy.isnan(means[row]).all()
+
+
+def test_grouped_mean_of_only_empty_groups():
+    offsets, indices = toolbox.compile_index_groups({'a': None, 'b': []})
+    assert numpy.isnan(toolbox.grouped_mean(numpy.zeros((4, 3)), offsets, indices)).all()
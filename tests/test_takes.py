@@ -0,0 +1,137 @@
+"""Take file tests, run with python -m pytest tests"""
+import os
+import sys
+
+import numpy
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mediapipe_toolbox_takes as takes
+
+
+def landmark_frames(frames, landmarks=50):
+    """(frames, landmarks, 4) of slowly moving points, with frame 3 undetected (NaN) like a dropped detection"""
+    values = numpy.zeros((frames, landmarks, 4), dtype=numpy.float32)
+    values[..., :3] = numpy.linspace(0.0, 1.0, frames)[:, None, None] + numpy.arange(landmarks)[None, :, None]
+    values[..., 3] = 0.9
+    values[3] = numpy.nan
+    return values
+
+
+def write_take(path, values, chunk_frames=4, **kwargs):
+    with takes.TakeWriter(str(path), values.shape[1:], chunk_frames=chunk_frames, metadata={'fps': 10}, **kwargs) as writer:
+        writer.append(values[:5])
+        writer.append(values[5:])
+    return str(path)
+
+
+@pytest.mark.parametrize('compression', list(takes.compressions.keys()))
+@pytest.mark.parametrize('dtype', takes.value_dtypes)
+def test_round_trip(tmp_path, compression, dtype):
+    values = landmark_frames(10)
+    path = write_take(tmp_path / ('take' + takes.take_extension), values, dtype=dtype, compression=compression)
+    with takes.TakeReader(path) as reader:
+        assert reader.kind == 'landmarks'
+        assert reader.metadata['fps'] == 10
+        assert reader.frame_count == len(reader) == 10
+        assert [frame_count for _, frame_count, _ in reader.chunks] == [4, 4, 2]
+        # The data compresses, so every chunk is stored with the codec rather than falling back to raw
+        codes = [takes.chunk_struct.unpack_from(reader.buffer, offset)[1] for _, _, offset in reader.chunks]
+        assert codes == [takes.compressions[compression]] * 3
+        read_values, confidence, timestamps = reader.read()
+        assert read_values.dtype == numpy.dtype(dtype)
+        numpy.testing.assert_array_equal(read_values, values.astype(dtype))
+        numpy.testing.assert_allclose(confidence, [0.9, 0.9, 0.9, 0.0, 0.9, 0.9, 0.9, 0.9, 0.9, 0.9], rtol=1e-6)
+        numpy.testing.assert_allclose(timestamps, numpy.arange(10) / 10.0)
+
+
+def test_compression_shrinks_the_file(tmp_path):
+    values = landmark_frames(64, landmarks=100)
+    raw = write_take(tmp_path / 'raw.mptake', values, chunk_frames=32)
+    packed = write_take(tmp_path / 'packed.mptake', values, chunk_frames=32, compression='zlib')
+    assert os.path.getsize(packed) < os.path.getsize(raw)
+
+
+def test_uncompressed_frames_are_views_of_the_file(tmp_path):
+    path = write_take(tmp_path / 'take.mptake', landmark_frames(10))
+    with takes.TakeReader(path) as reader:
+        values, _, _ = reader.frames(4, 7)
+        assert numpy.shares_memory(values, reader.buffer)
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+@pytest.mark.parametrize('start, stop', [(0, 10), (2, 3), (3, 5), (1, 9), (4, 8), (8, 20), (6, 6), (-3, 2)])
+def test_frames_slicing(tmp_path, compression, start, stop):
+    values = landmark_frames(10)
+    path = write_take(tmp_path / 'take.mptake', values, compression=compression)
+    with takes.TakeReader(path) as reader:
+        read_values, confidence, timestamps = reader.frames(start, stop)
+        expected = values[max(start, 0):stop]
+        assert read_values.shape == expected.shape
+        numpy.testing.assert_array_equal(read_values, expected)
+        assert len(confidence) == len(timestamps) == len(expected)
+        numpy.testing.assert_allclose(timestamps, numpy.arange(max(start, 0), min(stop, 10)) / 10.0)
+        numpy.testing.assert_array_equal(reader[-1], values[-1])
+        with pytest.raises(IndexError):
+            reader[10]
+
+
+@pytest.mark.parametrize('compression', [None, 'lzma'])
+def test_never_closed_take_is_read_from_its_chunks(tmp_path, compression):
+    values = landmark_frames(10)
+    path = str(tmp_path / 'crashed.mptake')
+    writer = takes.TakeWriter(path, values.shape[1:], chunk_frames=4, compression=compression)
+    writer.append(values)
+    writer.flush() # The 2 frames left over go out as a short chunk
+    writer.file.close() # A crash, so no index or trailer
+    with takes.TakeReader(path) as reader:
+        assert reader.frame_count == 10
+        numpy.testing.assert_array_equal(reader.read()[0], values)
+
+
+def test_torn_last_chunk_is_dropped(tmp_path):
+    values = landmark_frames(10)
+    path = write_take(tmp_path / 'take.mptake', values)
+    with takes.TakeReader(path) as reader:
+        last_chunk_offset = reader.chunks[-1][2]
+    # Cut the file off part way through the last chunk, which takes the index and trailer with it
+    with open(path, 'r+b') as take_file:
+        take_file.truncate(last_chunk_offset + takes.chunk_struct.size + 8)
+    with takes.TakeReader(path) as reader:
+        assert reader.frame_count == 8
+        numpy.testing.assert_array_equal(reader.read()[0], values[:8])
+
+
+def test_header_only_take_is_empty(tmp_path):
+    path = str(tmp_path / 'empty.mptake')
+    writer = takes.TakeWriter(path, (5, 4))
+    writer.file.close()
+    with takes.TakeReader(path) as reader:
+        assert reader.frame_count == 0
+        assert reader.read()[0].shape == (0, 5, 4)
+
+
+def test_not_a_take(tmp_path):
+    path = tmp_path / 'other.mptake'
+    path.write_bytes(b'\x00' * 128)
+    with pytest.raises(ValueError):
+        takes.TakeReader(str(path))
+
+
+def test_bone_sets_round_trip(tmp_path):
+    path = str(tmp_path / 'rig.mptake')
+    bone_names = ['spine', 'spine.001', 'face']
+    heads = numpy.arange(2 * 3 * 3, dtype=numpy.float32).reshape(2, 3, 3)
+    tails = heads + 0.5
+    takes.write_bone_sets(path, bone_names, heads, tails, compression='zlib')
+    names, last_heads, last_tails = takes.read_bone_set(path)
+    assert names == bone_names
+    numpy.testing.assert_array_equal(last_heads, heads[-1])
+    numpy.testing.assert_array_equal(last_tails, tails[-1])
+    _, first_heads, _ = takes.read_bone_set(path, 0)
+    numpy.testing.assert_array_equal(first_heads, heads[0])
+
+    landmark_path = write_take(tmp_path / 'landmarks.mptake', landmark_frames(4))
+    with pytest.raises(ValueError):
+        takes.read_bone_set(landmark_path)